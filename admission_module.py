@@ -0,0 +1,187 @@
+# admission_module.py
+# Kiểm soát tải cho server WebSocket: giới hạn số lời gọi Gemini/MongoDB đang chạy của cả tiến trình
+# với hàng chờ công bằng giữa các phiên, giới hạn tốc độ gửi lượt của từng client (token bucket),
+# và từ chối ngay kèm thời gian nên thử lại khi quá tải thay vì để yêu cầu chờ vô hạn.
+import asyncio
+import collections
+import contextlib
+import math
+import time
+
+import config
+
+
+class OverloadedError(RuntimeError):
+    """Không nhận thêm việc lúc này. retry_after: số giây client nên chờ trước khi gửi lại."""
+
+    def __init__(self, message, retry_after, reason):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+def retry_after_seconds(seconds):
+    """Làm tròn lên thành số giây nguyên (tối thiểu 1) để gửi cho client."""
+    return max(1, math.ceil(seconds))
+
+
+class TokenBucket:
+    """Cho phép trung bình `rate` lần mỗi giây, dồn tối đa `burst` lần."""
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._clock = clock
+        self._tokens = float(self.burst)
+        self._updated = clock()
+
+    def try_acquire(self, tokens=1):
+        """Lấy `tokens` nếu đủ và trả về 0; nếu không, trả về số giây cần chờ cho đủ (không lấy gì)."""
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return 0.0
+        return (tokens - self._tokens) / self.rate if self.rate > 0 else math.inf
+
+
+class FairLimiter:
+    """
+    Giới hạn số tác vụ chạy đồng thời (capacity) trên asyncio loop của tiến trình.
+    Khi hết chỗ, các phiên chờ được phục vụ xoay vòng (round-robin) nên một phiên gửi nhiều yêu cầu
+    không chiếm lượt của các phiên khác. Yêu cầu bị từ chối ngay (OverloadedError) khi đã có max_waiting yêu cầu chờ
+    hoặc thời gian chờ ước tính vượt max_wait; yêu cầu đã vào hàng chờ cũng không chờ quá max_wait.
+    """
+
+    def __init__(self, name, capacity, max_waiting, max_wait):
+        self.name = name
+        self.capacity = max(capacity, 1)
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self._in_flight = 0
+        self._queues = collections.OrderedDict() # phiên -> deque các Future đang chờ, theo thứ tự xoay vòng
+        self._waiting = 0
+        self._service_time = 1.0 # Thời gian giữ chỗ trung bình (EWMA, giây) để ước tính thời gian chờ
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    @property
+    def waiting(self):
+        return self._waiting
+
+    def has_capacity(self):
+        """Còn chỗ ngay (không phải xếp hàng) cho một tác vụ mới."""
+        return self._in_flight < self.capacity and not self._waiting
+
+    def estimated_wait(self):
+        """Thời gian chờ ước tính (giây) của một yêu cầu mới."""
+        if self.has_capacity():
+            return 0.0
+        return (self._waiting + 1) / self.capacity * self._service_time
+
+    def _reject(self, estimate):
+        self.rejected += 1
+        raise OverloadedError(
+            f"'{self.name}' is overloaded ({self._in_flight} running, {self._waiting} waiting).",
+            retry_after_seconds(estimate or self._service_time), self.name,
+        )
+
+    async def acquire(self, session):
+        if self.has_capacity():
+            self._in_flight += 1
+            self.admitted += 1
+            return
+        estimate = self.estimated_wait()
+        if self._waiting >= self.max_waiting or estimate > self.max_wait:
+            self._reject(estimate)
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(session, collections.deque()).append(future)
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled(): # Được cấp chỗ đúng lúc hết giờ
+                return
+            self._discard(session, future)
+            self.timed_out += 1
+            self._reject(self.estimated_wait())
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release() # Đã được cấp chỗ nhưng lượt bị hủy: trả lại cho người khác
+            else:
+                self._discard(session, future)
+            raise
+
+    def _discard(self, session, future):
+        queue = self._queues.get(session)
+        if queue is not None and future in queue:
+            queue.remove(future)
+            self._waiting -= 1
+            if not queue:
+                del self._queues[session]
+        future.cancel()
+
+    def release(self, held_for=None):
+        if held_for is not None:
+            self._service_time += 0.2 * (held_for - self._service_time)
+        self._in_flight -= 1
+        while self._in_flight < self.capacity and self._queues:
+            session, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+            self._waiting -= 1
+            if queue:
+                self._queues.move_to_end(session) # Phiên còn yêu cầu chờ xuống cuối vòng
+            else:
+                del self._queues[session]
+            if future.done():
+                continue
+            future.set_result(None)
+            self._in_flight += 1
+            self.admitted += 1
+
+    @contextlib.asynccontextmanager
+    async def slot(self, session):
+        """`async with limiter.slot(websocket):` giữ một chỗ trong suốt khối lệnh."""
+        await self.acquire(session)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def stats(self):
+        return {
+            "capacity": self.capacity,
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+def new_rate_limiter():
+    """Token bucket cho số lượt của một client, hoặc None nếu RATE_LIMIT_TURNS_PER_MINUTE = 0."""
+    if config.RATE_LIMIT_TURNS_PER_MINUTE <= 0:
+        return None
+    return TokenBucket(config.RATE_LIMIT_TURNS_PER_MINUTE / 60.0, config.RATE_LIMIT_BURST)
+
+
+# Giới hạn chung của tiến trình cho các lời gọi Gemini và tra cứu sản phẩm
+llm_limiter = FairLimiter(
+    "llm", config.LLM_MAX_CONCURRENCY, config.ADMISSION_MAX_WAITING, config.ADMISSION_MAX_WAIT_SECONDS
+)
+db_limiter = FairLimiter(
+    "db", config.DB_MAX_CONCURRENCY, config.ADMISSION_MAX_WAITING, config.ADMISSION_MAX_WAIT_SECONDS
+)
+
+
+def stats():
+    return {limiter.name: limiter.stats() for limiter in (llm_limiter, db_limiter)}
@@ -0,0 +1,184 @@
+# audio_module.py
+# Nhận âm thanh do client gửi lên qua WebSocket (frame nhị phân PCM16 hoặc Opus),
+# lưu vào ring buffer cấp phát sẵn cho mỗi phiên và phát hiện hết câu nói bằng VAD theo năng lượng.
+import math
+from array import array
+
+import config
+
+SAMPLE_WIDTH = 2 # PCM 16-bit
+
+
+class AudioFormatError(ValueError):
+    """Định dạng âm thanh client khai báo không được hỗ trợ."""
+
+
+class RingBuffer:
+    """
+    Bộ đệm vòng kích thước cố định (cấp phát một lần). Khi đầy, dữ liệu cũ nhất bị ghi đè.
+    Vị trí được tính theo tổng số byte đã ghi (offset tuyệt đối) để đọc lại một đoạn bất kỳ còn trong bộ đệm.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._buffer = bytearray(capacity)
+        self.total_written = 0
+
+    def write(self, data):
+        data = memoryview(data)
+        if len(data) >= self.capacity:
+            # Chỉ phần cuối còn nằm trong bộ đệm, nhưng offset vẫn tăng đúng bằng độ dài thật của dữ liệu
+            self.total_written += len(data) - self.capacity
+            data = data[-self.capacity:]
+        start = self.total_written % self.capacity
+        first = min(len(data), self.capacity - start)
+        self._buffer[start:start + first] = data[:first]
+        if first < len(data):
+            self._buffer[:len(data) - first] = data[first:]
+        self.total_written += len(data)
+
+    def read_since(self, offset):
+        """Trả về dữ liệu từ offset tuyệt đối đến hiện tại (bị cắt nếu phần đầu đã bị ghi đè)."""
+        offset = max(offset, self.total_written - self.capacity, 0)
+        length = self.total_written - offset
+        if length <= 0:
+            return b""
+        start = offset % self.capacity
+        end = start + length
+        if end <= self.capacity:
+            return bytes(self._buffer[start:end])
+        return bytes(self._buffer[start:]) + bytes(self._buffer[:end - self.capacity])
+
+
+def frame_rms(frame):
+    """Năng lượng RMS của một frame PCM16 little-endian."""
+    samples = array("h")
+    samples.frombytes(frame)
+    if not samples:
+        return 0.0
+    return math.sqrt(sum(s * s for s in samples) / len(samples))
+
+
+class EnergyVAD:
+    """
+    Phát hiện giọng nói theo năng lượng: bắt đầu câu nói sau `start_frames` frame liên tiếp vượt ngưỡng,
+    kết thúc khi im lặng liên tục `end_silence_ms`.
+    """
+
+    def __init__(self, sample_rate, frame_ms=None, threshold=None, start_frames=None, end_silence_ms=None):
+        self.frame_ms = frame_ms or config.AUDIO_VAD_FRAME_MS
+        self.frame_bytes = sample_rate * self.frame_ms // 1000 * SAMPLE_WIDTH
+        self.threshold = config.AUDIO_VAD_THRESHOLD if threshold is None else threshold
+        self.start_frames = start_frames or config.AUDIO_VAD_START_FRAMES
+        end_silence_ms = end_silence_ms or config.AUDIO_VAD_END_SILENCE_MS
+        self.end_frames = max(end_silence_ms // self.frame_ms, 1)
+        self.reset()
+
+    def reset(self):
+        self.in_speech = False
+        self._voiced_run = 0
+        self._silent_run = 0
+
+    def process(self, frame):
+        """Xử lý một frame; trả về "start", "end" hoặc None."""
+        voiced = frame_rms(frame) >= self.threshold
+        if not self.in_speech:
+            self._voiced_run = self._voiced_run + 1 if voiced else 0
+            if self._voiced_run >= self.start_frames:
+                self.in_speech = True
+                self._silent_run = 0
+                return "start"
+            return None
+        self._silent_run = 0 if voiced else self._silent_run + 1
+        if self._silent_run >= self.end_frames:
+            self.reset()
+            return "end"
+        return None
+
+
+class OpusDecoder:
+    """Giải mã gói Opus thành PCM16 (cần thư viện opuslib, không bắt buộc)."""
+
+    def __init__(self, sample_rate, channels=1):
+        try:
+            import opuslib
+        except ImportError:
+            raise AudioFormatError("Opus audio requires the 'opuslib' package on the server.")
+        self._decoder = opuslib.Decoder(sample_rate, channels)
+        self._frame_size = sample_rate * 60 // 1000 # Kích thước frame Opus lớn nhất (60 ms)
+
+    def decode(self, packet):
+        return self._decoder.decode(bytes(packet), self._frame_size)
+
+
+class AudioSession:
+    """
+    Trạng thái âm thanh của một client: bộ đệm vòng, VAD và phần frame chưa đủ độ dài.
+    feed() trả về PCM của một câu nói trọn vẹn khi VAD phát hiện người dùng đã nói xong.
+    """
+
+    def __init__(self, sample_rate=16000, encoding="pcm16", channels=1):
+        if sample_rate not in (8000, 16000, 24000, 48000):
+            raise AudioFormatError(f"Unsupported sample rate: {sample_rate}")
+        if channels != 1:
+            raise AudioFormatError("Only mono audio is supported.")
+        if encoding == "pcm16":
+            self._decoder = None
+        elif encoding == "opus":
+            self._decoder = OpusDecoder(sample_rate, channels)
+        else:
+            raise AudioFormatError(f"Unsupported audio encoding: {encoding}")
+        self.sample_rate = sample_rate
+        self.encoding = encoding
+        bytes_per_second = sample_rate * SAMPLE_WIDTH
+        self.ring = RingBuffer(int(bytes_per_second * config.AUDIO_MAX_UTTERANCE_SECONDS))
+        self.vad = EnergyVAD(sample_rate)
+        self._preroll_bytes = bytes_per_second * config.AUDIO_PREROLL_MS // 1000
+        self._pending = bytearray() # Phần dư chưa đủ một frame VAD
+        self._utterance_start = None # Offset tuyệt đối trong ring buffer của câu nói hiện tại
+
+    @property
+    def in_speech(self):
+        return self._utterance_start is not None
+
+    def feed(self, data):
+        """Nhận một frame nhị phân từ client. Trả về bytes PCM của câu nói khi kết thúc, ngược lại None."""
+        pcm = self._decoder.decode(data) if self._decoder is not None else data
+        self.ring.write(pcm)
+        self._pending.extend(pcm)
+        frame_bytes = self.vad.frame_bytes
+        utterance = None
+        consumed = 0
+        while len(self._pending) - consumed >= frame_bytes:
+            frame = bytes(self._pending[consumed:consumed + frame_bytes])
+            consumed += frame_bytes
+            state = self.vad.process(frame)
+            if state == "start":
+                # Giữ lại một đoạn ngắn trước khi VAD kích hoạt để không mất âm đầu
+                position = self.ring.total_written - (len(self._pending) - consumed)
+                self._utterance_start = position - frame_bytes * self.vad.start_frames - self._preroll_bytes
+            elif state == "end" and utterance is None:
+                utterance = self._take_utterance()
+        del self._pending[:consumed]
+
+        # Câu nói quá dài: cắt tại độ dài tối đa của ring buffer
+        if utterance is None and self.in_speech and self.ring.total_written - self._utterance_start >= self.ring.capacity:
+            self.vad.reset()
+            utterance = self._take_utterance()
+        return utterance
+
+    def finish(self):
+        """Client báo đã dừng gửi âm thanh: trả về câu nói đang dở (nếu có)."""
+        utterance = self._take_utterance() if self.in_speech else None
+        self.vad.reset()
+        self._pending.clear()
+        return utterance
+
+    def _take_utterance(self):
+        pcm = self.ring.read_since(self._utterance_start)
+        self._utterance_start = None
+        return pcm
+
+    @property
+    def duration_seconds(self):
+        return self.ring.total_written / (self.sample_rate * SAMPLE_WIDTH)
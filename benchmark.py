@@ -0,0 +1,425 @@
+# benchmark.py
+# Đo tải server WebSocket hoàn toàn cục bộ: MongoDB, Gemini và STT được thay bằng bản giả (fake_module),
+# N client ảo gửi câu hỏi mua sắm tiếng Việt qua server.handle_client.
+# Kết quả (thông lượng, p50/p95/p99 theo từng giai đoạn) được in ra và lưu thành file JSON để so sánh giữa các lần chạy.
+#
+# Ví dụ:
+#   python benchmark.py --products 100000 --clients 50 --turns 20 --search-backend index --stream
+#   python benchmark.py --compare benchmark_results/benchmark-20240101-120000.json
+import argparse
+import asyncio
+import collections
+import contextlib
+import datetime
+import functools
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+import config
+import protocol_module
+
+STAGES = ("turn", "first_delta", "stt", "db", "llm", "llm_first_token")
+
+
+def percentile(sorted_values, fraction):
+    """Phân vị theo thứ hạng gần nhất trên danh sách đã sắp xếp."""
+    if not sorted_values:
+        return None
+    rank = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class StageRecorder:
+    """Ghi thời gian (giây) theo giai đoạn, an toàn khi gọi từ nhiều thread."""
+
+    def __init__(self):
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock:
+            self._samples.setdefault(stage, []).append(seconds)
+
+    def count(self, stage):
+        return len(self._samples.get(stage, ()))
+
+    def summary(self):
+        result = {}
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self._samples.items()}
+        for stage, values in samples.items():
+            result[stage] = {
+                "count": len(values),
+                "mean_ms": round(sum(values) / len(values) * 1000, 2),
+                "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+                "max_ms": round(values[-1] * 1000, 2),
+            }
+        return result
+
+
+def _timed(recorder, stage, fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            recorder.record(stage, time.perf_counter() - start)
+    return wrapper
+
+
+def _timed_async(recorder, stage, fn):
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            recorder.record(stage, time.perf_counter() - start)
+    return wrapper
+
+
+def _timed_stream(recorder, fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        first = True
+        try:
+            for item in fn(*args, **kwargs):
+                if first and item[0] == "delta":
+                    recorder.record("llm_first_token", time.perf_counter() - start)
+                    first = False
+                yield item
+        finally:
+            recorder.record("llm", time.perf_counter() - start)
+    return wrapper
+
+
+def install(args, recorder):
+    """Thay dịch vụ thật bằng bản giả và bọc các giai đoạn để đo thời gian. Trả về module server."""
+    config.SEARCH_BACKEND = args.search_backend
+    config.SEARCH_INDEX_REFRESH_SECONDS = 0 # Không quét lại cả danh mục giả trong lúc đo
+    config.STT_BACKEND = "fake"
+    config.MONGO_DRIVER = args.mongo_driver
+    config.RATE_LIMIT_TURNS_PER_MINUTE = args.rate_limit # Client ảo gửi liên tục, mặc định không giới hạn
+
+    import fake_module
+    import db_module
+    import llm_module
+    import stt_module
+
+    started = time.perf_counter()
+    products = fake_module.generate_catalog(args.products, seed=args.seed)
+    if args.search_backend == "tokens":
+        import catalog_module # Tính sẵn search_tokens/context như khi nhập danh mục thật
+        products = map(catalog_module.prepare_product, products)
+    db_module.collection = fake_module.FakeCollection(products, latency=args.db_latency)
+    print(f"Seeded {args.products} synthetic products in {time.perf_counter() - started:.1f}s.")
+    if args.mongo_driver == "async":
+        db_module.async_collection = fake_module.AsyncFakeCollection(db_module.collection)
+    llm_module.model = fake_module.FakeModel(
+        latency=args.llm_latency, token_rate=args.token_rate, output_tokens=args.output_tokens, seed=args.seed
+    )
+    stt_module.register_recognizer("fake", fake_module.make_fake_recognizer(
+        fake_module.generate_queries(200, seed=args.seed), base_latency=args.stt_latency, seed=args.seed
+    ))
+
+    db_module.search_knowledge_base = _timed(recorder, "db", db_module.search_knowledge_base)
+    db_module._search_async = _timed_async(recorder, "db", db_module._search_async)
+    llm_module.get_chatbot_response = _timed(recorder, "llm", llm_module.get_chatbot_response)
+    llm_module.stream_chatbot_response = _timed_stream(recorder, llm_module.stream_chatbot_response)
+    stt_module.recognize_pcm = _timed(recorder, "stt", stt_module.recognize_pcm)
+
+    import server
+    return server
+
+
+class BenchConnection:
+    """WebSocket giả nối trực tiếp một client ảo với server.handle_client qua hai hàng đợi."""
+
+    def __init__(self, client_id):
+        self.remote_address = ("bench", client_id)
+        self._to_server = asyncio.Queue()
+        self._to_client = asyncio.Queue()
+        self._received = collections.deque() # Sự kiện đã giải mã từ frame v2 (nhiều sự kiện mỗi frame)
+        self.closed = False
+        self.frames = 0
+        self.bytes = 0
+
+    # Phía server
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        message = await self._to_server.get()
+        if message is None:
+            raise StopAsyncIteration
+        return message
+
+    async def send(self, message, text=None):
+        self.frames += 1
+        self.bytes += len(message)
+        if text and isinstance(message, bytes):
+            message = message.decode("utf-8") # Text frame gửi dạng bytes UTF-8
+        self._to_client.put_nowait(message)
+
+    async def close(self, code=1000, reason=""):
+        self.closed = True
+        self._to_server.put_nowait(None)
+        self._to_client.put_nowait(json.dumps({"event": "closed", "code": code, "reason": reason}))
+
+    # Phía client
+    def client_send(self, message):
+        self._to_server.put_nowait(message if isinstance(message, bytes) else json.dumps(message))
+
+    async def client_recv(self, timeout):
+        if not self._received:
+            self._received.extend(protocol_module.decode_frame(await asyncio.wait_for(self._to_client.get(), timeout)))
+        return self._received.popleft()
+
+    def client_close(self):
+        self._to_server.put_nowait(None)
+
+
+ANSWER_EVENTS = ("chat_message", "chat_done", "error", "busy", "closed")
+
+
+async def _await_answer(connection, timeout, started, recorder):
+    """Đọc sự kiện đến khi có câu trả lời cuối; ghi thời gian tới chat_delta đầu tiên."""
+    first_delta = True
+    while True:
+        data = await connection.client_recv(timeout)
+        event = data.get("event")
+        if event == "chat_delta" and first_delta:
+            recorder.record("first_delta", time.perf_counter() - started)
+            first_delta = False
+        if event == "chat_message" and data.get("role") != "chatbot":
+            continue # Văn bản STT của người dùng, chưa phải câu trả lời
+        if event in ANSWER_EVENTS:
+            return data
+
+
+async def run_client(server, client_id, queries, args, recorder, counters, utterance):
+    rng = random.Random(args.seed + client_id)
+    connection = BenchConnection(client_id)
+    handler = asyncio.create_task(server.handle_client(connection))
+    try:
+        connection.client_send({
+            "event": "hello", "session_id": f"bench-{uuid.uuid4().hex}", "protocol": args.protocol, "encoding": args.encoding,
+        })
+        await connection.client_recv(args.timeout)
+        connection.client_send({"event": "set_options", "llm_cache": not args.no_llm_cache, "tts": False})
+        await connection.client_recv(args.timeout)
+
+        for query in queries:
+            voice = rng.random() < args.voice_ratio
+            if voice:
+                connection.client_send({"event": "audio_start", "sample_rate": 16000, "encoding": "pcm16"})
+                frame_bytes = 16000 * 2 * 20 // 1000
+                for offset in range(0, len(utterance), frame_bytes):
+                    connection.client_send(utterance[offset:offset + frame_bytes])
+                started = time.perf_counter() # Người dùng vừa nói xong
+            else:
+                if args.typing: # Người dùng gõ từng từ: gửi nội dung đang gõ trước tin nhắn cuối
+                    words = query.split()
+                    for end in range(1, len(words) + 1):
+                        connection.client_send({"event": "partial_text", "text": " ".join(words[:end])})
+                        await asyncio.sleep(args.typing)
+                started = time.perf_counter() # Người dùng vừa bấm gửi
+                connection.client_send({"event": "text_message", "text": query, "stream": args.stream})
+            try:
+                answer = await _await_answer(connection, args.timeout, started, recorder)
+            except asyncio.TimeoutError:
+                counters["timeouts"] += 1
+                continue
+            finally:
+                if voice:
+                    connection.client_send({"event": "audio_end"})
+            if answer.get("event") == "busy": # Bị kiểm soát tải từ chối: không tính là lỗi
+                counters["busy"] += 1
+                continue
+            if answer.get("event") in ("error", "closed"):
+                counters["errors"] += 1
+                if answer.get("event") == "closed":
+                    return
+                continue
+            recorder.record("turn", time.perf_counter() - started)
+            counters["turns"] += 1
+            if args.think_time:
+                await asyncio.sleep(rng.uniform(0, 2 * args.think_time))
+    finally:
+        connection.client_close()
+        await asyncio.wait_for(handler, args.timeout)
+        counters["frames"] += connection.frames
+        counters["bytes"] += connection.bytes
+
+
+async def run_benchmark(server, args, recorder):
+    import executor_module
+    import fake_module
+    import db_module
+    import llm_module
+    import journal_module
+    import metrics_module
+
+    await executor_module.run("db", db_module.load_query_vocabulary)
+    journal = journal_module.journal
+    if journal is not None: # Nhật ký hội thoại ghi vào collection giả với cùng độ trễ như MongoDB giả
+        journal.collection = fake_module.FakeCollection(name=config.JOURNAL_COLLECTION, latency=args.db_latency)
+        await journal.start()
+    if args.search_backend == "index":
+        started = time.perf_counter()
+        await executor_module.run("db", db_module.get_search_index)
+        print(f"Built search index in {time.perf_counter() - started:.1f}s.")
+
+    queries = fake_module.generate_queries(args.clients * args.turns, seed=args.seed)
+    utterance = fake_module.synthetic_utterance()
+    counters = {"turns": 0, "errors": 0, "timeouts": 0, "busy": 0, "frames": 0, "bytes": 0}
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        run_client(server, client_id, queries[client_id * args.turns:(client_id + 1) * args.turns],
+                   args, recorder, counters, utterance)
+        for client_id in range(args.clients)
+    ))
+    duration = time.perf_counter() - started
+    if journal is not None:
+        await journal.close()
+    return {
+        "duration_seconds": round(duration, 3),
+        "turns": counters["turns"],
+        "errors": counters["errors"],
+        "timeouts": counters["timeouts"],
+        "busy": counters["busy"],
+        "throughput_turns_per_second": round(counters["turns"] / duration, 2) if duration else None,
+        "stages": recorder.summary(),
+        "llm_cache": llm_module.cache_stats(),
+        "fake_model_calls": llm_module.model.calls,
+        "executors": executor_module.stats(),
+        "ws": {
+            "protocol": args.protocol,
+            "encoding": args.encoding,
+            "frames": counters["frames"],
+            "bytes": counters["bytes"],
+            "bytes_per_turn": round(counters["bytes"] / counters["turns"]) if counters["turns"] else None,
+        },
+        "journal": journal.stats() if journal is not None else None,
+        "prefetch": {
+            result: metrics_module.PREFETCH.value(result=result) for result in ("started", "hit", "miss", "skipped")
+        } if args.typing else None,
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_report(results, baseline=None):
+    print(f"\nTurns: {results['turns']}  errors: {results['errors']}  timeouts: {results['timeouts']}  "
+          f"busy: {results.get('busy', 0)}  "
+          f"duration: {results['duration_seconds']}s  throughput: {results['throughput_turns_per_second']} turns/s")
+    if baseline:
+        print(f"Baseline throughput: {baseline.get('throughput_turns_per_second')} turns/s "
+              f"({baseline.get('git_revision')}, {baseline.get('timestamp')})")
+    ws = results.get("ws")
+    if ws:
+        print(f"Protocol v{ws['protocol']} ({ws['encoding']}): {ws['frames']} frames, {ws['bytes']} bytes, "
+              f"{ws['bytes_per_turn']} bytes/turn (before permessage-deflate)")
+    prefetch = results.get("prefetch")
+    if prefetch:
+        print(f"Prefetch: {prefetch['started']} started, {prefetch['hit']} hit, {prefetch['miss']} miss, "
+              f"{prefetch['skipped']} skipped (no spare DB capacity)")
+    print(f"{'stage':<16}{'count':>8}{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}{'max ms':>12}")
+    for stage in STAGES:
+        stats = results["stages"].get(stage)
+        if not stats:
+            continue
+        line = f"{stage:<16}{stats['count']:>8}{stats['p50_ms']:>12}{stats['p95_ms']:>12}{stats['p99_ms']:>12}{stats['max_ms']:>12}"
+        base = (baseline or {}).get("stages", {}).get(stage)
+        if base:
+            line += f"   (p50 {stats['p50_ms'] - base['p50_ms']:+.1f}, p95 {stats['p95_ms'] - base['p95_ms']:+.1f})"
+        print(line)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test for the WebSocket chatbot server")
+    parser.add_argument("--products", type=int, default=10000, help="Số sản phẩm tổng hợp (10k - 1M)")
+    parser.add_argument("--clients", type=int, default=20, help="Số client đồng thời")
+    parser.add_argument("--turns", type=int, default=10, help="Số câu hỏi mỗi client")
+    parser.add_argument("--search-backend", choices=("mongo", "index", "tokens"), default=config.SEARCH_BACKEND)
+    parser.add_argument("--mongo-driver", choices=("sync", "async"), default=config.MONGO_DRIVER,
+                        help="Tra cứu MongoDB giả bằng pymongo trong thread pool hoặc bằng driver async")
+    parser.add_argument("--stream", action="store_true", help="Yêu cầu trả lời dạng streaming (chat_delta)")
+    parser.add_argument("--protocol", type=int, choices=(1, 2), default=1, help="Phiên bản giao thức WebSocket yêu cầu")
+    parser.add_argument("--encoding", choices=("json", "msgpack"), default="json", help="Encoding của protocol v2")
+    parser.add_argument("--voice-ratio", type=float, default=0.0, help="Tỉ lệ lượt gửi bằng âm thanh (0-1)")
+    parser.add_argument("--no-llm-cache", action="store_true", help="Tắt cache câu trả lời Gemini cho các client")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Thời gian tới token đầu của Gemini giả (giây)")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="Tốc độ sinh token của Gemini giả (token/giây)")
+    parser.add_argument("--output-tokens", type=int, default=60, help="Số token mỗi câu trả lời giả")
+    parser.add_argument("--db-latency", type=float, default=0.002, help="Độ trễ mạng giả lập mỗi lệnh MongoDB (giây)")
+    parser.add_argument("--stt-latency", type=float, default=0.3, help="Độ trễ cơ bản của STT giả (giây)")
+    parser.add_argument("--rate-limit", type=float, default=0.0,
+                        help="Giới hạn lượt/phút của mỗi client (RATE_LIMIT_TURNS_PER_MINUTE), mặc định tắt")
+    parser.add_argument("--typing", type=float, default=0.0,
+                        help="Gửi partial_text theo từng từ, cách nhau số giây này, trước mỗi text_message (0 để tắt)")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Thời gian nghỉ trung bình giữa hai câu hỏi (giây)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Thời gian chờ tối đa một câu trả lời (giây)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="benchmark_results", help="Thư mục hoặc file JSON lưu kết quả")
+    parser.add_argument("--compare", help="File kết quả cũ để so sánh")
+    parser.add_argument("--verbose", action="store_true", help="Giữ log/print của server (mặc định bị tắt khi đo)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fp:
+            baseline = json.load(fp)
+
+    recorder = StageRecorder()
+    server = install(args, recorder)
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    with contextlib.ExitStack() as stack:
+        if not args.verbose: # print() trong db_module/llm_module làm sai lệch kết quả khi chạy nhiều client
+            stack.enter_context(contextlib.redirect_stdout(open(os.devnull, "w", encoding="utf-8")))
+        measured = asyncio.run(run_benchmark(server, args, recorder))
+
+    results = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "git_revision": _git_revision(),
+        "python": sys.version.split()[0],
+        "settings": vars(args),
+        **measured,
+    }
+    print_report(results, baseline)
+
+    output = args.output
+    if not output.endswith(".json"):
+        os.makedirs(output, exist_ok=True)
+        output = os.path.join(output, f"benchmark-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(output, "w", encoding="utf-8") as fp:
+        json.dump(results, fp, ensure_ascii=False, indent=2, default=str)
+    print(f"\nResults saved to {output}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# cache_module.py
+# Bộ nhớ đệm LRU có thời hạn (TTL), an toàn khi dùng từ nhiều thread.
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+MISSING = object() # Giá trị trả về của get() khi không có trong cache
+
+
+class TTLCache:
+    """
+    Cache LRU giới hạn số phần tử, mỗi phần tử hết hạn sau `ttl` giây (ttl=None: không hết hạn).
+    Đếm số lần trúng (hits), trượt (misses), bị loại do đầy (evictions) và do hết hạn (expirations).
+    """
+
+    def __init__(self, maxsize, ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._data = OrderedDict() # key -> (hạn dùng, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                expires_at, value = item
+                if expires_at is None or expires_at > self._clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires_at = None if self.ttl is None else self._clock() + self.ttl
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+class SingleFlight:
+    """
+    Gộp các lời gọi đồng thời có cùng khóa: chỉ lời gọi đầu tiên thực sự chạy `fn`,
+    các lời gọi khác chờ và nhận chung kết quả (hoặc exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {} # key -> Future của lời gọi đang chạy
+        self.shared = 0 # Số lời gọi đã dùng chung kết quả thay vì tự chạy
+
+    def do(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            else:
+                self.shared += 1
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
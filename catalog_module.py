@@ -0,0 +1,215 @@
+# catalog_module.py
+# Nhập/làm mới danh mục sản phẩm vào MongoDB từ file CSV hoặc JSONL bằng bulk_write theo lô.
+# Mỗi sản phẩm được tính sẵn các trường phục vụ tra cứu để lúc trả lời khách không phải xử lý văn bản thô:
+#   search_tokens   - token đã bỏ dấu của tên, thương hiệu, danh mục, từ khóa, mô tả (index multikey, so khớp chính xác)
+#   context         - chuỗi ngữ cảnh dựng sẵn (kết quả của db_module.format_product_info)
+#   content_version - mã băm nội dung; sản phẩm không đổi thì không bị ghi lại ở lần nhập sau
+#
+# Ví dụ:
+#   python catalog_module.py products.jsonl
+#   python catalog_module.py products.csv --batch-size 1000 --key ten
+import argparse
+import csv
+import datetime
+import hashlib
+import json
+import os
+import sys
+import time
+
+from pymongo import UpdateOne
+
+import config
+import db_module
+import search_module
+
+SEARCH_TOKENS_FIELD = db_module.SEARCH_TOKENS_FIELD
+CONTEXT_FIELD = db_module.CONTEXT_FIELD
+VERSION_FIELD = "content_version"
+DERIVED_FIELDS = (SEARCH_TOKENS_FIELD, CONTEXT_FIELD, VERSION_FIELD)
+
+# Tăng khi format_product_info hoặc cách tách token thay đổi, để lần nhập sau ghi lại toàn bộ trường tính sẵn
+DERIVED_FORMAT_VERSION = 1
+
+# (trường, tên index) được tạo sau khi nhập; gia dùng cho lọc theo khoảng giá, updated_at cho làm mới chỉ mục BM25
+INDEXES = (
+    (SEARCH_TOKENS_FIELD, "catalog_search_tokens"),
+    ("danh_muc", "catalog_danh_muc"),
+    ("thuong_hieu", "catalog_thuong_hieu"),
+    ("gia", "catalog_gia"),
+)
+
+CSV_LIST_SEPARATOR = "|" # Phân cách các phần tử của cột keywords trong CSV
+
+
+def search_tokens(doc):
+    """Tập token (đã bỏ dấu, chữ thường) của các trường được tìm kiếm, theo thứ tự ổn định."""
+    tokens = set()
+    for field in search_module.FIELD_WEIGHTS:
+        tokens.update(search_module.tokenize(doc.get(field)))
+    return sorted(tokens)
+
+
+def content_version(doc):
+    """Mã băm của nội dung gốc (bỏ _id, updated_at và các trường tính sẵn)."""
+    source = {
+        key: value for key, value in doc.items()
+        if key not in DERIVED_FIELDS and key not in ("_id", config.SEARCH_UPDATED_AT_FIELD)
+    }
+    payload = json.dumps([DERIVED_FORMAT_VERSION, source], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def prepare_product(doc):
+    """Trả về bản sao của sản phẩm kèm search_tokens, context và content_version."""
+    product = {key: value for key, value in doc.items() if key not in DERIVED_FIELDS and key != "_id"}
+    product[SEARCH_TOKENS_FIELD] = search_tokens(product)
+    product[CONTEXT_FIELD] = db_module.format_product_info(product)
+    product[VERSION_FIELD] = content_version(product)
+    return product
+
+
+def _parse_price(value):
+    if isinstance(value, (int, float)) or value in (None, ""):
+        return value
+    text = str(value).strip().replace(",", "").replace(" ", "")
+    try:
+        number = float(text)
+    except ValueError:
+        return value # Giữ nguyên giá dạng chữ ("Liên hệ"...), format_product_info vẫn hiển thị được
+    return int(number) if number.is_integer() else number
+
+
+def _clean_row(row):
+    """Chuẩn hóa một dòng CSV: bỏ ô trống, đổi giá sang số, tách danh sách từ khóa."""
+    doc = {}
+    for key, value in row.items():
+        if key is None:
+            continue # Dòng có nhiều ô hơn tiêu đề
+        key = key.strip()
+        value = value.strip() if isinstance(value, str) else value
+        if value in (None, ""):
+            continue
+        if key == "keywords":
+            value = [item.strip() for item in value.split(CSV_LIST_SEPARATOR) if item.strip()]
+        doc[key] = value
+    if "gia" in doc:
+        doc["gia"] = _parse_price(doc["gia"])
+    return doc
+
+
+def read_products(path, file_format=None):
+    """Đọc lần lượt từng sản phẩm từ file CSV (có dòng tiêu đề) hoặc JSONL, không nạp cả file vào bộ nhớ."""
+    file_format = file_format or ("csv" if path.lower().endswith(".csv") else "jsonl")
+    with open(path, encoding="utf-8-sig", newline="") as fp:
+        if file_format == "csv":
+            for row in csv.DictReader(fp):
+                yield _clean_row(row)
+            return
+        for line_number, line in enumerate(fp, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                doc = json.loads(line)
+            except ValueError as e:
+                print(f"Bỏ qua dòng {line_number}: JSON không hợp lệ ({e})")
+                continue
+            if isinstance(doc, dict):
+                if "gia" in doc:
+                    doc["gia"] = _parse_price(doc["gia"])
+                yield doc
+
+
+def _batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def ensure_indexes(collection, key_field="ten"):
+    """Tạo các index dùng khi tra cứu (bỏ qua nếu đã có)."""
+    names = [collection.create_index(field, name=name) for field, name in INDEXES]
+    names.append(collection.create_index(key_field, name=f"catalog_key_{key_field}"))
+    names.append(collection.create_index(config.SEARCH_UPDATED_AT_FIELD, name="catalog_updated_at"))
+    return names
+
+
+def import_products(collection, products, key_field="ten", batch_size=500):
+    """
+    Ghi các sản phẩm vào collection theo lô (upsert theo key_field). Sản phẩm có content_version không đổi được bỏ qua,
+    nên chạy lại với cùng file gần như không ghi gì và updated_at chỉ thay đổi với sản phẩm thật sự đổi.
+    Trả về số liệu {read, inserted, updated, unchanged, skipped}.
+    """
+    stats = {"read": 0, "inserted": 0, "updated": 0, "unchanged": 0, "skipped": 0}
+    for batch in _batches(products, batch_size):
+        prepared = {}
+        for doc in batch:
+            stats["read"] += 1
+            key = doc.get(key_field)
+            if key in (None, ""):
+                stats["skipped"] += 1
+                continue
+            prepared[key] = prepare_product(doc) # Trùng khóa trong cùng lô: giữ bản sau cùng
+        if not prepared:
+            continue
+
+        existing = {
+            doc.get(key_field): doc.get(VERSION_FIELD)
+            for doc in db_module.with_retries(lambda: list(collection.find(
+                {key_field: {"$in": list(prepared)}}, {key_field: 1, VERSION_FIELD: 1, "_id": 0}
+            )))
+        }
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) # pymongo trả về datetime naive (UTC)
+        operations = []
+        for key, product in prepared.items():
+            if key in existing and existing[key] == product[VERSION_FIELD]:
+                stats["unchanged"] += 1
+                continue
+            product[config.SEARCH_UPDATED_AT_FIELD] = now
+            operations.append(UpdateOne({key_field: key}, {"$set": product}, upsert=True))
+            stats["updated" if key in existing else "inserted"] += 1
+        if operations:
+            # Upsert theo khóa nên thử lại cả lô khi lỗi mạng vẫn an toàn
+            db_module.with_retries(lambda: collection.bulk_write(operations, ordered=False))
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import or refresh the product catalog from CSV/JSONL")
+    parser.add_argument("path", help="File CSV (có dòng tiêu đề) hoặc JSONL, mỗi dòng một sản phẩm")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="Mặc định đoán theo phần mở rộng của file")
+    parser.add_argument("--key", default="ten", help="Trường định danh sản phẩm dùng để upsert (mặc định: ten)")
+    parser.add_argument("--batch-size", type=int, default=500, help="Số sản phẩm mỗi lệnh bulk_write")
+    parser.add_argument("--skip-indexes", action="store_true", help="Không tạo index sau khi nhập")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.path):
+        print(f"Không tìm thấy file: {args.path}")
+        return 1
+    collection = db_module.connect()
+    if collection is None:
+        return 1
+
+    started = time.perf_counter()
+    stats = import_products(collection, read_products(args.path, args.format), key_field=args.key,
+                            batch_size=max(args.batch_size, 1))
+    print(f"Đã đọc {stats['read']} sản phẩm trong {time.perf_counter() - started:.1f}s: "
+          f"{stats['inserted']} mới, {stats['updated']} cập nhật, {stats['unchanged']} không đổi, "
+          f"{stats['skipped']} bỏ qua (thiếu '{args.key}').")
+    if not args.skip_indexes:
+        print(f"Index: {', '.join(ensure_indexes(collection, args.key))}")
+    if stats["inserted"] or stats["updated"]:
+        # Phiên bản danh mục trong MongoDB: các server đang chạy bỏ cache tra cứu ở lần đọc lại tiếp theo
+        # (CATALOG_VERSION_POLL_SECONDS)
+        print(f"Phiên bản danh mục: {db_module.bump_catalog_version()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
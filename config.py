@@ -11,5 +11,181 @@ MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/") # Thay bằ
 DB_NAME = "shopdb"
 COLLECTION_NAME = "products"
 
+# Kết nối MongoDB: "sync" (pymongo trong thread pool "db") hoặc "async" (AsyncMongoClient của pymongo >= 4.10
+# hoặc Motor, truy vấn chạy thẳng trên asyncio loop; tự quay về "sync" nếu chưa cài)
+MONGO_DRIVER = os.getenv("MONGO_DRIVER", "sync")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "2")) # Số kết nối luôn giữ sẵn
+MONGO_MAX_IDLE_MS = int(os.getenv("MONGO_MAX_IDLE_MS", "60000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "3000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "3000"))
+# Thời gian tối đa phía server cho một truy vấn tìm sản phẩm (maxTimeMS, 0 để không giới hạn)
+MONGO_QUERY_TIMEOUT_MS = int(os.getenv("MONGO_QUERY_TIMEOUT_MS", "1500"))
+# Số lần thử lại khi lỗi mạng tạm thời và độ trễ cơ bản (giây, tăng gấp đôi mỗi lần)
+MONGO_RETRIES = int(os.getenv("MONGO_RETRIES", "2"))
+MONGO_RETRY_BACKOFF = float(os.getenv("MONGO_RETRY_BACKOFF", "0.1"))
+# Khi chưa kết nối được MongoDB: khoảng chờ giữa hai lần thử kết nối lại (giây, tăng gấp đôi tới mức tối đa);
+# trong lúc chờ, tra cứu trả về ngay không có ngữ cảnh sản phẩm
+MONGO_RECONNECT_MIN_SECONDS = float(os.getenv("MONGO_RECONNECT_MIN_SECONDS", "1"))
+MONGO_RECONNECT_MAX_SECONDS = float(os.getenv("MONGO_RECONNECT_MAX_SECONDS", "30"))
+
 # Cấu hình khác (nếu cần)
-LANGUAGE_CODE = "vi-VN"
\ No newline at end of file
+LANGUAGE_CODE = "vi-VN"
+
+# Thread pool cho các tác vụ đồng bộ (pymongo, Gemini, STT) để không chặn asyncio loop
+# Mỗi loại công việc có pool riêng: số worker và số tác vụ tối đa được phép chờ
+DB_WORKERS = int(os.getenv("DB_WORKERS", "8"))
+DB_MAX_QUEUE = int(os.getenv("DB_MAX_QUEUE", "64"))
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "16"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+STT_WORKERS = int(os.getenv("STT_WORKERS", "2"))
+STT_MAX_QUEUE = int(os.getenv("STT_MAX_QUEUE", "8"))
+EXECUTOR_STATS_INTERVAL = float(os.getenv("EXECUTOR_STATS_INTERVAL", "30")) # Giây, 0 để tắt
+
+# Kiểm soát tải của mỗi tiến trình: số kết nối tối đa, số lời gọi Gemini/tra cứu sản phẩm chạy đồng thời,
+# số yêu cầu được chờ và thời gian chờ tối đa (giây) trước khi trả "busy" cho client
+MAX_CONNECTIONS = int(os.getenv("MAX_CONNECTIONS", "500"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", str(LLM_WORKERS)))
+DB_MAX_CONCURRENCY = int(os.getenv("DB_MAX_CONCURRENCY", str(DB_WORKERS)))
+ADMISSION_MAX_WAITING = int(os.getenv("ADMISSION_MAX_WAITING", "64"))
+ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "10"))
+# Số lượt mỗi client được gửi mỗi phút (0 để tắt) và số lượt được gửi dồn một lúc
+RATE_LIMIT_TURNS_PER_MINUTE = float(os.getenv("RATE_LIMIT_TURNS_PER_MINUTE", "30"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "5"))
+# Thời gian gợi ý client chờ (giây) khi bị từ chối vì hết kết nối hoặc thread pool đầy
+BUSY_RETRY_AFTER_SECONDS = float(os.getenv("BUSY_RETRY_AFTER_SECONDS", "5"))
+
+# Giao thức WebSocket (protocol_module): nén permessage-deflate ("deflate" hoặc "none") với số bit cửa sổ nén (8-15),
+# mức nén và memLevel (1-9) của zlib; với protocol v2, thời gian gộp các sự kiện nhỏ (ms) và số sự kiện tối đa mỗi frame
+WS_COMPRESSION = os.getenv("WS_COMPRESSION", "deflate")
+WS_DEFLATE_WINDOW_BITS = int(os.getenv("WS_DEFLATE_WINDOW_BITS", "12"))
+WS_DEFLATE_LEVEL = int(os.getenv("WS_DEFLATE_LEVEL", "6"))
+WS_DEFLATE_MEM_LEVEL = int(os.getenv("WS_DEFLATE_MEM_LEVEL", "5"))
+PROTOCOL_FLUSH_MS = float(os.getenv("PROTOCOL_FLUSH_MS", "15"))
+PROTOCOL_MAX_BATCH_EVENTS = int(os.getenv("PROTOCOL_MAX_BATCH_EVENTS", "32"))
+
+# Gửi câu trả lời dạng streaming (chat_delta + chat_done) khi client không chỉ định
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "false").lower() in ("1", "true", "yes")
+
+# Công cụ tìm kiếm sản phẩm: "mongo" (truy vấn regex trực tiếp), "index" (chỉ mục BM25 trong bộ nhớ)
+# hoặc "tokens" (so khớp token trên trường search_tokens có index, cần nhập danh mục bằng catalog_module.py)
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "mongo")
+SEARCH_INDEX_REFRESH_SECONDS = float(os.getenv("SEARCH_INDEX_REFRESH_SECONDS", "30"))
+SEARCH_UPDATED_AT_FIELD = os.getenv("SEARCH_UPDATED_AT_FIELD", "updated_at")
+
+# Tra cứu trước theo sự kiện "typing"/"partial_text" (nội dung đang gõ, giả thuyết STT tạm thời): bật/tắt,
+# thời gian chờ không có nội dung mới trước khi tra cứu (ms), thời gian giữ kết quả (giây) và độ dài tối đa được phân tích
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() in ("1", "true", "yes")
+PREFETCH_DEBOUNCE_MS = float(os.getenv("PREFETCH_DEBOUNCE_MS", "150"))
+PREFETCH_TTL_SECONDS = float(os.getenv("PREFETCH_TTL_SECONDS", "10"))
+PREFETCH_MAX_CHARS = int(os.getenv("PREFETCH_MAX_CHARS", "500"))
+
+# Cache kết quả tra cứu sản phẩm (số câu hỏi tối đa, thời gian sống tính bằng giây; 0 để tắt)
+KB_CACHE_SIZE = int(os.getenv("KB_CACHE_SIZE", "1024"))
+KB_CACHE_TTL = float(os.getenv("KB_CACHE_TTL", "300"))
+# Phiên bản danh mục lưu trong MongoDB (tài liệu "catalog" của collection CATALOG_META_COLLECTION), tăng sau mỗi lần
+# nhập danh mục; server đọc lại mỗi CATALOG_VERSION_POLL_SECONDS giây (0 để tắt) và bỏ cache tra cứu khi phiên bản đổi
+CATALOG_META_COLLECTION = os.getenv("CATALOG_META_COLLECTION", "catalog_meta")
+CATALOG_VERSION_POLL_SECONDS = float(os.getenv("CATALOG_VERSION_POLL_SECONDS", "5"))
+
+# Cache câu trả lời của Gemini (số câu trả lời, thời gian sống tính bằng giây; 0 để tắt)
+# và số tin nhắn gần nhất (trước câu hỏi hiện tại) được đưa vào khóa cache
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "512"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "600"))
+LLM_CACHE_HISTORY_MESSAGES = int(os.getenv("LLM_CACHE_HISTORY_MESSAGES", "4"))
+
+# Bảo vệ lời gọi Gemini: thời gian tối đa cho cả lượt (mọi lần thử), số lần thử lại lỗi tạm thời và độ trễ cơ bản (giây)
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "20"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.5"))
+# Gửi thêm một yêu cầu song song khi yêu cầu đầu chậm hơn p95 (tốn thêm token), không sớm hơn LLM_HEDGE_MIN_DELAY giây
+LLM_HEDGE = os.getenv("LLM_HEDGE", "false").lower() in ("1", "true", "yes")
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "2"))
+# Circuit breaker: số lỗi tạm thời liên tiếp để mở và số giây trước khi thử lại
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+# Số lần gọi Gemini đang chạy tối đa (gồm cả yêu cầu hedge và yêu cầu bị bỏ rơi do hết deadline)
+LLM_MAX_ATTEMPTS_IN_FLIGHT = int(os.getenv("LLM_MAX_ATTEMPTS_IN_FLIGHT", "32"))
+# Câu trả lời cũ được giữ thêm bao lâu (giây) để dùng khi Gemini lỗi (0 để tắt)
+LLM_STALE_CACHE_TTL = float(os.getenv("LLM_STALE_CACHE_TTL", "86400"))
+
+# Ngân sách token cho prompt gửi Gemini (ước lượng cục bộ, không tính system instruction)
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))
+PROMPT_DB_CONTEXT_TOKENS = int(os.getenv("PROMPT_DB_CONTEXT_TOKENS", "800"))
+HISTORY_SUMMARY_TOKENS = int(os.getenv("HISTORY_SUMMARY_TOKENS", "300"))
+
+# Cache âm thanh TTS: số câu giữ trong bộ nhớ, thư mục cache trên đĩa ("" để tắt) và dung lượng tối đa
+TTS_MEMORY_CACHE_SIZE = int(os.getenv("TTS_MEMORY_CACHE_SIZE", "64"))
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", ".tts_cache")
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+
+# TTS theo từng câu: độ dài tối đa/tối thiểu của một đoạn và số đoạn được tổng hợp trước
+TTS_CHUNK_MAX_CHARS = int(os.getenv("TTS_CHUNK_MAX_CHARS", "200"))
+TTS_CHUNK_MIN_CHARS = int(os.getenv("TTS_CHUNK_MIN_CHARS", "20"))
+TTS_PIPELINE_LOOKAHEAD = int(os.getenv("TTS_PIPELINE_LOOKAHEAD", "2"))
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "4"))
+TTS_MAX_QUEUE = int(os.getenv("TTS_MAX_QUEUE", "32"))
+
+# Chế độ kiosk (main.py): số lượt hội thoại giữ trong lịch sử, cho phép nói chen ngang khi chatbot đang trả lời
+# (micro luôn nghe) và tỉ lệ cặp từ liên tiếp trùng với câu đang đọc để coi câu nghe được là tiếng vọng từ loa (bỏ qua)
+KIOSK_HISTORY_TURNS = int(os.getenv("KIOSK_HISTORY_TURNS", "5"))
+KIOSK_BARGE_IN = os.getenv("KIOSK_BARGE_IN", "true").lower() in ("1", "true", "yes")
+KIOSK_ECHO_OVERLAP = float(os.getenv("KIOSK_ECHO_OVERLAP", "0.8"))
+
+# Âm thanh do client gửi qua WebSocket: độ dài tối đa một câu nói, đoạn giữ lại trước khi VAD kích hoạt,
+# tham số VAD (độ dài frame, ngưỡng RMS, số frame để bắt đầu, thời gian im lặng để kết thúc) và backend nhận dạng
+AUDIO_MAX_UTTERANCE_SECONDS = float(os.getenv("AUDIO_MAX_UTTERANCE_SECONDS", "15"))
+AUDIO_PREROLL_MS = int(os.getenv("AUDIO_PREROLL_MS", "300"))
+AUDIO_VAD_FRAME_MS = int(os.getenv("AUDIO_VAD_FRAME_MS", "20"))
+AUDIO_VAD_THRESHOLD = float(os.getenv("AUDIO_VAD_THRESHOLD", "500"))
+AUDIO_VAD_START_FRAMES = int(os.getenv("AUDIO_VAD_START_FRAMES", "3"))
+AUDIO_VAD_END_SILENCE_MS = int(os.getenv("AUDIO_VAD_END_SILENCE_MS", "700"))
+STT_BACKEND = os.getenv("STT_BACKEND", "google")
+
+# Số lượt tối đa đang chờ của mỗi client và số lần bị từ chối liên tiếp trước khi ngắt kết nối
+TURN_QUEUE_SIZE = int(os.getenv("TURN_QUEUE_SIZE", "4"))
+TURN_MAX_REJECTIONS = int(os.getenv("TURN_MAX_REJECTIONS", "10"))
+
+# Lưu phiên hội thoại theo session_id: "memory" (trong tiến trình), "sqlite" (file cục bộ) hoặc "kv" (Redis/RESP)
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "3600")) # Phiên không hoạt động quá lâu sẽ bị xóa, 0 để giữ mãi
+SESSION_MEMORY_MAX_BYTES = int(os.getenv("SESSION_MEMORY_MAX_BYTES", str(32 * 1024 * 1024)))
+SESSION_SQLITE_PATH = os.getenv("SESSION_SQLITE_PATH", "sessions.sqlite3")
+SESSION_KV_HOST = os.getenv("SESSION_KV_HOST", "127.0.0.1")
+SESSION_KV_PORT = int(os.getenv("SESSION_KV_PORT", "6380"))
+
+# Nhật ký hội thoại ghi trễ vào MongoDB (journal_module): số lượt mỗi lần insert_many, chu kỳ ghi (giây),
+# số lượt tối đa trong bộ đệm, thời gian tối đa một lượt chờ khi bộ đệm đầy trước khi bị bỏ
+# và thời gian ghi nốt bộ đệm khi tắt server (giây)
+JOURNAL_ENABLED = os.getenv("JOURNAL_ENABLED", "true").lower() in ("1", "true", "yes")
+JOURNAL_COLLECTION = os.getenv("JOURNAL_COLLECTION", "conversations")
+JOURNAL_BATCH_SIZE = int(os.getenv("JOURNAL_BATCH_SIZE", "100"))
+JOURNAL_FLUSH_SECONDS = float(os.getenv("JOURNAL_FLUSH_SECONDS", "2"))
+JOURNAL_MAX_BUFFER = int(os.getenv("JOURNAL_MAX_BUFFER", "10000"))
+JOURNAL_MAX_BLOCK_SECONDS = float(os.getenv("JOURNAL_MAX_BLOCK_SECONDS", "0.05"))
+JOURNAL_DRAIN_SECONDS = float(os.getenv("JOURNAL_DRAIN_SECONDS", "10"))
+
+# Địa chỉ WebSocket server và số tiến trình worker (có thể ghi đè bằng --workers N).
+# SERVER_REUSE_PORT: mỗi worker tự bind cổng với SO_REUSEPORT (nếu hệ điều hành hỗ trợ),
+# ngược lại tiến trình cha bind một socket và các worker cùng accept trên đó
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8765"))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "1"))
+SERVER_REUSE_PORT = os.getenv("SERVER_REUSE_PORT", "true").lower() in ("1", "true", "yes")
+
+# Endpoint Prometheus (GET /metrics) chạy cạnh cổng WebSocket; 0 để tắt.
+# Chế độ nhiều worker: worker thứ i dùng cổng METRICS_PORT + i
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "8766"))
+# Cùng cổng đó: GET /healthz (liveness: tiến trình và asyncio loop còn chạy) và GET /readyz (readiness: đã làm nóng xong,
+# MongoDB trả lời ping, Gemini đã cấu hình). Chu kỳ ping MongoDB (giây), 0 để chỉ kiểm tra lúc làm nóng
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", "10"))
+
+# Logging: ghi qua hàng đợi bởi thread nền, định dạng "json" (một dòng JSON mỗi bản ghi) hoặc "text".
+# LOG_SAMPLE_RATES: tỉ lệ giữ lại theo sự kiện, ví dụ "ws_message=0.1,turn_history=0" (WARNING trở lên luôn được ghi)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "ws_message=0.1")
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "500"))
+LOG_MAX_MESSAGE_CHARS = int(os.getenv("LOG_MAX_MESSAGE_CHARS", "2000"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
@@ -1,34 +1,294 @@
-from pymongo import MongoClient
 import config
+import asyncio
+import random
 import re
+import threading
+import time
+import search_module
+import query_module
+import cache_module
+import metrics_module
+import resilience_module
 
-# Kết nối MongoDB
-try:
-    client = MongoClient(config.MONGODB_URI)
-    db = client[config.DB_NAME]
-    collection = db[config.COLLECTION_NAME]
-    print("Kết nối MongoDB thành công.")
-    client.admin.command('ping')  # Kiểm tra kết nối
-except Exception as e:
-    print(f"Lỗi kết nối MongoDB: {e}")
-    client = None
-    db = None
-    collection = None
+# Kết nối MongoDB: tạo khi cần lần đầu (không tạo lúc import) để mỗi tiến trình worker
+# sau khi fork có MongoClient riêng (MongoClient không dùng chung được qua fork).
+# pymongo cũng chỉ được import khi kết nối lần đầu, nên import module này không tốn thời gian nạp driver.
+client = None
+db = None
+collection = None
+_connect_lock = threading.Lock()
+# Kết nối lỗi (MongoDB chưa chạy, mất mạng lúc khởi động): thử lại sau khoảng chờ tăng dần thay vì bỏ hẳn
+_reconnect = resilience_module.ReconnectBackoff(config.MONGO_RECONNECT_MIN_SECONDS, config.MONGO_RECONNECT_MAX_SECONDS)
+# Kết quả ping gần nhất (check_health), dùng cho /readyz
+healthy = False
 
-def should_search_db(query_text):
+# Client async (MONGO_DRIVER = "async"), cũng tạo khi cần lần đầu bên trong asyncio loop của tiến trình
+async_client = None
+async_collection = None
+_async_connect_lock = None
+_async_unavailable = False
+_async_reconnect = resilience_module.ReconnectBackoff(
+    config.MONGO_RECONNECT_MIN_SECONDS, config.MONGO_RECONNECT_MAX_SECONDS
+)
+
+# Chỉ lấy các trường format_product_info dùng đến, không kéo cả tài liệu (keywords, search_tokens...) về
+PRODUCT_PROJECTION = dict({field: 1 for field in search_module.STORED_FIELDS}, _id=0)
+PRODUCT_LIMIT = 5
+
+# Trường do catalog_module tính sẵn khi nhập danh mục, dùng khi SEARCH_BACKEND = "tokens"
+SEARCH_TOKENS_FIELD = "search_tokens"
+CONTEXT_FIELD = "context"
+CONTEXT_PROJECTION = {CONTEXT_FIELD: 1, "_id": 0}
+
+def _client_options():
+    """Tham số pool kết nối dùng chung cho MongoClient và client async."""
+    return {
+        "maxPoolSize": config.MONGO_MAX_POOL_SIZE,
+        "minPoolSize": config.MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": config.MONGO_MAX_IDLE_MS,
+        "connectTimeoutMS": config.MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    }
+
+def _is_transient(error):
+    """
+    Lỗi mạng hoặc đổi primary thì đáng thử lại. Không thử lại khi hết maxTimeMS (truy vấn chậm sẽ lại chậm)
+    hay khi không chọn được server (đã chờ đủ serverSelectionTimeoutMS).
+    """
+    from pymongo import errors as mongo_errors # Đã được nạp khi kết nối
+    return (isinstance(error, mongo_errors.AutoReconnect)
+            and not isinstance(error, mongo_errors.ServerSelectionTimeoutError))
+
+def _retry_delay(attempt):
+    # Backoff lũy thừa có jitter để các worker không cùng thử lại một lúc
+    return config.MONGO_RETRY_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.0)
+
+def with_retries(fn):
+    """Gọi fn(), thử lại tối đa MONGO_RETRIES lần khi gặp lỗi tạm thời."""
+    for attempt in range(config.MONGO_RETRIES + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= config.MONGO_RETRIES or not _is_transient(e):
+                raise
+            print(f"Lỗi MongoDB tạm thời, thử lại lần {attempt + 1}: {e}")
+            time.sleep(_retry_delay(attempt))
+
+async def with_retries_async(fn):
+    """Như with_retries nhưng fn() trả về awaitable."""
+    for attempt in range(config.MONGO_RETRIES + 1):
+        try:
+            return await fn()
+        except Exception as e:
+            if attempt >= config.MONGO_RETRIES or not _is_transient(e):
+                raise
+            print(f"Lỗi MongoDB tạm thời, thử lại lần {attempt + 1}: {e}")
+            await asyncio.sleep(_retry_delay(attempt))
+
+def _find_products(coll, mongo_query):
+    """Cursor tìm sản phẩm (pymongo hoặc async): chỉ lấy các trường cần và giới hạn thời gian phía server."""
+    projection = CONTEXT_PROJECTION if config.SEARCH_BACKEND == "tokens" else PRODUCT_PROJECTION
+    cursor = coll.find(mongo_query, projection).limit(PRODUCT_LIMIT)
+    if config.MONGO_QUERY_TIMEOUT_MS > 0:
+        cursor = cursor.max_time_ms(config.MONGO_QUERY_TIMEOUT_MS)
+    return cursor
+
+def connect():
+    """
+    Kết nối MongoDB nếu chưa kết nối. Trả về collection, hoặc None nếu lỗi.
+    Sau một lần lỗi, các lần gọi trong khoảng chờ (MONGO_RECONNECT_*) trả về None ngay, không chờ timeout.
+    """
+    global client, db, collection, healthy
+    if collection is not None:
+        return collection
+    if not _reconnect.ready():
+        return None
+    with _connect_lock:
+        if collection is None and _reconnect.ready():
+            new_client = None
+            try:
+                from pymongo import MongoClient
+                new_client = MongoClient(config.MONGODB_URI, **_client_options())
+                new_client.admin.command('ping')  # Kiểm tra kết nối
+                new_collection = new_client[config.DB_NAME][config.COLLECTION_NAME]
+                # Làm nóng: truy vấn đầu tiên của khách không phải chịu thời gian mở collection/đọc index
+                with_retries(lambda: new_collection.find_one({}, PRODUCT_PROJECTION))
+                client = new_client
+                db = client[config.DB_NAME]
+                collection = new_collection
+                healthy = True
+                _reconnect.succeeded()
+                print("Kết nối MongoDB thành công.")
+            except Exception as e:
+                if new_client is not None:
+                    new_client.close() # Không để lại thread giám sát của client lỗi
+                delay = _reconnect.failed()
+                print(f"Lỗi kết nối MongoDB: {e} (thử lại sau {delay:.1f}s)")
+    return collection
+
+def check_health():
+    """Ping MongoDB (kết nối nếu chưa có), cập nhật `healthy`. Gọi định kỳ từ thread pool "db"."""
+    global healthy
+    if get_collection() is None:
+        healthy = False
+        return False
+    if client is None: # Collection được gán sẵn từ bên ngoài (benchmark, collection giả)
+        healthy = True
+        return True
+    try:
+        client.admin.command('ping')
+        healthy = True
+    except Exception as e:
+        if healthy:
+            print(f"MongoDB không trả lời ping: {e}")
+        healthy = False
+    return healthy
+
+def _async_client_class():
+    try:
+        from pymongo import AsyncMongoClient # pymongo >= 4.10
+        return AsyncMongoClient
+    except ImportError:
+        pass
+    try:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        return AsyncIOMotorClient
+    except ImportError:
+        return None
+
+async def connect_async():
+    """
+    Kết nối bằng driver async (chỉ khi MONGO_DRIVER = "async"), gọi từ bên trong asyncio loop.
+    Trả về collection async, hoặc None nếu không dùng driver async (khi đó tra cứu chạy bằng pymongo trong thread pool).
+    """
+    global async_client, async_collection, _async_connect_lock, _async_unavailable
+    if config.MONGO_DRIVER != "async" or _async_unavailable:
+        return None
+    if async_collection is not None:
+        return async_collection
+    if not _async_reconnect.ready():
+        return None
+    if _async_connect_lock is None:
+        _async_connect_lock = asyncio.Lock()
+    async with _async_connect_lock:
+        if async_collection is None and not _async_unavailable and _async_reconnect.ready():
+            client_class = _async_client_class()
+            if client_class is None:
+                print("MONGO_DRIVER=async cần pymongo >= 4.10 hoặc motor, dùng pymongo đồng bộ.")
+                _async_unavailable = True
+                return None
+            try:
+                new_client = client_class(config.MONGODB_URI, **_client_options())
+                await new_client.admin.command('ping')
+                new_collection = new_client[config.DB_NAME][config.COLLECTION_NAME]
+                await with_retries_async(lambda: new_collection.find_one({}, PRODUCT_PROJECTION))
+                async_client = new_client
+                async_collection = new_collection
+                _async_reconnect.succeeded()
+                print("Kết nối MongoDB (async) thành công.")
+            except Exception as e:
+                delay = _async_reconnect.failed()
+                print(f"Lỗi kết nối MongoDB (async): {e} (thử lại sau {delay:.1f}s)")
+    return async_collection
+
+def get_collection():
+    return collection if collection is not None else connect()
+
+# Cache kết quả tra cứu theo dạng chuẩn hóa của câu hỏi (xem query_module.cache_key).
+# catalog_version tăng mỗi khi tiến trình này thấy danh mục thay đổi (chỉ mục trong bộ nhớ được làm mới...);
+# catalog_db_version là phiên bản dùng chung lưu trong MongoDB, tăng khi nhập danh mục (catalog_module),
+# được mọi server/worker đọc lại định kỳ (refresh_catalog_version). Cả hai nằm trong khóa cache.
+catalog_version = 0
+catalog_db_version = None
+CATALOG_META_ID = "catalog"
+kb_cache = None
+if config.KB_CACHE_SIZE > 0 and config.KB_CACHE_TTL > 0:
+    kb_cache = cache_module.TTLCache(config.KB_CACHE_SIZE, config.KB_CACHE_TTL)
+
+def invalidate_kb_cache():
+    """Gọi khi sản phẩm thay đổi (nhập danh mục, cập nhật chỉ mục...)."""
+    global catalog_version
+    catalog_version += 1
+    if kb_cache is not None:
+        kb_cache.clear()
+
+def _catalog_meta():
+    return db[config.CATALOG_META_COLLECTION] if db is not None else None
+
+def bump_catalog_version():
     """
-    Quyết định xem có nên tìm kiếm trong DB hay không dựa trên từ khóa.
-    Đây là logic rất cơ bản cho MVP.
+    Tăng phiên bản danh mục trong MongoDB (gọi sau khi nhập/sửa sản phẩm) để mọi server đang chạy bỏ cache tra cứu.
+    Trả về phiên bản mới, hoặc None nếu chưa kết nối. Thử lại khi lỗi mạng có thể tăng hai lần, không ảnh hưởng gì.
     """
+    from pymongo import ReturnDocument
+    meta = _catalog_meta()
+    if meta is None:
+        return None
+    doc = with_retries(lambda: meta.find_one_and_update(
+        {"_id": CATALOG_META_ID}, {"$inc": {"version": 1}, "$currentDate": {"updated_at": True}},
+        upsert=True, return_document=ReturnDocument.AFTER,
+    ))
+    return doc["version"]
+
+def refresh_catalog_version():
+    """Đọc phiên bản danh mục trong MongoDB; nếu khác lần đọc trước thì bỏ cache tra cứu. Trả về True nếu đã đổi."""
+    global catalog_db_version
+    meta = _catalog_meta()
+    if meta is None:
+        return False
+    doc = with_retries(lambda: meta.find_one({"_id": CATALOG_META_ID}, {"version": 1}))
+    version = doc.get("version", 0) if doc else 0
+    if version == catalog_db_version:
+        return False
+    catalog_db_version = version
+    invalidate_kb_cache()
+    return True
+
+# Chỉ mục tìm kiếm trong bộ nhớ (khi SEARCH_BACKEND = "index"), được tạo khi cần lần đầu
+search_index = None
+_search_index_lock = threading.Lock()
+
+def get_search_index():
+    """Trả về chỉ mục tìm kiếm, nạp từ MongoDB và bắt đầu làm mới định kỳ ở lần gọi đầu."""
+    global search_index
+    if config.SEARCH_BACKEND != "index":
+        return None
+    collection = get_collection()
+    if collection is None:
+        return None
+    if search_index is None:
+        with _search_index_lock:
+            if search_index is None:
+                index = search_module.SearchIndex(
+                    updated_at_field=config.SEARCH_UPDATED_AT_FIELD, on_change=invalidate_kb_cache
+                )
+                index.load(collection)
+                if config.SEARCH_INDEX_REFRESH_SECONDS > 0:
+                    index.start_refresher(collection, config.SEARCH_INDEX_REFRESH_SECONDS)
+                search_index = index
+    return search_index
+
+def load_query_vocabulary():
+    """Nạp danh sách thương hiệu và danh mục từ MongoDB cho bộ phân tích câu hỏi."""
+    collection = get_collection()
+    if collection is None:
+        return False
+    try:
+        query_module.set_vocabulary(
+            brands=with_retries(lambda: collection.distinct("thuong_hieu")),
+            categories=with_retries(lambda: collection.distinct("danh_muc")),
+        )
+        invalidate_kb_cache() # Kết quả phân tích câu hỏi có thể đã khác
+        return True
+    except Exception as e:
+        print(f"Lỗi khi nạp từ vựng thương hiệu/danh mục: {e}")
+        return False
+
+def should_search_db(query_text):
+    """Quyết định xem có nên tìm kiếm trong DB hay không (xem query_module.analyze)."""
     if not query_text:
         return False
-    query_lower = query_text.lower()
-    # Các từ khóa gợi ý cần tra cứu DB
-    db_keywords = ["giá", "khuyến mãi", "sản phẩm", "hàng", "cửa hàng", "ở đâu", "mở cửa"]
-    for keyword in db_keywords:
-        if keyword in query_lower:
-            return True
-    return False
+    return query_module.analyze(query_text).should_search
 
 def format_product_info(doc):
     """Định dạng thông tin sản phẩm."""
@@ -50,19 +310,140 @@ def format_product_info(doc):
          parts.append(f"Thương hiệu: {doc['thuong_hieu']}")
     return ". ".join(parts)
 
-def search_knowledge_base(query_text):
-    """Tìm kiếm thông tin trong MongoDB."""
-    if collection is None:
+@metrics_module.timed("db_search")
+def search_knowledge_base(query_text, analysis=None):
+    """
+    Tìm kiếm thông tin trong MongoDB.
+    analysis: kết quả query_module.analyze(query_text) nếu nơi gọi đã phân tích sẵn.
+    """
+    if get_collection() is None:
         print("Chưa kết nối được MongoDB.")
         return None
 
-    keywords = query_text.lower().split()
-    stop_words = ["là", "bao nhiêu", "có", "giá", "của", "cho", "tôi", "biết", "về", "ở", "đâu", "địa chỉ", "đến", "mua"]  # Thêm "mua"
-    meaningful_keywords = [word for word in keywords if word not in stop_words and len(word) > 1]
+    if analysis is None:
+        analysis = query_module.analyze(query_text)
+
+    cache_key = _kb_cache_key(analysis)
+    if cache_key is not None:
+        cached = kb_cache.get(cache_key)
+        if cached is not cache_module.MISSING:
+            return cached
+
+    try:
+        context = _search_uncached(query_text, analysis)
+    except Exception as e:
+        _report_query_error(e)
+        return None # Không cache lỗi
+
+    if cache_key is not None:
+        kb_cache.set(cache_key, context)
+    return context
+
+async def search_knowledge_base_async(query_text, analysis=None):
+    """
+    Bản async của search_knowledge_base cho server. Với driver async và SEARCH_BACKEND = "mongo"/"tokens",
+    truy vấn chạy thẳng trên asyncio loop; các trường hợp khác gọi bản đồng bộ trong thread pool "db".
+    """
+    if config.SEARCH_BACKEND == "index" or await connect_async() is None:
+        import executor_module # Import muộn: executor_module chỉ cần khi chạy trong server
+        return await executor_module.run("db", search_knowledge_base, query_text, analysis=analysis)
+    return await _search_async(query_text, analysis)
+
+@metrics_module.timed("db_search")
+async def _search_async(query_text, analysis):
+    if analysis is None:
+        analysis = query_module.analyze(query_text)
+
+    cache_key = _kb_cache_key(analysis)
+    if cache_key is not None:
+        cached = kb_cache.get(cache_key)
+        if cached is not cache_module.MISSING:
+            return cached
+
+    queries = _mongo_queries(analysis)
+    context = None
+    if queries:
+        results = []
+        try:
+            with metrics_module.timed("mongo_query"):
+                for mongo_query in queries:
+                    results = await with_retries_async(
+                        lambda: _find_products(async_collection, mongo_query).to_list(length=PRODUCT_LIMIT)
+                    )
+                    if results:
+                        break
+        except Exception as e:
+            _report_query_error(e)
+            return None
+        context = _format_results(query_text, results)
+
+    if cache_key is not None:
+        kb_cache.set(cache_key, context)
+    return context
+
+def _kb_cache_key(analysis):
+    """Khóa cache tra cứu: phiên bản danh mục + từ khóa và bộ lọc (khoảng giá, thương hiệu, danh mục) của câu hỏi."""
+    if kb_cache is None:
+        return None
+    return (catalog_version, catalog_db_version, analysis.retrieval_key())
+
+def _report_query_error(error):
+    from pymongo import errors as mongo_errors
+    if isinstance(error, mongo_errors.ExecutionTimeout):
+        print(f"Truy vấn MongoDB vượt quá {config.MONGO_QUERY_TIMEOUT_MS} ms, bỏ qua ngữ cảnh sản phẩm.")
+    else:
+        print(f"Lỗi khi truy vấn MongoDB: {error}")
+
+def _search_uncached(query_text, analysis):
+    """Tra cứu thực sự (chỉ mục trong bộ nhớ hoặc MongoDB). Ném exception nếu truy vấn lỗi."""
+    meaningful_keywords = analysis.keywords
+    structured_filter = analysis.mongo_filter()
+
+    if not meaningful_keywords and not structured_filter:
+        return None
+
+    try:
+        index = get_search_index()
+    except Exception as e:
+        print(f"Lỗi khi nạp chỉ mục tìm kiếm, dùng truy vấn MongoDB: {e}")
+        index = None
+    # Chỉ mục chấm điểm theo từ khóa và cả tên thương hiệu/danh mục, rồi lọc theo bộ lọc có cấu trúc
+    search_text = " ".join(meaningful_keywords + [v for v in (analysis.brand, analysis.category) if v])
+    if index is not None and search_text:
+        predicate = analysis.matches if structured_filter else None
+        return _format_results(query_text, index.search(search_text, limit=PRODUCT_LIMIT, predicate=predicate))
+
+    results = []
+    with metrics_module.timed("mongo_query"):
+        for mongo_query in _mongo_queries(analysis):
+            results = with_retries(lambda: list(_find_products(get_collection(), mongo_query)))
+            if results:
+                break
+    return _format_results(query_text, results)
+
+def _mongo_queries(analysis):
+    """
+    Các truy vấn MongoDB được thử lần lượt cho tới khi có kết quả ([] nếu không có gì để tìm).
+    SEARCH_BACKEND = "tokens": so khớp chính xác token đã bỏ dấu trên search_tokens (index multikey),
+    trước hết đòi đủ mọi từ khóa rồi mới nới thành một từ khóa bất kỳ. Còn lại: regex theo từ khóa.
+    """
+    meaningful_keywords = analysis.keywords
+    structured_filter = analysis.mongo_filter()
+    if not meaningful_keywords and not structured_filter:
+        return []
+
+    if config.SEARCH_BACKEND == "tokens":
+        tokens = list(dict.fromkeys(search_module.tokenize(meaningful_keywords)))
+        if not tokens:
+            return [structured_filter] if structured_filter else []
+        queries = [dict(structured_filter, **{SEARCH_TOKENS_FIELD: {"$all": tokens}})]
+        if len(tokens) > 1:
+            queries.append(dict(structured_filter, **{SEARCH_TOKENS_FIELD: {"$in": tokens}}))
+        return queries
 
     search_conditions = []
     for keyword in meaningful_keywords:
-        regex_pattern = re.compile(f'.*{re.escape(keyword)}.*', re.IGNORECASE)
+        regex_pattern = re.compile(re.escape(keyword), re.IGNORECASE) # Regex không neo đã khớp ở bất kỳ vị trí nào
         search_conditions.append({"$or": [
             {"ten": regex_pattern},
             {"mo_ta": regex_pattern},
@@ -71,32 +452,31 @@ def search_knowledge_base(query_text):
             {"thuong_hieu": regex_pattern} # Tìm theo thương hiệu
         ]})
 
-    if not search_conditions:
-        return None
-
-    mongo_query = {"$or": search_conditions}
-
-    try:
-        results = collection.find(mongo_query).limit(5)  # Tăng limit lên 5
-        found_docs = list(results)
-
-        if not found_docs:
-            print(f"Không tìm thấy thông tin cho: '{query_text}' trong DB.")
-            return None
+    # Bộ lọc bằng/khoảng (dùng được index) kết hợp với điều kiện từ khóa còn lại
+    if search_conditions and structured_filter:
+        mongo_query = {"$and": [structured_filter, {"$or": search_conditions}]}
+    elif search_conditions:
+        mongo_query = {"$or": search_conditions}
+    else:
+        mongo_query = structured_filter
+    return [mongo_query]
 
-        context_list = [format_product_info(doc) for doc in found_docs]
-        context_list = [ctx for ctx in context_list if ctx]
-
-        if not context_list:
-            return None
+def _format_results(query_text, found_docs):
+    """Ghép thông tin các sản phẩm tìm được thành ngữ cảnh cho LLM."""
+    if not found_docs:
+        print(f"Không tìm thấy thông tin cho: '{query_text}' trong DB.")
+        return None
 
-        print(f"Đã tìm thấy {len(context_list)} thông tin liên quan.")
-        return "\n---\n".join(context_list)
+    # Ngữ cảnh dựng sẵn khi nhập danh mục (catalog_module), nếu không có thì định dạng tại chỗ
+    context_list = [doc.get(CONTEXT_FIELD) or format_product_info(doc) for doc in found_docs]
+    context_list = [ctx for ctx in context_list if ctx]
 
-    except Exception as e:
-        print(f"Lỗi khi truy vấn MongoDB: {e}")
+    if not context_list:
         return None
 
+    print(f"Đã tìm thấy {len(context_list)} thông tin liên quan.")
+    return "\n---\n".join(context_list)
+
 if __name__ == '__main__':
     test_query_1 = "Giá sữa tươi Vinamilk"
     context1 = search_knowledge_base(test_query_1)
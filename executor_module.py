@@ -0,0 +1,191 @@
+# executor_module.py
+# Các thread pool có giới hạn cho công việc đồng bộ (pymongo, Gemini, STT, TTS)
+# để coroutine của server không bao giờ chặn asyncio loop.
+import asyncio
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+
+class ExecutorBusyError(RuntimeError):
+    """Pool đã đủ worker bận và hàng đợi đã đầy."""
+
+
+class BoundedExecutor:
+    """
+    ThreadPoolExecutor với số tác vụ chờ tối đa.
+    Đếm số tác vụ đang chạy và đang chờ để báo cáo độ sâu hàng đợi.
+    """
+
+    def __init__(self, name, max_workers, max_queue):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-worker")
+        self._lock = threading.Lock()
+        self._pending = 0 # Đang chạy + đang chờ
+        self._running = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise ExecutorBusyError(f"Executor '{self.name}' is full ({self._pending} pending).")
+            self._pending += 1
+
+        def call():
+            with self._lock:
+                self._running += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+        try:
+            future = self._executor.submit(call)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        future.add_done_callback(self._on_done) # Được gọi cả khi tác vụ bị hủy trước khi chạy
+        return future
+
+    def _on_done(self, future):
+        with self._lock:
+            self._pending -= 1
+            self.completed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "in_flight": self._running,
+                "queued": self._pending - self._running,
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _pool_settings():
+    return {
+        "db": (config.DB_WORKERS, config.DB_MAX_QUEUE),
+        "llm": (config.LLM_WORKERS, config.LLM_MAX_QUEUE),
+        "stt": (config.STT_WORKERS, config.STT_MAX_QUEUE),
+        "tts": (config.TTS_WORKERS, config.TTS_MAX_QUEUE),
+    }
+
+
+def get_executor(kind):
+    """Lấy (hoặc tạo lần đầu) pool cho loại công việc `kind`."""
+    executor = _executors.get(kind)
+    if executor is not None:
+        return executor
+    with _executors_lock:
+        if kind not in _executors:
+            settings = _pool_settings()
+            if kind not in settings:
+                raise ValueError(f"Unknown executor kind: {kind}")
+            max_workers, max_queue = settings[kind]
+            _executors[kind] = BoundedExecutor(kind, max_workers, max_queue)
+        return _executors[kind]
+
+
+async def run(kind, fn, *args, **kwargs):
+    """
+    Chạy hàm đồng bộ `fn` trong pool `kind` và chờ kết quả mà không chặn loop.
+    Context (contextvars) của coroutine được truyền sang thread worker.
+    Ném ExecutorBusyError nếu pool đã đầy.
+    """
+    ctx = contextvars.copy_context()
+    future = get_executor(kind).submit(ctx.run, fn, *args, **kwargs)
+    return await asyncio.wrap_future(future)
+
+
+_STREAM_END = object()
+
+
+async def iterate(kind, gen_fn, *args, **kwargs):
+    """
+    Chạy generator đồng bộ `gen_fn(*args, **kwargs)` trong pool `kind` và
+    yield từng phần tử của nó về coroutine ngay khi được sinh ra.
+    Nếu phía async dừng sớm (break/hủy task), generator sẽ được đóng ở thread worker.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+
+    def put(item, error=None):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, (item, error))
+        except RuntimeError: # Loop đã đóng
+            stop.set()
+
+    def pump():
+        gen = gen_fn(*args, **kwargs)
+        try:
+            for item in gen:
+                if stop.is_set():
+                    break
+                put(item)
+        except BaseException as e:
+            put(_STREAM_END, e)
+            return
+        finally:
+            gen.close()
+        put(_STREAM_END)
+
+    ctx = contextvars.copy_context()
+    future = get_executor(kind).submit(ctx.run, pump)
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is _STREAM_END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+        future.cancel()
+
+
+def stats():
+    """Thống kê của tất cả các pool đã được tạo."""
+    return {kind: executor.stats() for kind, executor in list(_executors.items())}
+
+
+def queue_depths():
+    """Số tác vụ đang chờ worker của từng pool."""
+    return {kind: s["queued"] for kind, s in stats().items()}
+
+
+async def report_stats_periodically(interval=None):
+    """Định kỳ ghi log độ sâu hàng đợi của các pool (chạy như một task nền)."""
+    interval = config.EXECUTOR_STATS_INTERVAL if interval is None else interval
+    if interval <= 0:
+        return
+    while True:
+        await asyncio.sleep(interval)
+        current = stats()
+        if any(s["in_flight"] or s["queued"] for s in current.values()):
+            logging.info(f"Executor stats: {current}")
+
+
+def shutdown(wait=True):
+    with _executors_lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=wait)
+        _executors.clear()
@@ -0,0 +1,572 @@
+# fake_module.py
+# Bản giả lập cục bộ của MongoDB collection, model Gemini và bộ nhận dạng giọng nói,
+# cùng danh mục sản phẩm / câu hỏi tổng hợp, để chạy benchmark và thử tải không cần dịch vụ thật.
+import asyncio
+import datetime
+import math
+import random
+import re
+import threading
+import time
+from array import array
+
+import prompt_module
+
+# ---------------------------------------------------------------------------
+# MongoDB collection giả
+# ---------------------------------------------------------------------------
+
+def _get_field(doc, path):
+    value = doc
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None, False
+        value = value[part]
+    return value, True
+
+
+def _regex_matches(pattern, value):
+    if isinstance(value, list):
+        return any(_regex_matches(pattern, item) for item in value)
+    return isinstance(value, str) and pattern.search(value) is not None
+
+
+def _compile_regex(condition):
+    flags = re.IGNORECASE if "i" in condition.get("$options", "") else 0
+    pattern = condition["$regex"]
+    return pattern if isinstance(pattern, re.Pattern) else re.compile(pattern, flags)
+
+
+def _equals(value, expected):
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+    return value == expected
+
+
+def _compare(value, op, operand):
+    if value is None or operand is None:
+        return False
+    try:
+        if op == "$gt":
+            return value > operand
+        if op == "$gte":
+            return value >= operand
+        if op == "$lt":
+            return value < operand
+        return value <= operand
+    except TypeError: # Khác kiểu (ví dụ số với chuỗi): Mongo coi là không khớp
+        return False
+
+
+def _field_matches(value, exists, condition):
+    if isinstance(condition, re.Pattern):
+        return _regex_matches(condition, value)
+    if not isinstance(condition, dict) or not any(key.startswith("$") for key in condition):
+        return exists and _equals(value, condition)
+    for op, operand in condition.items():
+        if op == "$regex":
+            if not _regex_matches(_compile_regex(condition), value):
+                return False
+        elif op == "$options":
+            continue
+        elif op == "$eq":
+            if not (exists and _equals(value, operand)):
+                return False
+        elif op == "$ne":
+            if exists and _equals(value, operand):
+                return False
+        elif op == "$in":
+            if not any(_field_matches(value, exists, item) for item in operand):
+                return False
+        elif op == "$all":
+            if not all(_field_matches(value, exists, item) for item in operand):
+                return False
+        elif op == "$nin":
+            # Giá trị None trong $nin cũng loại các tài liệu không có trường
+            if any((item is None and not exists) or _field_matches(value, exists, item) for item in operand):
+                return False
+        elif op in ("$gt", "$gte", "$lt", "$lte"):
+            if not _compare(value, op, operand):
+                return False
+        elif op == "$exists":
+            if exists != bool(operand):
+                return False
+        else:
+            raise ValueError(f"Unsupported query operator in FakeCollection: {op}")
+    return True
+
+
+def matches_filter(doc, query):
+    """Đánh giá một bộ lọc kiểu MongoDB (tập con thường dùng) trên một tài liệu."""
+    for key, condition in (query or {}).items():
+        if key == "$and":
+            if not all(matches_filter(doc, sub) for sub in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(doc, sub) for sub in condition):
+                return False
+        elif key == "$nor":
+            if any(matches_filter(doc, sub) for sub in condition):
+                return False
+        else:
+            value, exists = _get_field(doc, key)
+            if isinstance(condition, dict) and None in condition.get("$in", ()) and not exists:
+                continue
+            if condition is None:
+                if exists and value is not None:
+                    return False
+                continue
+            if not _field_matches(value, exists, condition):
+                return False
+    return True
+
+
+def _project(doc, projection):
+    if not projection:
+        return dict(doc)
+    included = {field for field, flag in projection.items() if flag}
+    if included:
+        result = {field: doc[field] for field in included if field in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+    return {field: value for field, value in doc.items() if projection.get(field, 1)}
+
+
+class FakeCursor:
+    """Con trỏ lười giống pymongo: limit/skip/sort/batch_size rồi duyệt."""
+
+    def __init__(self, collection, query, projection, simulate_latency=True):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._simulate_latency = simulate_latency
+        self._limit = 0
+        self._skip = 0
+        self._sort = None
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def skip(self, count):
+        self._skip = count
+        return self
+
+    def sort(self, key_or_list, direction=1):
+        self._sort = [(key_or_list, direction)] if isinstance(key_or_list, str) else list(key_or_list)
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def max_time_ms(self, ms):
+        return self
+
+    def __iter__(self):
+        if self._simulate_latency:
+            self._collection._simulate_latency()
+        docs = self._collection._snapshot()
+        matched = (doc for doc in docs if matches_filter(doc, self._query))
+        if self._sort:
+            matched = list(matched)
+            for field, direction in reversed(self._sort):
+                matched.sort(key=lambda doc: (_get_field(doc, field)[0] is None, _get_field(doc, field)[0]),
+                             reverse=direction < 0)
+        count = 0
+        for index, doc in enumerate(matched):
+            if index < self._skip:
+                continue
+            if self._limit and count >= self._limit:
+                break
+            count += 1
+            yield _project(doc, self._projection)
+
+
+class FakeResult:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class FakeCollection:
+    """
+    Collection trong bộ nhớ thay cho pymongo (find/find_one/distinct/count_documents/insert/update/delete).
+    latency: độ trễ mạng giả lập (giây) cho mỗi lệnh gửi đến "máy chủ".
+    """
+
+    def __init__(self, docs=(), latency=0.0, name="products"):
+        self.name = name
+        self.latency = latency
+        self._docs = []
+        self._lock = threading.Lock()
+        self._next_id = 1
+        self.calls = 0
+        for doc in docs:
+            self._insert(doc)
+
+    def _simulate_latency(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _snapshot(self):
+        with self._lock:
+            return list(self._docs)
+
+    def _insert(self, doc):
+        doc = dict(doc)
+        if "_id" not in doc:
+            doc["_id"] = self._next_id
+            self._next_id += 1
+        self._docs.append(doc)
+        return doc["_id"]
+
+    def find(self, filter=None, projection=None, **kwargs):
+        return FakeCursor(self, filter or {}, projection)
+
+    def find_one(self, filter=None, projection=None, **kwargs):
+        for doc in self.find(filter, projection).limit(1):
+            return doc
+        return None
+
+    def distinct(self, field, filter=None):
+        self._simulate_latency()
+        values = []
+        seen = set()
+        for doc in self._snapshot():
+            if filter and not matches_filter(doc, filter):
+                continue
+            value, exists = _get_field(doc, field)
+            for item in (value if isinstance(value, list) else [value]):
+                if exists and item is not None and item not in seen:
+                    seen.add(item)
+                    values.append(item)
+        return values
+
+    def count_documents(self, filter=None, **kwargs):
+        self._simulate_latency()
+        return sum(1 for doc in self._snapshot() if matches_filter(doc, filter))
+
+    def insert_one(self, doc):
+        self._simulate_latency()
+        with self._lock:
+            return FakeResult(inserted_id=self._insert(doc), acknowledged=True)
+
+    def insert_many(self, docs, ordered=True):
+        self._simulate_latency()
+        with self._lock:
+            return FakeResult(inserted_ids=[self._insert(doc) for doc in docs], acknowledged=True)
+
+    def update_one(self, filter, update, upsert=False):
+        self._simulate_latency()
+        with self._lock:
+            for doc in self._docs:
+                if matches_filter(doc, filter):
+                    doc.update(update.get("$set", {}))
+                    return FakeResult(matched_count=1, modified_count=1, upserted_id=None)
+            if not upsert:
+                return FakeResult(matched_count=0, modified_count=0, upserted_id=None)
+            doc = {key: value for key, value in filter.items() if not key.startswith("$")}
+            doc.update(update.get("$setOnInsert", {}))
+            doc.update(update.get("$set", {}))
+            return FakeResult(matched_count=0, modified_count=0, upserted_id=self._insert(doc))
+
+    def bulk_write(self, requests, ordered=True):
+        """Thực hiện các lệnh UpdateOne/InsertOne/DeleteOne của pymongo (đọc thuộc tính nội bộ _filter/_doc/_upsert)."""
+        counts = {"inserted_count": 0, "matched_count": 0, "modified_count": 0, "deleted_count": 0, "upserted_count": 0}
+        for request in requests:
+            name = type(request).__name__
+            if name == "InsertOne":
+                self.insert_one(request._doc)
+                counts["inserted_count"] += 1
+            elif name == "UpdateOne":
+                result = self.update_one(request._filter, request._doc, upsert=request._upsert)
+                counts["matched_count"] += result.matched_count
+                counts["modified_count"] += result.modified_count
+                counts["upserted_count"] += result.upserted_id is not None
+            elif name == "DeleteOne":
+                counts["deleted_count"] += self.delete_one(request._filter).deleted_count
+            else:
+                raise ValueError(f"Unsupported bulk operation in FakeCollection: {name}")
+        return FakeResult(acknowledged=True, **counts)
+
+    def delete_one(self, filter):
+        self._simulate_latency()
+        with self._lock:
+            for index, doc in enumerate(self._docs):
+                if matches_filter(doc, filter):
+                    del self._docs[index]
+                    return FakeResult(deleted_count=1)
+        return FakeResult(deleted_count=0)
+
+    def create_index(self, keys, **kwargs):
+        name = kwargs.get("name")
+        if name:
+            return name
+        keys = [(keys, 1)] if isinstance(keys, str) else keys
+        return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+    def __len__(self):
+        return len(self._docs)
+
+
+class AsyncFakeCursor:
+    """Con trỏ async giống Motor/AsyncMongoClient: limit/skip/sort/max_time_ms rồi `await cursor.to_list(n)`."""
+
+    def __init__(self, cursor, latency):
+        self._cursor = cursor
+        self._latency = latency
+
+    def limit(self, count):
+        self._cursor.limit(count)
+        return self
+
+    def skip(self, count):
+        self._cursor.skip(count)
+        return self
+
+    def sort(self, key_or_list, direction=1):
+        self._cursor.sort(key_or_list, direction)
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def max_time_ms(self, ms):
+        return self
+
+    async def to_list(self, length=None):
+        if self._latency:
+            await asyncio.sleep(self._latency) # Chờ mạng không chiếm thread như bản đồng bộ
+        docs = []
+        for doc in self._cursor:
+            if length is not None and len(docs) >= length:
+                break
+            docs.append(doc)
+        return docs
+
+
+class AsyncFakeCollection:
+    """
+    Bản async của FakeCollection (thay cho collection của Motor/AsyncMongoClient) dùng chung dữ liệu với collection gốc.
+    Độ trễ giả lập được chờ bằng asyncio.sleep thay vì time.sleep.
+    """
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def find(self, filter=None, projection=None, **kwargs):
+        self._collection.calls += 1
+        cursor = FakeCursor(self._collection, filter or {}, projection, simulate_latency=False)
+        return AsyncFakeCursor(cursor, self._collection.latency)
+
+    async def find_one(self, filter=None, projection=None, **kwargs):
+        docs = await self.find(filter, projection).to_list(1)
+        return docs[0] if docs else None
+
+
+# ---------------------------------------------------------------------------
+# Model Gemini giả
+# ---------------------------------------------------------------------------
+
+_FILLER_WORDS = (
+    "dạ hiện cửa hàng có sản phẩm này với giá rất tốt, bạn có thể tham khảo thêm "
+    "các lựa chọn khác trong cùng danh mục. chương trình khuyến mãi áp dụng đến cuối tháng."
+).split()
+
+
+class FakeUsage:
+    def __init__(self, prompt_tokens, output_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+
+class FakeResponse:
+    """Có các thuộc tính llm_module đọc: parts, text, prompt_feedback, candidates, usage_metadata."""
+
+    def __init__(self, text, usage=None):
+        self.text = text
+        self.parts = [text] if text else []
+        self.prompt_feedback = None
+        self.candidates = []
+        self.usage_metadata = usage
+
+
+class FakeModel:
+    """
+    Thay cho genai.GenerativeModel: trả lời sau `latency` giây (thời gian tới token đầu, dao động ±jitter)
+    rồi sinh `output_tokens` token với tốc độ `token_rate` token/giây. Hỗ trợ stream=True.
+    """
+
+    def __init__(self, latency=0.5, token_rate=50.0, output_tokens=60, jitter=0.2, chunk_tokens=8, seed=None):
+        self.latency = latency
+        self.token_rate = token_rate
+        self.output_tokens = output_tokens
+        self.jitter = jitter
+        self.chunk_tokens = chunk_tokens
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _first_token_delay(self):
+        with self._lock:
+            self.calls += 1
+            factor = self._random.uniform(1 - self.jitter, 1 + self.jitter) if self.jitter else 1.0
+        return max(self.latency * factor, 0.0)
+
+    def _answer_words(self, contents):
+        # Câu trả lời nhắc lại một phần câu hỏi cuối để mỗi câu hỏi có câu trả lời khác nhau
+        last = contents[-1]["parts"][-1] if contents else ""
+        question = last.rsplit("\n", 1)[-1][:60]
+        words = f"Về câu hỏi '{question}':".split()
+        while len(words) < self.output_tokens:
+            words.extend(_FILLER_WORDS)
+        return words[:max(self.output_tokens, 1)]
+
+    def _prompt_tokens(self, contents):
+        return sum(prompt_module.message_tokens(message) for message in contents)
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        words = self._answer_words(contents)
+        usage = FakeUsage(self._prompt_tokens(contents), len(words))
+        delay = self._first_token_delay()
+        if not stream:
+            time.sleep(delay + len(words) / self.token_rate)
+            return FakeResponse(" ".join(words), usage)
+        return self._stream(words, delay, usage)
+
+    def _stream(self, words, delay, usage):
+        time.sleep(delay)
+        for start in range(0, len(words), self.chunk_tokens):
+            piece = words[start:start + self.chunk_tokens]
+            time.sleep(len(piece) / self.token_rate)
+            prefix = "" if start == 0 else " "
+            yield FakeResponse(prefix + " ".join(piece), usage)
+
+
+# ---------------------------------------------------------------------------
+# Bộ nhận dạng giọng nói giả
+# ---------------------------------------------------------------------------
+
+def make_fake_recognizer(phrases, seconds_per_audio_second=0.2, base_latency=0.1, seed=None):
+    """
+    Backend STT giả cho stt_module.register_recognizer: mất base_latency + (độ dài âm thanh × hệ số) giây
+    rồi trả về một câu ngẫu nhiên trong `phrases`.
+    """
+    rng = random.Random(seed)
+    lock = threading.Lock()
+
+    def recognize(pcm, sample_rate, sample_width=2):
+        duration = len(pcm) / (sample_rate * sample_width)
+        time.sleep(base_latency + duration * seconds_per_audio_second)
+        with lock:
+            return rng.choice(phrases)
+
+    return recognize
+
+
+def synthetic_utterance(sample_rate=16000, speech_seconds=1.0, silence_seconds=0.8, amplitude=3000):
+    """PCM16 của một câu nói giả (âm sin kèm khoảng lặng trước/sau) đủ để EnergyVAD phát hiện."""
+    samples = array("h")
+    lead = int(sample_rate * 0.2)
+    samples.extend([0] * lead)
+    for n in range(int(sample_rate * speech_seconds)):
+        samples.append(int(amplitude * math.sin(2 * math.pi * 220 * n / sample_rate)))
+    samples.extend([0] * int(sample_rate * silence_seconds))
+    return samples.tobytes()
+
+
+# ---------------------------------------------------------------------------
+# Danh mục sản phẩm và câu hỏi tổng hợp
+# ---------------------------------------------------------------------------
+
+# danh mục -> (các loại sản phẩm, thương hiệu, khoảng giá VND, biến thể)
+CATALOG_SPEC = {
+    "Sữa": (
+        ["Sữa tươi", "Sữa chua", "Sữa đặc", "Sữa bột"],
+        ["Vinamilk", "TH True Milk", "Dutch Lady", "Nutifood"],
+        (8000, 600000), ["không đường", "ít đường", "có đường", "hương dâu", "180ml", "1 lít"],
+    ),
+    "Đồ gia dụng": (
+        ["Nồi cơm điện", "Ấm siêu tốc", "Quạt điện", "Bàn ủi", "Máy xay sinh tố"],
+        ["Sunhouse", "Philips", "Panasonic", "Kangaroo"],
+        (150000, 3000000), ["1.8 lít", "cao cấp", "mini", "gia đình", "inox"],
+    ),
+    "Điện tử": (
+        ["Laptop", "Điện thoại", "Tai nghe", "Loa bluetooth", "Máy tính bảng"],
+        ["Dell", "Samsung", "Apple", "Sony", "Xiaomi"],
+        (300000, 40000000), ["chính hãng", "bản quốc tế", "màu đen", "màu trắng", "128GB"],
+    ),
+    "Hóa mỹ phẩm": (
+        ["Nước giặt", "Dầu gội", "Kem đánh răng", "Nước rửa chén", "Sữa tắm"],
+        ["Omo", "Sunsilk", "P/S", "Sunlight", "Dove"],
+        (20000, 350000), ["hương chanh", "dịu nhẹ", "túi 3kg", "chai 800ml", "than hoạt tính"],
+    ),
+    "Thực phẩm": (
+        ["Mì gói", "Nước mắm", "Dầu ăn", "Gạo", "Bánh quy"],
+        ["Hảo Hảo", "Chin-su", "Neptune", "Vinh Hiển", "Cosy"],
+        (3000, 250000), ["thùng 30 gói", "chai 500ml", "túi 5kg", "vị tôm chua cay", "cao cấp"],
+    ),
+    "Đồ uống": (
+        ["Nước ngọt", "Cà phê", "Trà xanh", "Nước suối", "Nước tăng lực"],
+        ["Coca-Cola", "Trung Nguyên", "Không Độ", "Lavie", "Red Bull"],
+        (5000, 200000), ["lon 330ml", "chai 1.5 lít", "thùng 24 lon", "hòa tan", "ít đường"],
+    ),
+}
+
+PROMOTIONS = ["Giảm 10%", "Mua 2 tặng 1", "Giảm 20% cuối tuần", "Tặng kèm quà", "Giảm 50.000đ cho hóa đơn từ 500.000đ"]
+
+
+def generate_catalog(count, seed=42, promotion_ratio=0.2):
+    """Sinh `count` sản phẩm tiếng Việt với các trường giống collection products thật."""
+    rng = random.Random(seed)
+    categories = list(CATALOG_SPEC.items())
+    base_time = datetime.datetime(2024, 1, 1)
+    for index in range(count):
+        category, (nouns, brands, (low, high), variants) = categories[index % len(categories)]
+        noun = rng.choice(nouns)
+        brand = rng.choice(brands)
+        variant = rng.choice(variants)
+        price = int(rng.uniform(low, high) / 1000) * 1000
+        doc = {
+            "ten": f"{noun} {brand} {variant} #{index}",
+            "gia": price,
+            "mo_ta": f"{noun} {variant} của {brand}, phù hợp cho nhu cầu hằng ngày.",
+            "danh_muc": category,
+            "thuong_hieu": brand,
+            "keywords": [noun.lower(), brand.lower(), variant.lower()],
+            "updated_at": base_time + datetime.timedelta(seconds=index),
+        }
+        if rng.random() < promotion_ratio:
+            doc["khuyen_mai"] = rng.choice(PROMOTIONS)
+        yield doc
+
+
+_QUERY_TEMPLATES = (
+    "Giá {noun} {brand} bao nhiêu vậy?",
+    "{noun} nào đang khuyến mãi?",
+    "Có {noun} dưới {price}k không?",
+    "Cho mình xem {noun} của {brand}",
+    "{noun} {brand} còn hàng không bạn?",
+    "Tìm {noun} {variant}",
+    "So sánh giúp mình {noun} {brand} với loại khác",
+)
+_CHITCHAT = ("Xin chào", "Cảm ơn bạn nhiều", "Cửa hàng mở cửa lúc mấy giờ?", "Bạn là ai vậy?")
+
+
+def generate_queries(count, seed=7, chitchat_ratio=0.15):
+    """Sinh câu hỏi mua sắm tiếng Việt (có dấu, có cả câu xã giao) dựa trên CATALOG_SPEC."""
+    rng = random.Random(seed)
+    specs = list(CATALOG_SPEC.values())
+    queries = []
+    for _ in range(count):
+        if rng.random() < chitchat_ratio:
+            queries.append(rng.choice(_CHITCHAT))
+            continue
+        nouns, brands, (low, high), variants = rng.choice(specs)
+        queries.append(rng.choice(_QUERY_TEMPLATES).format(
+            noun=rng.choice(nouns), brand=rng.choice(brands), variant=rng.choice(variants),
+            price=int(rng.uniform(low, high) / 1000),
+        ))
+    return queries
@@ -0,0 +1,205 @@
+# journal_module.py
+# Nhật ký hội thoại ghi trễ (write-behind) vào collection JOURNAL_COLLECTION ("conversations") của MongoDB:
+# mỗi lượt (câu hỏi + câu trả lời) là một tài liệu, dùng cho phân tích, đánh giá offline và dựng lại lịch sử
+# khi client kết nối lại mà session store không còn phiên. Lượt được giữ trong bộ đệm bộ nhớ và một task nền
+# ghi theo lô bằng insert_many, nên lượt trả lời của khách không bao giờ phải chờ MongoDB.
+import asyncio
+import collections
+import datetime
+import logging
+import os
+import uuid
+
+import config
+import db_module
+import executor_module
+
+DUPLICATE_KEY = 11000
+
+
+def _insert_batch(collection, batch):
+    from pymongo import errors as mongo_errors # Import muộn như db_module: chỉ cần khi thực sự ghi
+    try:
+        collection.insert_many(batch, ordered=False)
+    except mongo_errors.BulkWriteError as e:
+        # Lần thử trước đã ghi được một phần: _id sinh sẵn nên phần đó chỉ báo trùng khóa, không bị ghi hai lần
+        if any(error.get("code") != DUPLICATE_KEY for error in e.details.get("writeErrors", ())):
+            raise
+
+
+def _find_recent(collection, session_id, limit):
+    cursor = collection.find(
+        {"session_id": session_id}, {"question": 1, "answer": 1, "created_at": 1}
+    ).sort("created_at", -1).limit(limit)
+    if config.MONGO_QUERY_TIMEOUT_MS > 0:
+        cursor = cursor.max_time_ms(config.MONGO_QUERY_TIMEOUT_MS)
+    return list(cursor)[::-1]
+
+
+class ConversationJournal:
+    """
+    Bộ đệm các lượt hội thoại, được task nền ghi xuống MongoDB khi đủ batch_size lượt hoặc sau flush_interval giây.
+    Bộ đệm có giới hạn (max_buffer): khi đầy, record() chờ tối đa max_block giây cho task nền giải phóng chỗ
+    rồi bỏ lượt đó (đếm vào dropped). Lô ghi lỗi được đưa lại đầu bộ đệm (trong giới hạn) để thử lại ở lần sau.
+    """
+
+    def __init__(self, collection=None, batch_size=None, flush_interval=None, max_buffer=None, max_block=None):
+        self.collection = collection # None: lấy collection JOURNAL_COLLECTION từ db_module khi ghi lần đầu
+        self.batch_size = max(config.JOURNAL_BATCH_SIZE if batch_size is None else batch_size, 1)
+        self.flush_interval = config.JOURNAL_FLUSH_SECONDS if flush_interval is None else flush_interval
+        self.max_buffer = max(config.JOURNAL_MAX_BUFFER if max_buffer is None else max_buffer, self.batch_size)
+        self.max_block = config.JOURNAL_MAX_BLOCK_SECONDS if max_block is None else max_block
+        self._buffer = collections.deque()
+        self._writing = [] # Lô đang được ghi (vẫn đọc được khi dựng lại lịch sử)
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._task = None
+        self._closing = False
+        self._indexed = False # Đã tạo index (session_id, created_at)
+        self.written = 0
+        self.dropped = 0
+        self.failed_batches = 0
+
+    def _get_collection(self):
+        if self.collection is None and db_module.db is not None:
+            self.collection = db_module.db[config.JOURNAL_COLLECTION]
+        return self.collection
+
+    async def ensure_index(self):
+        """
+        Tạo index (session_id, created_at) một lần. MongoDB chưa kết nối hoặc tạo lỗi thì thử lại ở lần gọi sau
+        (sau mỗi lô ghi thành công), nên server khởi động khi MongoDB chưa sẵn sàng vẫn có index.
+        """
+        if self._indexed:
+            return True
+        collection = self._get_collection()
+        if collection is None:
+            return False
+        try:
+            await executor_module.run(
+                "db", collection.create_index, [("session_id", 1), ("created_at", -1)], name="journal_session"
+            )
+        except Exception as e:
+            logging.error(f"Conversation journal index creation failed: {e}")
+            return False
+        self._indexed = True
+        return True
+
+    async def start(self):
+        """Tạo index (nếu MongoDB đã kết nối) và chạy task ghi nền trên loop hiện tại."""
+        await self.ensure_index()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def record(self, session_id, question, answer, **fields):
+        """Đưa một lượt vào bộ đệm. Trả về False nếu lượt bị bỏ vì bộ đệm đầy."""
+        if len(self._buffer) >= self.max_buffer and self._task is not None and self.max_block > 0:
+            self._space.clear()
+            self._wakeup.set()
+            try:
+                await asyncio.wait_for(self._space.wait(), self.max_block)
+            except asyncio.TimeoutError:
+                pass
+        if len(self._buffer) >= self.max_buffer:
+            self.dropped += 1
+            if self.dropped % 100 == 1:
+                logging.warning(f"Conversation journal buffer full, {self.dropped} turns dropped so far.")
+            return False
+
+        self._buffer.append(dict(
+            fields,
+            _id=uuid.uuid4().hex, # Sinh sẵn để thử lại insert_many không tạo bản ghi trùng
+            session_id=session_id,
+            created_at=datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None),
+            question=question,
+            answer=answer,
+            pid=os.getpid(),
+        ))
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    async def flush(self):
+        """Ghi một lô từ đầu bộ đệm. Trả về False nếu ghi lỗi."""
+        if not self._buffer:
+            return True
+        batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+        self._space.set()
+        self._writing = batch
+        try:
+            collection = self._get_collection()
+            if collection is None:
+                raise RuntimeError("MongoDB is not connected.")
+            await executor_module.run("db", db_module.with_retries, lambda: _insert_batch(collection, batch))
+        except Exception as e:
+            self.failed_batches += 1
+            room = max(self.max_buffer - len(self._buffer), 0)
+            self._buffer.extendleft(reversed(batch[:room]))
+            self.dropped += len(batch) - min(room, len(batch))
+            logging.error(f"Conversation journal write of {len(batch)} turns failed: {e}")
+            return False
+        finally:
+            self._writing = []
+        self.written += len(batch)
+        await self.ensure_index()
+        return True
+
+    async def _run(self):
+        while True:
+            if self._closing and not self._buffer:
+                return
+            if len(self._buffer) < self.batch_size and not self._closing:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+            if not await self.flush():
+                await asyncio.sleep(self.flush_interval) # MongoDB đang lỗi: không thử lại liên tục
+
+    async def close(self, timeout=None):
+        """Ghi nốt bộ đệm (tối đa `timeout` giây) rồi dừng task nền."""
+        timeout = config.JOURNAL_DRAIN_SECONDS if timeout is None else timeout
+        self._closing = True
+        self._wakeup.set()
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            logging.warning(f"Conversation journal closed with {len(self._buffer)} turns not written.")
+        except Exception as e:
+            logging.error(f"Conversation journal stopped with error: {e}")
+        self._task = None
+
+    async def load_history(self, session_id, max_messages):
+        """
+        Các tin nhắn gần nhất của phiên dạng {"role", "parts"} (như ChatHistory), gồm cả lượt chưa được ghi xuống.
+        Trả về list rỗng nếu phiên chưa có lượt nào.
+        """
+        max_turns = max(max_messages // 2, 1)
+        pending = [doc for doc in [*self._writing, *self._buffer] if doc["session_id"] == session_id][-max_turns:]
+        stored = []
+        collection = self._get_collection()
+        if len(pending) < max_turns and collection is not None:
+            stored = await executor_module.run("db", _find_recent, collection, session_id, max_turns)
+        pending_ids = {doc["_id"] for doc in pending}
+        turns = [doc for doc in stored if doc.get("_id") not in pending_ids] + pending
+        messages = []
+        for turn in turns[-max_turns:]:
+            messages.append({"role": "user", "parts": [turn["question"]]})
+            messages.append({"role": "model", "parts": [turn["answer"]]})
+        return messages
+
+    def stats(self):
+        return {
+            "buffered": len(self._buffer) + len(self._writing),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed_batches": self.failed_batches,
+        }
+
+
+# Nhật ký dùng chung của tiến trình (None nếu JOURNAL_ENABLED = false)
+journal = ConversationJournal() if config.JOURNAL_ENABLED else None
@@ -1,28 +1,24 @@
 # llm_module.py
-import google.generativeai as genai
 import config
 import re
 import json
 import logging
-import traceback
+import functools
+import hashlib
+import threading
+import cache_module
+import query_module
+import prompt_module
+import metrics_module
+import log_module
+import resilience_module
+import time
 
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(levelname)s - %(message)s",
 )
 
-# Cấu hình API Key
-try:
-    genai.configure(api_key=config.GOOGLE_API_KEY)
-    # Lưu ý: gemini-2.0-flash có thể không phải là model mới nhất hoặc phù hợp nhất.
-    # Kiểm tra tài liệu Gemini để chọn model phù hợp với nhu cầu và khả năng xử lý context.
-    # gemini-pro hoặc các model mới hơn có thể xử lý context dài tốt hơn.
-    model = genai.GenerativeModel('gemini-2.0-flash')
-    print("Đã cấu hình Google Generative AI SDK với model gemini.")
-except Exception as e:
-    print(f"Lỗi cấu hình Google Generative AI SDK: {e}")
-    model = None
-
 SYSTEM_PROMPT = """Bạn là trợ lý ảo của siêu thị ABC, giúp khách hàng mua sắm.
 Bạn có thể trả lời về thông tin sản phẩm, giá, khuyến mãi, danh mục, thương hiệu.
 Trả lời ngắn gọn, rõ ràng, dùng thông tin từ cơ sở dữ liệu nếu có.
@@ -30,107 +26,364 @@ Nếu không có thông tin, xin lỗi và đề nghị hỏi lại hoặc liên
 Hãy duy trì tính liên tục của cuộc trò chuyện dựa trên lịch sử được cung cấp.
 """
 
-# Thay đổi tham số đầu vào
-def get_chatbot_response(chat_history, db_context=None):
+# Model Gemini được tạo khi cần lần đầu (không tạo lúc import) để mỗi tiến trình worker
+# sau khi fork có kết nối gRPC/HTTP riêng. SDK google-generativeai (nạp mất vài giây) cũng chỉ được import lúc đó.
+model = None
+_configure_lock = threading.Lock()
+
+def configure():
+    """Cấu hình API Key và tạo model nếu chưa có. Trả về model, hoặc None nếu lỗi."""
+    global model
+    if model is not None:
+        return model
+    with _configure_lock:
+        if model is None:
+            try:
+                import google.generativeai as genai
+                genai.configure(api_key=config.GOOGLE_API_KEY)
+                # Lưu ý: gemini-2.0-flash có thể không phải là model mới nhất hoặc phù hợp nhất.
+                # Kiểm tra tài liệu Gemini để chọn model phù hợp với nhu cầu và khả năng xử lý context.
+                # gemini-pro hoặc các model mới hơn có thể xử lý context dài tốt hơn.
+                model = genai.GenerativeModel('gemini-2.0-flash', system_instruction=SYSTEM_PROMPT)
+                print("Đã cấu hình Google Generative AI SDK với model gemini.")
+            except Exception as e:
+                print(f"Lỗi cấu hình Google Generative AI SDK: {e}")
+    return model
+
+def get_model():
+    return model if model is not None else configure()
+
+# Mẫu phát hiện thông tin cá nhân (số điện thoại, số tài khoản...) trong câu trả lời
+PERSONAL_INFO_PATTERN = re.compile(r"\d{10,}")
+PERSONAL_INFO_REFUSAL = "Xin lỗi, tôi không được phép cung cấp thông tin cá nhân."
+
+def _build_prompt_parts(chat_history, db_context=None, summary=""):
     """
-    Gửi yêu cầu đến Gemini và nhận phản hồi, sử dụng lịch sử chat.
-    chat_history: list các dict dạng {"role": "user/model", "parts": ["message"]}
+    Lắp ráp prompt cho Gemini trong ngân sách token (xem prompt_module.build_prompt).
+    SYSTEM_PROMPT được gửi qua system_instruction của model nên không lặp lại trong contents.
     """
-    if not model:
-        return "Lỗi: Chưa khởi tạo được mô hình Gemini."
+    full_prompt_parts, estimated_tokens = prompt_module.build_prompt(chat_history, db_context, summary)
+    if db_context:
+        logging.info("\n--- Gửi kèm ngữ cảnh từ DB đến LLM (trong lịch sử) ---")
+    logging.info(f"Prompt: {len(full_prompt_parts)} messages, ~{estimated_tokens} tokens.")
 
-    if not chat_history:
-        logging.error("get_chatbot_response được gọi với chat_history rỗng.")
-        return "Xin lỗi, đã có lỗi xảy ra với phiên chat."
+    # Hoặc log toàn bộ nếu cần debug kỹ (chỉ được dựng khi DEBUG bật, bị cắt ngắn theo LOG_MAX_FIELD_CHARS)
+    logging.debug(
+        "Full prompt to Gemini: %s", log_module.lazy(lambda: json.dumps(full_prompt_parts, ensure_ascii=False)),
+        extra={"event": "llm_prompt"},
+    )
+    return full_prompt_parts
 
-    # Xây dựng prompt hoàn chỉnh
-    # SYSTEM_PROMPT và lời chào mở đầu luôn được thêm vào đầu nếu đây là lần tương tác đầu tiên
-    # Hoặc, nếu bạn muốn SYSTEM_PROMPT luôn là một phần của mọi yêu cầu:
-    full_prompt_parts = [
-        {"role": "user", "parts": [SYSTEM_PROMPT]},
-        {"role": "model", "parts": ["Chào bạn, tôi có thể giúp gì cho bạn?"]}, # Lời chào mở đầu
-    ]
+def _empty_response_message(response):
+    """Thông báo cho trường hợp Gemini không trả về nội dung (bị chặn, vấn đề an toàn...)."""
+    block_reason_msg = ""
+    if response.prompt_feedback and response.prompt_feedback.block_reason:
+        block_reason_msg = f" Yêu cầu bị chặn: {response.prompt_feedback.block_reason_message or response.prompt_feedback.block_reason}"
+        logging.error(block_reason_msg)
 
-    # Nối lịch sử chat hiện tại (đã bao gồm tin nhắn mới nhất của người dùng)
-    full_prompt_parts.extend(chat_history)
-
-    # Xử lý db_context nếu có
-    # Cách tiếp cận: Thêm db_context vào cuối tin nhắn user cuối cùng trong history
-    # (Lưu ý: history được truyền vào đã chứa tin nhắn mới nhất của user)
-    if db_context and full_prompt_parts:
-        # Tìm tin nhắn user cuối cùng để gắn db_context
-        # Tuy nhiên, với cách chúng ta xây dựng history, tin nhắn cuối cùng trong `chat_history`
-        # truyền vào `get_chatbot_response` chính là tin nhắn mới nhất của user.
-        last_message_in_history = full_prompt_parts[-1]
-        if last_message_in_history.get("role") == "user":
-            original_user_part = last_message_in_history["parts"][0]
-            last_message_in_history["parts"] = [
-                f"{original_user_part}\n\nThông tin từ siêu thị (nếu liên quan):\n---\n{db_context}\n---\nHãy trả lời câu hỏi trên DỰA VÀO thông tin này và lịch sử trò chuyện."
-            ]
-            logging.info("\n--- Gửi kèm ngữ cảnh từ DB đến LLM (trong lịch sử) ---")
-        else:
-            # Trường hợp hiếm: tin nhắn cuối không phải của user, thêm db_context như một phần user mới
-            # Điều này không nên xảy ra với logic hiện tại.
-            logging.warning("Could not easily append db_context to the last user message in history.")
-            full_prompt_parts.append(
-                 {"role": "user", "parts": [f"Thông tin bổ sung từ cơ sở dữ liệu có thể liên quan: {db_context}"]}
-            )
+    # Kiểm tra safety ratings nếu có
+    safety_ratings_issues = []
+    if response.candidates:
+        for candidate in response.candidates:
+            if candidate.safety_ratings:
+                for rating in candidate.safety_ratings:
+                    if rating.probability.value > 0: # HARASSMENT, HATE_SPEECH, SEXUALLY_EXPLICIT, DANGEROUS_CONTENT
+                        safety_ratings_issues.append(f"{rating.category.name}: {rating.probability.name}")
+    if safety_ratings_issues:
+         logging.error(f"Phản hồi có vấn đề về an toàn: {'; '.join(safety_ratings_issues)}")
+         return f"Xin lỗi, tôi không thể tạo phản hồi do vấn đề về an toàn nội dung.{block_reason_msg}"
+
+    logging.error(f"Gemini không trả về nội dung.{block_reason_msg}")
+    return f"Xin lỗi, tôi không thể tạo phản hồi vào lúc này.{block_reason_msg}"
+
+# Thông báo cho người dùng theo loại lỗi (resilience_module.classify)
+_API_ERROR_MESSAGES = {
+    "auth": "Lỗi: API Key không hợp lệ hoặc không có quyền truy cập.",
+    "unsupported_location": "Lỗi: Yêu cầu từ vị trí của bạn không được phép.",
+    "unavailable": "Lỗi: Không thể kết nối đến máy chủ.",
+}
+FALLBACK_REPLY = "Xin lỗi, trợ lý đang tạm thời quá tải. Bạn vui lòng thử lại sau ít phút."
 
+def _api_error_message(e):
+    """Chuyển exception khi gọi Gemini thành thông báo cho người dùng."""
+    kind = resilience_module.classify(e)
+    logging.error(f"Lỗi khi gọi API Gemini ({kind}): {e}", exc_info=True)
+    return _API_ERROR_MESSAGES.get(kind, "Lỗi giao tiếp với AI.")
 
-    # Ghi log prompt cuối cùng gửi đi (chỉ một phần để tránh quá dài)
-    # logging.info(f"Final prompt to Gemini (first 2 parts and last part): {full_prompt_parts[:2]} ... {full_prompt_parts[-1:] if full_prompt_parts else ''}")
-    # Hoặc log toàn bộ nếu cần debug kỹ:
-    logging.debug(f"Full prompt to Gemini: {json.dumps(full_prompt_parts, ensure_ascii=False, indent=2)}")
+def _degraded_answer(e, key=None):
+    """
+    Câu trả lời khi Gemini tạm thời không dùng được (lỗi mạng, quá tải, hết deadline, circuit breaker mở):
+    câu trả lời cũ cho đúng câu hỏi này nếu còn trong stale_cache, nếu không thì FALLBACK_REPLY.
+    """
+    logging.warning(f"Gemini không khả dụng ({resilience_module.classify(e)}): {e}")
+    if key is not None and stale_cache is not None:
+        stale = stale_cache.get(key)
+        if stale is not cache_module.MISSING:
+            logging.info("Dùng câu trả lời cũ trong cache thay cho Gemini.")
+            return stale
+    return FALLBACK_REPLY
+
+# Cache câu trả lời và gộp các yêu cầu giống nhau đang chạy đồng thời (single-flight)
+response_cache = None
+if config.LLM_CACHE_SIZE > 0 and config.LLM_CACHE_TTL > 0:
+    response_cache = cache_module.TTLCache(config.LLM_CACHE_SIZE, config.LLM_CACHE_TTL)
+_in_flight = cache_module.SingleFlight()
+# Giữ câu trả lời lâu hơn LLM_CACHE_TTL, chỉ đọc khi Gemini lỗi (stale-if-error)
+stale_cache = None
+if config.LLM_CACHE_SIZE > 0 and config.LLM_STALE_CACHE_TTL > 0:
+    stale_cache = cache_module.TTLCache(config.LLM_CACHE_SIZE, config.LLM_STALE_CACHE_TTL)
+
+# Deadline, thử lại, hedge và circuit breaker cho mọi lời gọi Gemini của tiến trình
+llm_caller = resilience_module.ResilientCaller(
+    "gemini",
+    deadline=config.LLM_DEADLINE_SECONDS,
+    retries=config.LLM_RETRIES,
+    backoff=config.LLM_RETRY_BACKOFF,
+    hedge=config.LLM_HEDGE,
+    hedge_min_delay=config.LLM_HEDGE_MIN_DELAY,
+    breaker=resilience_module.CircuitBreaker(
+        "gemini", config.LLM_BREAKER_FAILURES, config.LLM_BREAKER_RESET_SECONDS
+    ),
+    max_attempts_in_flight=config.LLM_MAX_ATTEMPTS_IN_FLIGHT,
+)
+
+def _remember(key, answer):
+    response_cache.set(key, answer)
+    if stale_cache is not None:
+        stale_cache.set(key, answer)
+
+def response_cache_key(chat_history, db_context=None, summary=""):
+    """
+    Khóa cache: hash của tin nhắn người dùng cuối (đã chuẩn hóa), db_context,
+    bản tóm tắt hội thoại và dấu vân tay của LLM_CACHE_HISTORY_MESSAGES tin nhắn trước đó.
+    """
+    last_message = chat_history[-1]
+    recent = chat_history[-1 - config.LLM_CACHE_HISTORY_MESSAGES:-1] if config.LLM_CACHE_HISTORY_MESSAGES > 0 else []
+    digest = hashlib.sha256()
+    digest.update(query_module.normalize(" ".join(last_message["parts"])).encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update((db_context or "").encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update((summary or "").encode("utf-8"))
+    for message in recent:
+        digest.update(b"\x00")
+        digest.update(message["role"].encode("utf-8"))
+        digest.update(b"\x01")
+        digest.update(" ".join(message["parts"]).encode("utf-8"))
+    return digest.hexdigest()
+
+def cache_stats():
+    """Thống kê cache câu trả lời; saved_calls = số lần không phải gọi Gemini."""
+    stats = response_cache.stats() if response_cache is not None else {"hits": 0, "misses": 0}
+    stats["coalesced"] = _in_flight.shared
+    stats["saved_calls"] = stats["hits"] + _in_flight.shared
+    return stats
 
+def _call_model(full_prompt_parts, timeout):
+    """Một lần gọi generate_content; timeout (giây còn lại của deadline) được truyền cho SDK để yêu cầu tự hủy."""
+    with metrics_module.timed("llm_api"):
+        response = get_model().generate_content(full_prompt_parts, request_options={"timeout": timeout})
+    metrics_module.record_llm_usage(getattr(response, "usage_metadata", None))
+    return response
 
+def _generate_answer(full_prompt_parts, key=None):
+    """
+    Gọi Gemini qua llm_caller (deadline, thử lại, hedge, circuit breaker). Trả về (câu trả lời, có_thể_cache).
+    key: khóa cache của câu hỏi, để trả lời bằng câu trả lời cũ khi Gemini lỗi.
+    """
     try:
         logging.info("\nĐang gửi yêu cầu đến Gemini...")
         # Sử dụng `generate_content` với toàn bộ `full_prompt_parts`
-        response = model.generate_content(full_prompt_parts)
+        response = llm_caller.call(functools.partial(_call_model, full_prompt_parts))
 
         if response.parts:
             answer = response.text
             logging.info("Gemini đã phản hồi.")
 
-            if re.search(r"\d{10,}", answer):
+            if PERSONAL_INFO_PATTERN.search(answer):
                 logging.warning("Cảnh báo: Câu trả lời có thể chứa thông tin cá nhân!")
-                answer = "Xin lỗi, tôi không được phép cung cấp thông tin cá nhân."
-            return answer
+                answer = PERSONAL_INFO_REFUSAL
+            return answer, True
         else:
             # Xử lý trường hợp bị chặn hoặc không có phản hồi
-            block_reason_msg = ""
-            if response.prompt_feedback and response.prompt_feedback.block_reason:
-                block_reason_msg = f" Yêu cầu bị chặn: {response.prompt_feedback.block_reason_message or response.prompt_feedback.block_reason}"
-                logging.error(block_reason_msg)
-
-            # Kiểm tra safety ratings nếu có
-            safety_ratings_issues = []
-            if response.candidates:
-                for candidate in response.candidates:
-                    if candidate.safety_ratings:
-                        for rating in candidate.safety_ratings:
-                            if rating.probability.value > 0: # HARASSMENT, HATE_SPEECH, SEXUALLY_EXPLICIT, DANGEROUS_CONTENT
-                                safety_ratings_issues.append(f"{rating.category.name}: {rating.probability.name}")
-            if safety_ratings_issues:
-                 logging.error(f"Phản hồi có vấn đề về an toàn: {'; '.join(safety_ratings_issues)}")
-                 return f"Xin lỗi, tôi không thể tạo phản hồi do vấn đề về an toàn nội dung.{block_reason_msg}"
-
-
-            logging.error(f"Gemini không trả về nội dung.{block_reason_msg}")
-            return f"Xin lỗi, tôi không thể tạo phản hồi vào lúc này.{block_reason_msg}"
+            return _empty_response_message(response), False
 
     except Exception as e:
-        logging.error(f"Lỗi khi gọi API Gemini: {e}\n{traceback.format_exc()}")
-        error_details = str(e)
-        if "API key not valid" in error_details:
-            return "Lỗi: API Key không hợp lệ."
-        elif "ConnectTimeoutError" in error_details or "Max retries exceeded" in error_details:
-            return "Lỗi: Không thể kết nối đến máy chủ."
-        # Thêm các lỗi cụ thể khác của Gemini nếu có
-        elif "UserLocationValidationError" in error_details:
-            return "Lỗi: Yêu cầu từ vị trí của bạn không được phép."
-        else:
-            return f"Lỗi giao tiếp với AI: {error_details}"
+        if resilience_module.classify(e) in resilience_module.DEGRADED_KINDS:
+            return _degraded_answer(e, key), False
+        return _api_error_message(e), False
+
+# Thay đổi tham số đầu vào
+@metrics_module.timed("llm")
+def get_chatbot_response(chat_history, db_context=None, use_cache=True, summary=""):
+    """
+    Gửi yêu cầu đến Gemini và nhận phản hồi, sử dụng lịch sử chat.
+    chat_history: list các dict dạng {"role": "user/model", "parts": ["message"]}
+    summary: tóm tắt các lượt cũ đã bị đẩy khỏi lịch sử (prompt_module.ChatHistory.summary)
+    use_cache: False để luôn gọi Gemini (ví dụ khi người dùng tắt cache cho cuộc trò chuyện)
+    """
+    if not get_model():
+        return "Lỗi: Chưa khởi tạo được mô hình Gemini."
+
+    if not chat_history:
+        logging.error("get_chatbot_response được gọi với chat_history rỗng.")
+        return "Xin lỗi, đã có lỗi xảy ra với phiên chat."
+
+    if not use_cache or response_cache is None:
+        answer, _ = _generate_answer(_build_prompt_parts(chat_history, db_context, summary))
+        return answer
+
+    key = response_cache_key(chat_history, db_context, summary)
+    cached = response_cache.get(key)
+    if cached is not cache_module.MISSING:
+        logging.info("Dùng câu trả lời đã cache cho yêu cầu giống hệt.")
+        return cached
+
+    def generate():
+        answer, cacheable = _generate_answer(_build_prompt_parts(chat_history, db_context, summary), key)
+        if cacheable:
+            _remember(key, answer)
+        return answer
+
+    return _in_flight.do(key, generate)
+
+class PIIStreamFilter:
+    """
+    Phiên bản tăng dần của kiểm tra PERSONAL_INFO_PATTERN cho chế độ streaming.
+    Giữ lại dãy chữ số ở cuối mỗi chunk (có thể nối thành 10+ chữ số ở chunk sau)
+    cho đến khi chắc chắn an toàn. Khi phát hiện, `tripped` = True và không phát thêm gì.
+    """
+
+    def __init__(self):
+        self._pending = ""
+        self.tripped = False
+
+    def feed(self, chunk):
+        """Nhận một chunk, trả về phần văn bản an toàn để gửi ngay."""
+        if self.tripped or not chunk:
+            return ""
+        text = self._pending + chunk
+        if PERSONAL_INFO_PATTERN.search(text):
+            self.tripped = True
+            self._pending = ""
+            return ""
+        # Dãy số cuối chưa đủ 10 chữ số: giữ lại chờ chunk tiếp theo
+        cut = len(text)
+        while cut > 0 and text[cut - 1].isdigit():
+            cut -= 1
+        self._pending = text[cut:]
+        return text[:cut]
+
+    def flush(self):
+        """Trả về phần còn giữ lại khi stream kết thúc."""
+        pending, self._pending = self._pending, ""
+        return "" if self.tripped else pending
+
+def stream_chatbot_response(chat_history, db_context=None, use_cache=True, summary=""):
+    """
+    Phiên bản streaming của get_chatbot_response (dùng chung cache câu trả lời).
+    Yield các tuple ("delta", text) khi Gemini sinh thêm văn bản, rồi đúng một ("done", câu trả lời cuối).
+    Câu trả lời cuối có thể khác phần đã stream (ví dụ bị thay bằng thông báo chặn thông tin cá nhân hoặc lỗi).
+    """
+    if not get_model():
+        yield ("done", "Lỗi: Chưa khởi tạo được mô hình Gemini.")
+        return
+
+    if not chat_history:
+        logging.error("stream_chatbot_response được gọi với chat_history rỗng.")
+        yield ("done", "Xin lỗi, đã có lỗi xảy ra với phiên chat.")
+        return
+
+    key = None
+    if use_cache and response_cache is not None:
+        key = response_cache_key(chat_history, db_context, summary)
+        cached = response_cache.get(key)
+        if cached is not cache_module.MISSING:
+            logging.info("Dùng câu trả lời đã cache cho yêu cầu giống hệt.")
+            yield ("delta", cached)
+            yield ("done", cached)
+            return
+
+    full_prompt_parts = _build_prompt_parts(chat_history, db_context, summary)
+    pii_filter = PIIStreamFilter()
+    answer_parts = []
+    response = None
+    usage = None
+
+    try:
+        llm_caller.before_call()
+    except resilience_module.CircuitOpenError as e:
+        yield ("done", _degraded_answer(e, key))
+        return
+
+    deadline_at = time.monotonic() + config.LLM_DEADLINE_SECONDS
+    attempt = 0
+    while True:
+        started = time.perf_counter()
+        try:
+            logging.info("\nĐang gửi yêu cầu streaming đến Gemini...")
+            timeout = max(deadline_at - time.monotonic(), 0.001)
+            response = get_model().generate_content(full_prompt_parts, stream=True, request_options={"timeout": timeout})
+            for chunk in response:
+                usage = getattr(chunk, "usage_metadata", None) or usage # Chunk cuối mang tổng số token
+                if not chunk.parts:
+                    continue
+                if not answer_parts:
+                    metrics_module.observe_stage("llm_first_token", time.perf_counter() - started)
+                answer_parts.append(chunk.text)
+                safe_text = pii_filter.feed(chunk.text)
+                if pii_filter.tripped:
+                    break
+                if safe_text:
+                    yield ("delta", safe_text)
+                if time.monotonic() > deadline_at:
+                    raise resilience_module.DeadlineExceededError("Gemini stream exceeded the turn deadline.")
+            break
+        except GeneratorExit: # Nơi gọi dừng đọc (lượt bị hủy): không phải lỗi của Gemini, cũng chưa trả lời xong
+            llm_caller.abandon()
+            raise
+        except Exception as e:
+            metrics_module.STAGE_ERRORS.inc(stage="llm_api")
+            kind = resilience_module.classify(e)
+            delay = llm_caller.retry_delay(attempt)
+            # Chỉ thử lại khi chưa gửi gì cho client (phần đã stream không rút lại được)
+            if (not answer_parts and attempt < llm_caller.retries and kind in resilience_module.TRANSIENT_KINDS
+                    and delay < deadline_at - time.monotonic()):
+                logging.warning(f"Gemini stream attempt {attempt + 1} failed ({kind}), retrying in {delay:.2f}s.")
+                llm_caller.count("retries")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            llm_caller.after_call(e)
+            if not answer_parts and kind in resilience_module.DEGRADED_KINDS:
+                yield ("done", _degraded_answer(e, key))
+            else:
+                yield ("done", _api_error_message(e))
+            return
+        finally:
+            metrics_module.observe_stage("llm_api", time.perf_counter() - started)
+    llm_caller.after_call()
+    metrics_module.record_llm_usage(usage)
+
+    if pii_filter.tripped:
+        logging.warning("Cảnh báo: Câu trả lời có thể chứa thông tin cá nhân!")
+        if key is not None:
+            _remember(key, PERSONAL_INFO_REFUSAL)
+        yield ("done", PERSONAL_INFO_REFUSAL)
+        return
+
+    if not answer_parts:
+        yield ("done", _empty_response_message(response))
+        return
+
+    tail = pii_filter.flush()
+    if tail:
+        yield ("delta", tail)
+    logging.info("Gemini đã phản hồi (streaming).")
+    answer = "".join(answer_parts)
+    if key is not None:
+        _remember(key, answer)
+    yield ("done", answer)
 
 if __name__ == '__main__':
     # Test với lịch sử
@@ -0,0 +1,213 @@
+# log_module.py
+# Ghi log không chặn: bản ghi được đưa vào hàng đợi có giới hạn và một thread nền định dạng (JSON hoặc văn bản) rồi ghi ra.
+# Nội dung tốn kém (lịch sử chat, prompt...) chỉ được tạo khi thật sự ghi (lazy) và bị cắt ngắn;
+# các sự kiện nhiều (mỗi tin nhắn WebSocket...) có thể được lấy mẫu theo tỉ lệ để giữ INFO khi chạy thật.
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+
+import config
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+# Thuộc tính chuẩn của LogRecord, không đưa vào phần "fields" của bản ghi JSON
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def truncate(value, limit=None):
+    """Cắt chuỗi dài, ghi rõ số ký tự bị bỏ."""
+    limit = config.LOG_MAX_FIELD_CHARS if limit is None else limit
+    text = value if isinstance(value, str) else str(value)
+    if limit and len(text) > limit:
+        return f"{text[:limit]}... [{len(text) - limit} chars truncated]"
+    return text
+
+
+class lazy:
+    """
+    Giá trị chỉ được tính khi bản ghi thực sự được ghi (bỏ qua nếu level tắt hoặc không được lấy mẫu):
+    logging.debug("History: %s", log_module.lazy(lambda: list(history)))
+    Làm tham số của message: được tính ở thread gọi log. Làm trường extra: được tính ở thread nền,
+    nên chỉ dùng cho dữ liệu không bị thay đổi sau đó.
+    """
+
+    __slots__ = ("_fn", "_limit")
+
+    def __init__(self, fn, limit=None):
+        self._fn = fn
+        self._limit = limit
+
+    def __str__(self):
+        try:
+            return truncate(self._fn(), self._limit)
+        except Exception as e:
+            return f"<log payload failed: {e}>"
+
+    __repr__ = __str__
+
+
+def parse_sample_rates(spec):
+    """"ws_message=0.1,turn_history=0" -> {"ws_message": 0.1, "turn_history": 0.0}"""
+    rates = {}
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        name, rate = item.split("=", 1)
+        try:
+            rates[name.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            continue
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Giữ lại một phần bản ghi của các sự kiện được cấu hình tỉ lệ (extra={"event": ...}).
+    WARNING trở lên luôn được giữ. Chạy ở thread gọi log, trước khi bản ghi vào hàng đợi.
+    """
+
+    def __init__(self, rates=None):
+        super().__init__()
+        self.rates = dict(rates or {})
+        self.dropped = 0
+
+    def filter(self, record):
+        event = getattr(record, "event", None)
+        if event is None or record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(event, 1.0)
+        if rate >= 1.0 or random.random() < rate:
+            return True
+        self.dropped += 1
+        return False
+
+
+class ContextFilter(logging.Filter):
+    """Gắn trace id của lượt đang xử lý (contextvars chỉ đọc được ở thread gọi log)."""
+
+    def filter(self, record):
+        if not hasattr(record, "trace_id"):
+            import metrics_module # Import muộn: metrics_module có thể được nạp sau log_module
+            record.trace_id = metrics_module.current_trace_id()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Một dòng JSON cho mỗi bản ghi: ts, level, logger, msg, event, trace_id, exc và các trường extra."""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": truncate(record.getMessage(), config.LOG_MAX_MESSAGE_CHARS),
+        }
+        for key, value in vars(record).items():
+            if key in _RECORD_ATTRIBUTES or key.startswith("_") or value is None:
+                continue
+            entry[key] = value if isinstance(value, (int, float, bool)) else truncate(value)
+        if record.exc_info:
+            entry["exc"] = truncate(self.formatException(record.exc_info), config.LOG_MAX_MESSAGE_CHARS)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record):
+        text = super().format(record)
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            text = f"{text} [trace={trace_id}]"
+        return truncate(text, config.LOG_MAX_MESSAGE_CHARS)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Đưa bản ghi vào hàng đợi mà không định dạng ở thread gọi log (QueueHandler chuẩn định dạng ngay trong prepare()).
+    Hàng đợi đầy thì bỏ bản ghi và đếm lại, không bao giờ chặn loop.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Chốt nội dung message ngay (tham số có thể là đối tượng sẽ bị thay đổi sau đó), còn định dạng thì để thread nền
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+_listener = None
+_handler = None
+_lock = threading.Lock()
+
+
+def setup_logging(level=None, log_format=None, sample_rates=None, stream=None):
+    """
+    Cấu hình root logger (gọi một lần khi khởi động; gọi lại sẽ thay cấu hình cũ).
+    log_format: "json" hoặc "text". sample_rates: {event: tỉ lệ 0-1}, mặc định LOG_SAMPLE_RATES.
+    """
+    global _listener, _handler
+    level = level or config.LOG_LEVEL
+    log_format = log_format or config.LOG_FORMAT
+    rates = parse_sample_rates(config.LOG_SAMPLE_RATES) if sample_rates is None else sample_rates
+
+    with _lock:
+        shutdown()
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter())
+        log_queue = queue.Queue(maxsize=config.LOG_QUEUE_SIZE)
+        _handler = NonBlockingQueueHandler(log_queue)
+        _handler.addFilter(SamplingFilter(rates))
+        _handler.addFilter(ContextFilter())
+        _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+        _listener.start()
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_handler)
+        root.setLevel(level)
+    return _handler
+
+
+def shutdown():
+    """Ghi nốt các bản ghi còn trong hàng đợi và dừng thread nền."""
+    global _listener, _handler
+    if _listener is not None:
+        try:
+            _listener.stop()
+        except queue.Full: # Sau fork thread nền không còn chạy và hàng đợi có thể đã đầy
+            pass
+        for handler in _listener.handlers:
+            handler.flush()
+        _listener = None
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+        _handler = None
+
+
+def stats():
+    if _handler is None:
+        return {"dropped_queue_full": 0, "dropped_sampling": 0}
+    sampler = next((f for f in _handler.filters if isinstance(f, SamplingFilter)), None)
+    return {"dropped_queue_full": _handler.dropped, "dropped_sampling": sampler.dropped if sampler else 0}
+
+
+atexit.register(shutdown)
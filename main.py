@@ -1,86 +1,335 @@
+import asyncio
+import collections
+import logging
+import threading
+import time
+
+import config
 import stt_module
 import db_module
 import llm_module
 import tts_module # Bỏ comment và import module TTS mới
+import query_module
+import search_module
+import log_module
+import metrics_module
+import executor_module # Chạy STT/MongoDB/Gemini/TTS trong thread pool để các giai đoạn chạy chồng lên nhau
+import scheduler_module
+from prompt_module import ChatHistory # Cửa sổ trượt, lượt cũ được gộp vào bản tóm tắt (như server)
+
+# Các câu nói cố định, được tổng hợp giọng nói trước khi bắt đầu (tts_module.prewarm)
+WELCOME_MESSAGE = "Chào mừng bạn đến với Chatbot Hỗ trợ!" # MVP đã bỏ bớt
+INSTRUCTION_MESSAGE = "Nói 'tạm biệt' để kết thúc."
+FAREWELL_MESSAGE = "Cảm ơn bạn đã sử dụng chatbot. Tạm biệt!"
+STT_FAIL_MESSAGE = "Vui lòng thử nói lại hoặc nói rõ hơn."
+
+# playsound không dừng được giữa chừng: câu đang phát dở của lượt bị hủy phải phát xong trước câu của lượt mới
+_playback_lock = threading.Lock()
+
+def _play_locked(audio, text):
+    with _playback_lock:
+        tts_module.play(audio, text)
+
+async def say(text):
+    """Nói một câu cố định (đã prewarm) mà không chặn loop."""
+    audio = await executor_module.run("tts", tts_module.synthesize, text)
+    await executor_module.run("tts", _play_locked, audio, text)
 
-def should_search_db(query_text):
+def is_echo(heard, speaking, threshold=None, min_tokens=4):
     """
-    Quyết định xem có nên tìm kiếm trong DB hay không dựa trên từ khóa.
-    Đây là logic rất cơ bản cho MVP.
+    Câu micro nghe được có phải là tiếng của chính chatbot phát ra loa không: phần lớn các cặp từ liên tiếp
+    của nó có trong câu trả lời đang đọc. Câu ngắn (dưới min_tokens từ) không bao giờ bị coi là tiếng vọng,
+    để khách vẫn ngắt được bằng "dừng lại", "cái khác"... kể cả khi nhắc lại tên sản phẩm.
     """
-    if not query_text:
+    threshold = config.KIOSK_ECHO_OVERLAP if threshold is None else threshold
+    heard_tokens = search_module.tokenize(heard)
+    if not speaking or len(heard_tokens) < min_tokens:
         return False
-    query_lower = query_text.lower()
-    # Các từ khóa gợi ý cần tra cứu DB
-    db_keywords = ["giá", "khuyến mãi", "sản phẩm", "hàng", "cửa hàng", "ở đâu", "mở cửa"]
-    for keyword in db_keywords:
-        if keyword in query_lower:
+    spoken_tokens = search_module.tokenize(speaking)
+    spoken_pairs = set(zip(spoken_tokens, spoken_tokens[1:]))
+    pairs = list(zip(heard_tokens, heard_tokens[1:]))
+    return sum(1 for pair in pairs if pair in spoken_pairs) / len(pairs) >= threshold
+
+
+class Speaker:
+    """
+    Đọc một câu trả lời theo từng câu ngay khi câu đó có (kể cả khi Gemini còn đang sinh phần sau).
+    Mỗi câu được tổng hợp ở pool "tts" ngay khi nhận, tối đa TTS_PIPELINE_LOOKAHEAD câu chờ phát,
+    và được phát lần lượt đúng thứ tự. cancel() bỏ các câu chưa phát (barge-in).
+    """
+
+    def __init__(self, lookahead=None):
+        lookahead = config.TTS_PIPELINE_LOOKAHEAD if lookahead is None else lookahead
+        self._slots = asyncio.Semaphore(max(lookahead, 1) + 1) # Câu đang phát + các câu tổng hợp trước
+        self._pending = collections.deque() # (câu, task tổng hợp) theo thứ tự phát
+        self._ready = asyncio.Event()
+        self._closed = False
+        self._player = asyncio.create_task(self._play_all())
+        self.spoken = [] # Các câu đã/đang được phát, để nhận ra tiếng vọng khi nghe chen ngang
+        self.first_audio_at = None
+
+    @property
+    def text(self):
+        return " ".join(self.spoken + [sentence for sentence, _ in self._pending])
+
+    def say(self, sentence):
+        if self._closed:
+            return
+        self._pending.append((sentence, asyncio.create_task(self._synthesize(sentence))))
+        self._ready.set()
+
+    async def _synthesize(self, sentence):
+        await self._slots.acquire() # Được trả lại sau khi câu này phát xong, hoặc ngay nếu tổng hợp lỗi/bị bỏ
+        try:
+            return await executor_module.run("tts", tts_module.synthesize, sentence)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def _play_all(self):
+        while True:
+            if not self._pending:
+                if self._closed:
+                    return
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            sentence, task = self._pending.popleft()
+            try:
+                audio = await task
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Lỗi TTS: {e}")
+                continue
+            if self.first_audio_at is None:
+                self.first_audio_at = time.monotonic()
+            self.spoken.append(sentence)
+            try:
+                await executor_module.run("tts", _play_locked, audio, sentence)
+            finally:
+                self._slots.release()
+
+    async def finish(self):
+        """Chờ phát hết các câu đã nhận."""
+        self._closed = True
+        self._ready.set()
+        await self._player
+
+    def clear(self):
+        """Bỏ các câu chưa phát (câu đang phát vẫn phát nốt)."""
+        while self._pending:
+            _, task = self._pending.popleft()
+            if task.done():
+                # Đã tổng hợp xong nên vẫn giữ chỗ (chỉ _play_all trả lại sau khi phát): trả lại ở đây.
+                # Câu tổng hợp lỗi đã tự trả chỗ trong _synthesize
+                if not task.cancelled() and task.exception() is None:
+                    self._slots.release()
+            else:
+                task.cancel()
+
+    def cancel(self):
+        self._closed = True
+        self.clear()
+        self._player.cancel()
+
+
+class Kiosk:
+    """
+    Vòng hội thoại bằng giọng nói cho một kiosk tại cửa hàng, chạy trên asyncio:
+    - micro nghe liên tục ở pool "stt" (kể cả khi chatbot đang nói) để khách nói chen ngang (KIOSK_BARGE_IN);
+    - mỗi lượt chạy qua TurnScheduler: câu nói mới hủy lượt đang xử lý/đang đọc;
+    - tra cứu MongoDB chạy song song với việc chuẩn bị lượt gọi Gemini, câu trả lời được stream
+      và đọc từng câu ngay khi có;
+    - lịch sử hội thoại có giới hạn (ChatHistory) như server.
+    """
+
+    def __init__(self):
+        self.history = ChatHistory(maxlen=config.KIOSK_HISTORY_TURNS * 2)
+        self.scheduler = scheduler_module.TurnScheduler(name="kiosk")
+        self.speaker = None # Speaker của lượt đang đọc câu trả lời
+        self.last_answer = "" # Câu trả lời vừa đọc xong: micro có thể vẫn đang thu tiếng vọng của nó
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.turns = 0
+
+    @property
+    def busy(self):
+        return not self._idle.is_set()
+
+    async def greet(self):
+        print(WELCOME_MESSAGE)
+        await say(WELCOME_MESSAGE) # Nói lời chào
+        print(INSTRUCTION_MESSAGE)
+        # tts_module.speak(INSTRUCTION_MESSAGE) # Có thể nói hoặc không tùy bạn
+
+    async def run(self):
+        """Nghe và xử lý các câu nói cho đến khi khách nói 'tạm biệt'."""
+        await self.greet()
+        try:
+            while True:
+                if not config.KIOSK_BARGE_IN:
+                    await self._idle.wait() # Không nghe khi chatbot đang xử lý/đang nói
+                # 1. Nhận giọng nói và chuyển thành văn bản
+                user_input = await executor_module.run("stt", stt_module.listen_and_recognize)
+                if await self.on_utterance(user_input, time.monotonic()):
+                    break
+        finally:
+            await self.scheduler.close()
+            if self.speaker is not None:
+                self.speaker.cancel()
+
+    async def on_utterance(self, user_input, heard_at):
+        """Xử lý một câu nghe được; trả về True khi kết thúc phiên."""
+        if not user_input:
+            if not self.busy:
+                # Xử lý trường hợp STT không thành công (đã in lỗi trong stt_module)
+                print(STT_FAIL_MESSAGE)
+                # tts_module.speak(STT_FAIL_MESSAGE) # Thông báo cho người dùng
+            return False
+
+        speaking = self.speaker.text if self.speaker is not None else self.last_answer
+        if is_echo(user_input, speaking):
+            logging.info(f"Ignoring echo of the chatbot's own speech: '{user_input}'")
+            return False
+
+        # Kiểm tra điều kiện thoát
+        if "tạm biệt" in user_input.lower():
+            await self.scheduler.close()
+            print(FAREWELL_MESSAGE)
+            await say(FAREWELL_MESSAGE) # Dùng TTS
             return True
-    return False
 
-def main_loop():
+        if self.busy:
+            print("\n(Khách nói chen ngang, dừng câu trả lời trước)")
+        self._idle.clear()
+        self.scheduler.submit(lambda: self.turn(user_input, heard_at))
+        return False
+
+    async def turn(self, user_input, heard_at):
+        try:
+            with metrics_module.timed("turn"):
+                await self._turn(user_input, heard_at)
+        except Exception as e:
+            logging.error(f"Kiosk turn failed: {e}", exc_info=True)
+            print("Xin lỗi, chatbot gặp lỗi khi xử lý câu hỏi. Vui lòng thử lại.")
+        finally:
+            if self.speaker is not None:
+                self.last_answer = self.speaker.text
+                self.speaker.cancel()
+                self.speaker = None
+            if not self.scheduler.pending:
+                self._idle.set()
+
+    async def _turn(self, user_input, heard_at):
+        # 2. Quyết định có tìm kiếm DB không; tra cứu chạy nền trong khi chuẩn bị lời gọi Gemini
+        context = None
+        db_seconds = None
+        analysis = query_module.analyze(user_input)
+        db_task = None
+        if analysis.should_search:
+            print("Đang tìm kiếm thông tin trong cơ sở dữ liệu...")
+            db_task = asyncio.create_task(self._search(user_input, analysis))
+
+        # Câu hỏi chỉ vào lịch sử cùng câu trả lời khi Gemini trả lời xong: lượt bị khách nói chen ngang
+        # (hủy giữa chừng) không để lại tin nhắn "user" không có câu trả lời trong prompt của lượt sau
+        user_message = {"role": "user", "parts": [user_input]}
+        messages, summary = list(self.history) + [user_message], self.history.summary
+        if db_task is not None:
+            try:
+                context, db_seconds = await db_task
+            except asyncio.CancelledError:
+                db_task.cancel()
+                raise
+            if context:
+                print("Đã tìm thấy thông tin liên quan.")
+            else:
+                print("Không tìm thấy thông tin cụ thể trong DB, sẽ hỏi AI chung.")
+
+        # 3. Gọi LLM (streaming) và 4. đọc từng câu ngay khi Gemini sinh xong câu đó
+        print("Chatbot đang suy nghĩ...")
+        self.speaker = speaker = Speaker()
+        sentences = tts_module.SentenceBuffer()
+        streamed = []
+        response = None
+        first_token_at = None
+        print("\nChatbot trả lời:")
+        async for kind, text in executor_module.iterate(
+            "llm", llm_module.stream_chatbot_response, messages, db_context=context, summary=summary,
+        ):
+            if kind == "delta":
+                if first_token_at is None:
+                    first_token_at = time.monotonic()
+                streamed.append(text)
+                print(text, end="", flush=True)
+                for sentence in sentences.feed(text):
+                    speaker.say(sentence)
+            else:
+                response = text
+
+        if response is None:
+            response = "Xin lỗi, đã có lỗi xảy ra."
+        if response != "".join(streamed):
+            # Câu trả lời cuối khác phần đã stream (bị chặn thông tin cá nhân, lỗi...): đọc câu trả lời cuối
+            print(f"\n{response}")
+            speaker.clear()
+            sentences = tts_module.SentenceBuffer()
+            for sentence in sentences.feed(response):
+                speaker.say(sentence)
+        for sentence in sentences.flush():
+            speaker.say(sentence)
+        print()
+        self.history.append(user_message)
+        self.history.append({"role": "model", "parts": [response]})
+
+        await speaker.finish()
+        self.turns += 1
+        self._report_latency(heard_at, db_seconds, first_token_at, speaker)
+        print("\n" + "="*20 + "\n") # Ngăn cách các lượt hội thoại
+
+    async def _search(self, user_input, analysis):
+        started = time.monotonic()
+        context = await db_module.search_knowledge_base_async(user_input, analysis=analysis)
+        return context, time.monotonic() - started
+
+    def _report_latency(self, heard_at, db_seconds, first_token_at, speaker):
+        """In độ trễ của lượt tính từ lúc nhận dạng xong câu nói (đồng hồ thực, gồm cả thời gian phát âm thanh)."""
+        now = time.monotonic()
+        parts = []
+        if db_seconds is not None:
+            parts.append(f"DB {db_seconds:.2f}s")
+        if first_token_at is not None:
+            parts.append(f"token đầu {first_token_at - heard_at:.2f}s")
+        if speaker.first_audio_at is not None:
+            first_audio = speaker.first_audio_at - heard_at
+            metrics_module.observe_stage("kiosk_first_audio", first_audio)
+            parts.append(f"âm thanh đầu {first_audio:.2f}s")
+        parts.append(f"tổng {now - heard_at:.2f}s")
+        print(f"[Lượt {self.turns}] " + ", ".join(parts))
+        logging.info(f"Kiosk turn {self.turns} latency: {', '.join(parts)}")
+
+
+async def main_loop():
     """Vòng lặp chính của chatbot."""
-    welcome_message = "Chào mừng bạn đến với Chatbot Hỗ trợ!" # MVP đã bỏ bớt
-    print(welcome_message)
-    tts_module.speak(welcome_message) # Nói lời chào
-
-    instruction_message = "Nói 'tạm biệt' để kết thúc."
-    print(instruction_message)
-    # tts_module.speak(instruction_message) # Có thể nói hoặc không tùy bạn
-
-    while True:
-        # 1. Nhận giọng nói và chuyển thành văn bản
-        user_input = stt_module.listen_and_recognize()
-
-        if user_input:
-            # Kiểm tra điều kiện thoát
-            if "tạm biệt" in user_input.lower():
-                farewell_message = "Cảm ơn bạn đã sử dụng chatbot. Tạm biệt!"
-                print(farewell_message)
-                tts_module.speak(farewell_message) # Dùng TTS
-                break
-
-            # 2. Quyết định có tìm kiếm DB không
-            context = None
-            if should_search_db(user_input):
-                print("Đang tìm kiếm thông tin trong cơ sở dữ liệu...")
-                # tts_module.speak("Đang tìm kiếm thông tin trong cơ sở dữ liệu.") # Thông báo trạng thái
-                context = db_module.search_knowledge_base(user_input)
-                if context:
-                    print("Đã tìm thấy thông tin liên quan.")
-                    # tts_module.speak("Đã tìm thấy thông tin liên quan.")
-                else:
-                    print("Không tìm thấy thông tin cụ thể trong DB, sẽ hỏi AI chung.")
-                    # tts_module.speak("Không tìm thấy thông tin cụ thể, tôi sẽ dùng AI để trả lời.")
-
-
-            # 3. Gọi LLM để lấy phản hồi
-            print("Chatbot đang suy nghĩ...")
-            # tts_module.speak("Để tôi suy nghĩ một chút...") # Thông báo trạng thái
-            response = llm_module.get_chatbot_response(user_input, db_context=context)
-
-            # 4. Hiển thị và phát phản hồi
-            print("\nChatbot trả lời:")
-            print(response)
-            tts_module.speak(response) # Dùng TTS để đọc phản hồi
-
-            print("\n" + "="*20 + "\n") # Ngăn cách các lượt hội thoại
-
-        else:
-            # Xử lý trường hợp STT không thành công (đã in lỗi trong stt_module)
-            stt_fail_message = "Vui lòng thử nói lại hoặc nói rõ hơn."
-            print(stt_fail_message)
-            # tts_module.speak(stt_fail_message) # Thông báo cho người dùng
+    try:
+        # MONGO_DRIVER = "async": mở pool kết nối async trên loop này
+        await db_module.connect_async()
+        await Kiosk().run()
+    finally:
+        executor_module.shutdown(wait=False)
 
 if __name__ == "__main__":
+    log_module.setup_logging()
     # Kiểm tra kết nối DB và LLM trước khi chạy vòng lặp chính
-    if db_module.collection is None:
+    if db_module.connect() is None:
         error_msg = "Không thể chạy chatbot do lỗi kết nối MongoDB. Vui lòng kiểm tra cấu hình và MongoDB server."
         print(error_msg)
         tts_module.speak(error_msg) # Thông báo lỗi qua TTS
-    elif llm_module.model is None:
+    elif llm_module.configure() is None:
         error_msg = "Không thể chạy chatbot do lỗi cấu hình Google Gemini. Vui lòng kiểm tra API Key."
         print(error_msg)
         tts_module.speak(error_msg) # Thông báo lỗi qua TTS
     else:
-        main_loop()
\ No newline at end of file
+        tts_module.prewarm([WELCOME_MESSAGE, INSTRUCTION_MESSAGE, FAREWELL_MESSAGE, STT_FAIL_MESSAGE])
+        db_module.load_query_vocabulary() # Thương hiệu/danh mục để nhận diện thực thể trong câu hỏi
+        asyncio.run(main_loop())
@@ -0,0 +1,364 @@
+# metrics_module.py
+# Đo thời gian từng giai đoạn của một lượt hội thoại (phân tích câu hỏi, MongoDB, Gemini, STT, TTS, gửi WebSocket),
+# đếm yêu cầu đang chạy, token Gemini và số phiên, rồi xuất theo định dạng văn bản của Prometheus qua HTTP.
+# Cùng endpoint HTTP đó trả lời liveness (/healthz) và readiness (/readyz) cho bộ cân bằng tải / orchestrator.
+import asyncio
+import bisect
+import contextvars
+import functools
+import logging
+import threading
+import time
+import uuid
+
+import config
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+# Mã theo dõi (trace id) của lượt đang xử lý; được executor_module chép sang thread worker cùng contextvars
+trace_id_var = contextvars.ContextVar("trace_id", default=None)
+
+
+def new_trace_id():
+    return uuid.uuid4().hex[:16]
+
+
+def current_trace_id():
+    return trace_id_var.get()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    def _samples(self):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Histogram với các bucket cố định (tích lũy theo chuẩn Prometheus khi xuất)."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {} # nhãn -> [số đếm theo bucket (không tích lũy, thêm +Inf), tổng, số mẫu]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels):
+        series = self._series.get(self._key(labels))
+        return series[2] if series else 0
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [("le", _format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """Giá trị được đọc lúc xuất từ một hàm: fn() -> {tuple nhãn: giá trị} (ví dụ thống kê cache, hàng đợi)."""
+
+    def __init__(self, name, documentation, kind, fn, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self._fn = fn
+
+    def _samples(self):
+        try:
+            values = self._fn()
+        except Exception as e:
+            logging.warning(f"Metric {self.name} collection failed: {e}")
+            return []
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def unregister(self, name):
+        with self._lock:
+            self._metrics.pop(name, None)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "chatbot_stage_seconds", "Duration of each processing stage of a turn.", ["stage"]
+))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    "chatbot_stage_errors_total", "Stages that raised an exception.", ["stage"]
+))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    "chatbot_in_flight_requests", "Requests currently being processed per stage.", ["stage"]
+))
+LLM_TOKENS = REGISTRY.register(Histogram(
+    "chatbot_llm_tokens", "Gemini token usage per request.", ["kind"], buckets=TOKEN_BUCKETS
+))
+LLM_TOKENS_TOTAL = REGISTRY.register(Counter(
+    "chatbot_llm_tokens_total", "Total Gemini tokens used.", ["kind"]
+))
+ACTIVE_SESSIONS = REGISTRY.register(Gauge(
+    "chatbot_active_sessions", "Connected WebSocket clients."
+))
+TURNS = REGISTRY.register(Counter(
+    "chatbot_turns_total", "Finished turns by outcome.", ["outcome"]
+))
+REJECTED = REGISTRY.register(Counter(
+    "chatbot_rejected_total", "Requests answered with a busy event by admission control.", ["reason"]
+))
+PREFETCH = REGISTRY.register(Counter(
+    "chatbot_prefetch_total", "Speculative product lookups from typing/partial_text events by result.", ["result"]
+))
+WS_FRAMES = REGISTRY.register(Counter(
+    "chatbot_ws_sent_frames_total", "WebSocket frames sent to clients.", ["protocol"]
+))
+WS_EVENTS = REGISTRY.register(Counter(
+    "chatbot_ws_sent_events_total", "Events sent to clients (several per frame with protocol v2).", ["protocol"]
+))
+WS_BYTES = REGISTRY.register(Counter(
+    "chatbot_ws_sent_bytes_total", "Encoded payload bytes sent to clients, before permessage-deflate.", ["protocol"]
+))
+
+
+def register_callback(name, documentation, kind, fn, labelnames=()):
+    """Đăng ký (hoặc thay) một metric đọc giá trị lúc xuất."""
+    REGISTRY.unregister(name)
+    return REGISTRY.register(CallbackMetric(name, documentation, kind, fn, labelnames))
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+class timed:
+    """
+    Đo thời gian một giai đoạn: dùng làm decorator (hàm đồng bộ hoặc async) hoặc `with timed("db_search"):`.
+    Đồng thời đếm số yêu cầu đang chạy và số lần lỗi của giai đoạn. Mỗi lần đo dùng một đối tượng mới.
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self._started = None
+
+    def __enter__(self):
+        IN_FLIGHT.inc(stage=self.stage)
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        STAGE_SECONDS.observe(time.perf_counter() - self._started, stage=self.stage)
+        IN_FLIGHT.dec(stage=self.stage)
+        if exc_type is not None and not issubclass(exc_type, (asyncio.CancelledError, GeneratorExit)):
+            STAGE_ERRORS.inc(stage=self.stage)
+        return False
+
+    def __call__(self, fn):
+        stage = self.stage
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with timed(stage):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+def record_llm_usage(usage_metadata):
+    """Ghi số token prompt/đầu ra từ response.usage_metadata của Gemini (bỏ qua nếu không có)."""
+    if usage_metadata is None:
+        return
+    for kind, attribute in (("prompt", "prompt_token_count"), ("output", "candidates_token_count")):
+        tokens = getattr(usage_metadata, attribute, None)
+        if tokens:
+            LLM_TOKENS.observe(tokens, kind=kind)
+            LLM_TOKENS_TOTAL.inc(tokens, kind=kind)
+
+
+# ---------------------------------------------------------------------------
+# Readiness: tên -> hàm không tham số trả về True khi phần đó sẵn sàng.
+# Hàm phải nhanh và không gọi mạng (đọc trạng thái do task nền cập nhật).
+# ---------------------------------------------------------------------------
+
+_readiness_checks = {}
+
+
+def register_readiness_check(name, fn):
+    """Đăng ký (hoặc thay) một điều kiện của /readyz."""
+    _readiness_checks[name] = fn
+
+
+def readiness():
+    """Trả về (sẵn sàng, {tên: True/False}); sẵn sàng khi mọi điều kiện đều đạt."""
+    results = {}
+    for name, fn in list(_readiness_checks.items()):
+        try:
+            results[name] = bool(fn())
+        except Exception as e:
+            logging.warning(f"Readiness check {name} failed: {e}")
+            results[name] = False
+    return all(results.values()), results
+
+
+# ---------------------------------------------------------------------------
+# HTTP endpoint /metrics, /healthz, /readyz
+# ---------------------------------------------------------------------------
+
+def _readiness_response():
+    ready, results = readiness()
+    body = "".join(f"{name} {'ok' if ok else 'fail'}\n" for name, ok in sorted(results.items()))
+    return ("200 OK" if ready else "503 Service Unavailable"), "text/plain; charset=utf-8", body or "ok\n"
+
+
+async def _handle_http(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        while True: # Bỏ qua các header
+            line = await asyncio.wait_for(reader.readline(), 5)
+            if not line or line in (b"\r\n", b"\n"):
+                break
+        parts = request_line.decode("latin-1").split()
+        path = parts[1].split("?", 1)[0] if len(parts) >= 2 else ""
+        method = parts[0] if len(parts) >= 2 else ""
+        if method == "GET" and path == "/metrics":
+            status, content_type, body = "200 OK", "text/plain; version=0.0.4; charset=utf-8", REGISTRY.render()
+        elif method == "GET" and path == "/healthz": # Trả lời được nghĩa là asyncio loop không bị treo
+            status, content_type, body = "200 OK", "text/plain; charset=utf-8", "ok\n"
+        elif method == "GET" and path == "/readyz":
+            status, content_type, body = _readiness_response()
+        else:
+            status, content_type, body = "404 Not Found", "text/plain; charset=utf-8", "Not found\n"
+        payload = body.encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(payload)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + payload
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_http_server(host=None, port=None):
+    """
+    Mở endpoint GET /metrics (Prometheus), /healthz và /readyz. port=0 hoặc METRICS_PORT=0 để tắt.
+    Trả về asyncio Server hoặc None.
+    """
+    host = config.METRICS_HOST if host is None else host
+    port = config.METRICS_PORT if port is None else port
+    if not port:
+        return None
+    server = await asyncio.start_server(_handle_http, host, port)
+    logging.info(f"Metrics endpoint listening on http://{host}:{port}/metrics (probes: /healthz, /readyz)")
+    return server
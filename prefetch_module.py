@@ -0,0 +1,100 @@
+# prefetch_module.py
+# Tra cứu sản phẩm trước (speculative retrieval) từ nội dung client đang gõ hoặc giả thuyết STT tạm thời
+# (sự kiện "typing"/"partial_text"), để khi tin nhắn cuối tới thì ngữ cảnh sản phẩm thường đã có sẵn
+# và bước tra cứu MongoDB không còn nằm trên đường trả lời.
+import asyncio
+import logging
+import time
+
+import config
+import metrics_module
+import query_module
+
+
+def _consume_exception(task):
+    # Tra cứu bị bỏ (có nội dung mới) vẫn có thể lỗi: lấy exception để asyncio không cảnh báo
+    if not task.cancelled():
+        task.exception()
+
+
+class _Slot:
+    __slots__ = ("key", "task", "created_at")
+
+    def __init__(self, key, task):
+        self.key = key
+        self.task = task
+        self.created_at = time.monotonic()
+        task.add_done_callback(_consume_exception)
+
+
+class SpeculativeRetriever:
+    """
+    Một ô kết quả tra cứu trước cho mỗi phiên.
+    update(text): chờ debounce giây không có nội dung mới rồi phân tích câu và tra cứu (nếu cần) ở task nền;
+    nội dung mới cho cùng khóa tra cứu (QueryAnalysis.retrieval_key) dùng lại tra cứu đang có, khóa khác thì thay thế.
+    take(analysis): lấy kết quả cho câu hỏi cuối nếu khóa khớp và chưa quá ttl giây (chờ nốt nếu còn đang tra cứu).
+    search(text, analysis) là coroutine tra cứu của server; nó có thể ném lỗi (ví dụ khi DB đang bận) để bỏ qua lần đoán.
+    """
+
+    def __init__(self, search, debounce=None, ttl=None):
+        self._search = search
+        self.debounce = config.PREFETCH_DEBOUNCE_MS / 1000.0 if debounce is None else debounce
+        self.ttl = config.PREFETCH_TTL_SECONDS if ttl is None else ttl
+        self._timer = None
+        self._slot = None
+
+    def update(self, text):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.create_task(self._after_debounce(text[:config.PREFETCH_MAX_CHARS]))
+
+    async def _after_debounce(self, text):
+        await asyncio.sleep(self.debounce)
+        self._timer = None
+        analysis = query_module.analyze(text)
+        if not analysis.should_search:
+            return
+        key = analysis.retrieval_key()
+        slot = self._slot
+        if slot is not None and slot.key == key and time.monotonic() - slot.created_at < self.ttl:
+            return # Đã tra cứu (hoặc đang tra cứu) đúng nội dung này
+        self._discard()
+        metrics_module.PREFETCH.inc(result="started")
+        self._slot = _Slot(key, asyncio.create_task(self._search(text, analysis)))
+
+    async def take(self, analysis):
+        """Trả về (True, ngữ cảnh) nếu có kết quả tra cứu trước dùng được cho câu hỏi cuối, ngược lại (False, None)."""
+        if self._timer is not None:
+            self._timer.cancel() # Tin nhắn cuối đã tới: nội dung đang gõ không còn ý nghĩa
+            self._timer = None
+        slot, self._slot = self._slot, None
+        if slot is None:
+            return False, None
+        if slot.key != analysis.retrieval_key() or time.monotonic() - slot.created_at >= self.ttl:
+            slot.task.cancel()
+            metrics_module.PREFETCH.inc(result="miss")
+            return False, None
+        try:
+            context = await asyncio.shield(slot.task) # Lượt bị hủy không hủy theo tra cứu dùng chung
+        except asyncio.CancelledError:
+            if not slot.task.cancelled():
+                raise # Chính lượt bị hủy
+            metrics_module.PREFETCH.inc(result="miss")
+            return False, None
+        except Exception as e:
+            logging.debug(f"Speculative search failed: {e}")
+            metrics_module.PREFETCH.inc(result="miss")
+            return False, None
+        metrics_module.PREFETCH.inc(result="hit")
+        return True, context
+
+    def _discard(self):
+        slot, self._slot = self._slot, None
+        if slot is not None and not slot.task.done():
+            slot.task.cancel()
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._discard()
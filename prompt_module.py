@@ -0,0 +1,168 @@
+# prompt_module.py
+# Lắp ráp prompt cho Gemini theo ngân sách token: giới hạn ngữ cảnh DB theo độ liên quan,
+# giữ các tin nhắn gần nhất và gộp các lượt cũ hơn thành một bản tóm tắt thay vì bỏ đi.
+import re
+from collections import deque
+
+import config
+
+CHARS_PER_TOKEN = 3 # Ước lượng thô cho tiếng Việt (tokenizer của Gemini cắt âm tiết có dấu thành nhiều token)
+DB_CONTEXT_SEPARATOR = "\n---\n" # Phân cách giữa các sản phẩm trong db_context (xem db_module)
+SUMMARY_LINE_CHARS = 160 # Độ dài tối đa của mỗi dòng tóm tắt cho một tin nhắn
+SUMMARY_ROLE_LABELS = {"user": "Khách", "model": "Trợ lý"}
+SUMMARY_OVERHEAD_TOKENS = 8 # Phần bao quanh bản tóm tắt trong prompt
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s")
+
+
+def estimate_tokens(text):
+    """Ước lượng số token của một đoạn văn bản mà không cần gọi API count_tokens."""
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def message_tokens(message):
+    return sum(estimate_tokens(part) for part in message["parts"]) + 4 # + chi phí vai trò/định dạng
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cắt văn bản cho vừa ngân sách token (giữ phần đầu)."""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[:max(max_chars - 1, 0)].rstrip() + "…"
+
+
+def summarize_message(message):
+    """Tóm tắt trích xuất một tin nhắn: câu đầu tiên, tối đa SUMMARY_LINE_CHARS ký tự."""
+    text = " ".join(" ".join(message["parts"]).split())
+    first_sentence = _SENTENCE_END.split(text, 1)[0]
+    if len(first_sentence) > SUMMARY_LINE_CHARS:
+        first_sentence = first_sentence[:SUMMARY_LINE_CHARS - 1].rstrip() + "…"
+    label = SUMMARY_ROLE_LABELS.get(message["role"], message["role"])
+    return f"{label}: {first_sentence}"
+
+
+def fold_into_summary(summary, messages, max_tokens=None):
+    """
+    Thêm các tin nhắn (cũ) vào bản tóm tắt đang có.
+    Khi vượt `max_tokens`, bỏ các dòng tóm tắt cũ nhất.
+    """
+    max_tokens = config.HISTORY_SUMMARY_TOKENS if max_tokens is None else max_tokens
+    lines = summary.split("\n") if summary else []
+    lines.extend(summarize_message(m) for m in messages)
+    while len(lines) > 1 and estimate_tokens("\n".join(lines)) > max_tokens:
+        lines.pop(0)
+    return truncate_to_tokens("\n".join(lines), max_tokens)
+
+
+class ChatHistory:
+    """
+    Lịch sử chat có giới hạn số tin nhắn (như deque(maxlen=...)), nhưng tin nhắn cũ
+    bị đẩy ra sẽ được gộp vào `summary` thay vì mất hẳn.
+    """
+
+    def __init__(self, maxlen, messages=(), summary=""):
+        self.maxlen = maxlen
+        self.summary = summary
+        self._messages = deque(messages, maxlen=maxlen)
+
+    def append(self, message):
+        if self.maxlen and len(self._messages) == self.maxlen:
+            self.summary = fold_into_summary(self.summary, [self._messages[0]])
+        self._messages.append(message)
+
+    def clear(self):
+        self._messages.clear()
+        self.summary = ""
+
+    def __iter__(self):
+        return iter(self._messages)
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __getitem__(self, index):
+        return self._messages[index]
+
+    def __repr__(self):
+        return f"ChatHistory({list(self._messages)!r}, summary={self.summary!r})"
+
+
+def cap_db_context(db_context, max_tokens):
+    """
+    Giữ các khối sản phẩm đầu tiên (đã xếp theo độ liên quan) cho vừa ngân sách token.
+    Luôn giữ ít nhất một khối (bị cắt ngắn nếu cần).
+    """
+    if not db_context:
+        return db_context
+    blocks = db_context.split(DB_CONTEXT_SEPARATOR)
+    kept = []
+    used = 0
+    for block in blocks:
+        cost = estimate_tokens(block) + 1
+        if kept and used + cost > max_tokens:
+            break
+        kept.append(block if cost <= max_tokens else truncate_to_tokens(block, max_tokens))
+        used += cost
+    return DB_CONTEXT_SEPARATOR.join(kept)
+
+
+def build_prompt(chat_history, db_context=None, summary="", budget=None, db_context_budget=None):
+    """
+    Lắp ráp danh sách contents cho generate_content trong giới hạn `budget` token
+    (không tính system instruction). Trả về (contents, số token ước lượng).
+
+    - Tin nhắn người dùng cuối cùng luôn được giữ, kèm db_context đã giới hạn.
+    - Các tin nhắn trước đó được thêm từ mới đến cũ cho đến khi hết ngân sách;
+      phần còn lại được gộp vào bản tóm tắt, đặt ở đầu tin nhắn người dùng đầu tiên.
+    """
+    budget = config.PROMPT_TOKEN_BUDGET if budget is None else budget
+    db_context_budget = config.PROMPT_DB_CONTEXT_TOKENS if db_context_budget is None else db_context_budget
+    messages = [{"role": m["role"], "parts": list(m["parts"])} for m in chat_history]
+    if not messages:
+        return [], 0
+
+    last_message = messages[-1]
+    summary_budget = config.HISTORY_SUMMARY_TOKENS
+    context_suffix = ""
+    if db_context:
+        db_context = cap_db_context(db_context, db_context_budget)
+        if last_message["role"] == "user":
+            context_suffix = f"\n\nThông tin từ siêu thị (nếu liên quan):\n---\n{db_context}\n---\nHãy trả lời câu hỏi trên DỰA VÀO thông tin này và lịch sử trò chuyện."
+        else:
+            messages.append({"role": "user", "parts": [f"Thông tin bổ sung từ cơ sở dữ liệu có thể liên quan: {db_context}"]})
+            last_message = messages[-1]
+    if last_message["role"] == "user":
+        # Câu hỏi cuối luôn được giữ nhưng bị cắt (khách dán đoạn văn bản dài) cho vừa phần ngân sách còn lại
+        # sau ngữ cảnh DB, bản tóm tắt và chi phí định dạng
+        reserved = estimate_tokens(context_suffix) + summary_budget + SUMMARY_OVERHEAD_TOKENS + message_tokens({"parts": []})
+        question = truncate_to_tokens(last_message["parts"][0], max(budget - reserved, 1))
+        last_message["parts"] = [question + context_suffix] + last_message["parts"][1:]
+
+    # Dành chỗ cho bản tóm tắt, rồi lấy các tin nhắn gần nhất còn vừa ngân sách
+    used = message_tokens(last_message)
+    kept_start = len(messages) - 1
+    while kept_start > 0:
+        cost = message_tokens(messages[kept_start - 1])
+        if used + cost + summary_budget > budget:
+            break
+        used += cost
+        kept_start -= 1
+
+    # Gemini yêu cầu hội thoại bắt đầu bằng lượt của người dùng
+    while kept_start < len(messages) - 1 and messages[kept_start]["role"] != "user":
+        used -= message_tokens(messages[kept_start])
+        kept_start += 1
+
+    dropped = messages[:kept_start]
+    contents = messages[kept_start:]
+    if dropped:
+        summary = fold_into_summary(summary, dropped, summary_budget)
+    if summary:
+        summary = truncate_to_tokens(summary, summary_budget)
+        first = contents[0]
+        first["parts"] = [f"(Tóm tắt cuộc trò chuyện trước đó:\n{summary})\n\n{first['parts'][0]}"] + first["parts"][1:]
+        used += estimate_tokens(summary) + SUMMARY_OVERHEAD_TOKENS
+    return contents, used
@@ -0,0 +1,177 @@
+# protocol_module.py
+# Giao thức gửi sự kiện từ server tới client qua WebSocket, thỏa thuận trong sự kiện "hello":
+#   {"event": "hello", "protocol": 2, "encoding": "msgpack"}
+#   v1 (mặc định, client cũ): mỗi sự kiện là một text frame JSON.
+#   v2: các sự kiện phát sinh trong PROTOCOL_FLUSH_MS (chat_delta, audio_chunk, trạng thái...) được gộp thành
+#       một frame chứa mảng sự kiện; frame được gửi ngay khi có sự kiện kết thúc một bước (chat_done, error...).
+#       encoding "json": text frame JSON; "msgpack": binary frame MessagePack, âm thanh gửi dạng bytes thay vì base64.
+# Phản hồi "session" cho hello luôn là JSON v1; các sự kiện sau đó theo phiên bản đã chọn.
+# Tin nhắn client gửi lên vẫn là JSON text (và frame nhị phân âm thanh) ở mọi phiên bản.
+# orjson và msgpack là tùy chọn: không cài thì dùng json chuẩn và client yêu cầu msgpack nhận JSON.
+import asyncio
+import base64
+import json
+import logging
+
+import config
+import metrics_module
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+SUPPORTED_VERSIONS = (1, 2)
+# Sự kiện kết thúc một bước mà client đang chờ: gửi ngay cùng các sự kiện đang gộp (v2)
+FLUSH_EVENTS = frozenset({
+    "session", "chat_message", "chat_done", "error", "busy", "audio_done",
+    "options_ack", "audio_end_ack", "stop_listening_ack",
+})
+
+
+def dumps(obj):
+    """JSON gọn (UTF-8, không khoảng trắng). Trả về bytes khi có orjson, ngược lại str."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(message):
+    """Giải mã tin nhắn JSON của client (str hoặc bytes). Lỗi cú pháp ném json.JSONDecodeError."""
+    if orjson is not None:
+        return orjson.loads(message)
+    return json.loads(message)
+
+
+def _jsonable(event):
+    audio = event.get("audio")
+    if isinstance(audio, (bytes, bytearray)):
+        event = dict(event, audio=base64.b64encode(audio).decode("ascii"))
+    return event
+
+
+def encode(payload, encoding="json"):
+    """Mã hóa một sự kiện hoặc mảng sự kiện. Trả về (dữ liệu, là_text_frame)."""
+    if encoding == "msgpack":
+        return msgpack.packb(payload, use_bin_type=True), False
+    if isinstance(payload, list):
+        payload = [_jsonable(event) for event in payload]
+    else:
+        payload = _jsonable(payload)
+    return dumps(payload), True
+
+
+def decode_frame(message):
+    """Phía client (benchmark, công cụ thử): frame nhận được -> danh sách sự kiện."""
+    if isinstance(message, (bytes, bytearray)):
+        payload = msgpack.unpackb(message, raw=False)
+    else:
+        payload = loads(message)
+    return payload if isinstance(payload, list) else [payload]
+
+
+def negotiate(requested_version=None, requested_encoding=None):
+    """Chọn phiên bản và encoding cao nhất mà cả hai phía hỗ trợ. Trả về (version, encoding)."""
+    try:
+        version = int(requested_version or 1)
+    except (TypeError, ValueError):
+        version = 1
+    version = max(v for v in SUPPORTED_VERSIONS if v <= max(version, 1))
+    encoding = "json"
+    if version >= 2 and requested_encoding == "msgpack" and msgpack is not None:
+        encoding = "msgpack"
+    return version, encoding
+
+
+class EventChannel:
+    """
+    Đường gửi sự kiện của một kết nối. v1: mỗi send() là một frame và chờ gửi xong.
+    v2: send() đưa sự kiện vào bộ đệm; bộ đệm được gửi thành một frame sau flush_interval giây,
+    khi đủ max_batch sự kiện, hoặc ngay khi gặp sự kiện trong FLUSH_EVENTS.
+    """
+
+    def __init__(self, websocket, version=1, encoding="json", flush_interval=None, max_batch=None):
+        self.websocket = websocket
+        self.version = version
+        self.encoding = encoding
+        self.flush_interval = config.PROTOCOL_FLUSH_MS / 1000.0 if flush_interval is None else flush_interval
+        self.max_batch = config.PROTOCOL_MAX_BATCH_EVENTS if max_batch is None else max_batch
+        self._pending = []
+        self._flush_task = None
+
+    @property
+    def label(self):
+        return f"v{self.version}-{self.encoding}"
+
+    async def upgrade(self, version, encoding):
+        """Chuyển sang phiên bản đã thỏa thuận (sau khi gửi phản hồi session)."""
+        await self.flush()
+        self.version = version
+        self.encoding = encoding
+
+    async def send(self, event):
+        if self.version < 2:
+            await self._send_frame(event)
+            return
+        self._pending.append(event)
+        if event.get("event") in FLUSH_EVENTS or len(self._pending) >= self.max_batch or self.flush_interval <= 0:
+            await self.flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self._flush_task = None
+        try:
+            await self.flush()
+        except Exception as e: # Kết nối đã đóng: handle_client tự dọn dẹp
+            logging.debug(f"Deferred flush to {self.websocket.remote_address} failed: {e}")
+
+    async def flush(self):
+        if not self._pending:
+            return
+        events, self._pending = self._pending, []
+        await self._send_frame(events)
+
+    async def _send_frame(self, payload):
+        with metrics_module.timed("ws_send"):
+            data, text = encode(payload, self.encoding)
+            if text:
+                if isinstance(data, str):
+                    data = data.encode("utf-8") # websockets cũng mã hóa như vậy; mã hóa ở đây để đếm đúng số byte
+                await self.websocket.send(data, text=True) # Bytes UTF-8 gửi thẳng làm text frame
+            else:
+                await self.websocket.send(data)
+        metrics_module.WS_FRAMES.inc(protocol=self.label)
+        metrics_module.WS_EVENTS.inc(len(payload) if isinstance(payload, list) else 1, protocol=self.label)
+        metrics_module.WS_BYTES.inc(len(data), protocol=self.label)
+
+    def close(self):
+        """Bỏ các sự kiện chưa gửi (kết nối đã đóng)."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        self._pending = []
+
+
+def server_options():
+    """
+    Tham số nén cho websockets.serve. "deflate": permessage-deflate với cửa sổ/bộ nhớ nén theo cấu hình
+    (cửa sổ nhỏ giảm bộ nhớ mỗi kết nối, JSON tiếng Việt lặp nhiều nên vẫn nén tốt); "none": tắt nén.
+    """
+    if config.WS_COMPRESSION == "none":
+        return {"compression": None}
+    from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+    return {
+        "compression": None, # Dùng extension đã cấu hình bên dưới thay cho mặc định của websockets
+        "extensions": [ServerPerMessageDeflateFactory(
+            server_max_window_bits=config.WS_DEFLATE_WINDOW_BITS,
+            client_max_window_bits=config.WS_DEFLATE_WINDOW_BITS,
+            compress_settings={"level": config.WS_DEFLATE_LEVEL, "memLevel": config.WS_DEFLATE_MEM_LEVEL},
+        )],
+    }
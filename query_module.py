@@ -0,0 +1,289 @@
+# query_module.py
+# Phân tích câu hỏi của người dùng: chuẩn hóa một lần, nhận diện ý định (intent),
+# trích xuất thực thể (thương hiệu, danh mục, khoảng giá) và sinh bộ lọc MongoDB có cấu trúc.
+# Dùng chung cho vòng lặp CLI (main.py) và WebSocket server.
+import re
+import threading
+import unicodedata
+from dataclasses import dataclass, field
+
+import metrics_module
+from search_module import fold_diacritics
+
+# Từ khóa cho từng ý định, viết cả có dấu và không dấu.
+# Không dùng "gia" không dấu cho ý định hỏi giá vì trùng với "đồ gia dụng".
+INTENT_KEYWORDS = {
+    "price": ["giá", "giá cả", "bao nhiêu", "bao nhieu", "mấy tiền", "may tien", "rẻ", "đắt"],
+    "promotion": ["khuyến mãi", "khuyen mai", "giảm giá", "giam gia", "ưu đãi", "uu dai", "sale"],
+    "store_hours": ["mở cửa", "mo cua", "đóng cửa", "dong cua", "giờ mở", "mấy giờ", "may gio",
+                    "cửa hàng", "cua hang", "ở đâu", "o dau", "địa chỉ", "dia chi"],
+    "product": ["sản phẩm", "san pham", "hàng", "mặt hàng", "có bán", "co ban", "loại nào"],
+}
+
+# Từ dừng bị bỏ qua khi tạo từ khóa tìm kiếm (tập hợp để tra cứu O(1))
+STOP_WORDS = frozenset([
+    "là", "có", "giá", "của", "cho", "tôi", "biết", "về", "ở", "đâu", "đến", "mua",
+    "nào", "gì", "bạn", "ạ", "nhé", "với", "thì", "sao", "vậy", "muốn", "tìm", "kiếm",
+])
+# Từ phủ định: chỉ là từ dừng ở cuối câu hỏi ("có sữa không?"); đứng trước một từ khóa thì được giữ
+# vì đổi nghĩa của từ đó ("sữa không đường" khác "sữa đường")
+NEGATION_WORDS = frozenset(["không"])
+# Cụm từ dừng nhiều âm tiết, bị xóa khỏi câu trước khi tách từ
+STOP_PHRASES = ("bao nhiêu", "địa chỉ", "hôm nay")
+
+_STOP_PHRASE_PATTERN = re.compile(
+    r"(?<!\w)(?:" + "|".join(re.escape(p) for p in STOP_PHRASES) + r")(?!\w)"
+)
+_INTENT_PATTERN = re.compile(
+    "|".join(
+        f"(?P<{intent}>(?<!\\w)(?:" + "|".join(re.escape(k) for k in sorted(words, key=len, reverse=True)) + ")(?!\\w))"
+        for intent, words in INTENT_KEYWORDS.items()
+    )
+)
+
+# Giá, so khớp trên văn bản đã bỏ dấu: "dưới 50 nghìn", "từ 20k đến 50k", "rẻ hơn 1,5 triệu", "giá 1.500.000 đ".
+# Một số chỉ được coi là giá khi có đơn vị tiền (k, nghìn, triệu, đ...) hoặc đứng sau "giá":
+# "hơn 2 hộp", "từ 2 hộp" không phải khoảng giá.
+_NUMBER = r"(\d+(?:[.,]\d+)*)\s*(k|nghin|ngan|trieu|tr|d|dong|vnd)?(?![a-z0-9])"
+_GIA = r"(?<![a-z0-9])(?:(gia)\s+)?"
+# Từ chỉ cận trên ("rẻ hơn 50k": giá <= 50k) và cận dưới ("đắt hơn 50k": giá >= 50k)
+_UPPER_BOUND_WORDS = ("duoi", "it hon", "re hon", "thap hon", "khong qua", "toi da")
+_LOWER_BOUND_WORDS = ("tren", "hon", "dat hon", "cao hon", "tu", "it nhat", "toi thieu")
+_PRICE_RANGE_PATTERN = re.compile(_GIA + r"tu\s+" + _NUMBER + r"\s*(?:den|toi|-)\s*" + _NUMBER)
+# Cụm dài được thử trước để "rẻ hơn" không bị đọc thành "hơn"
+_PRICE_BOUND_PATTERN = re.compile(
+    _GIA + "(" + "|".join(sorted(_UPPER_BOUND_WORDS + _LOWER_BOUND_WORDS, key=len, reverse=True)) + r")\s+" + _NUMBER
+)
+_PRICE_EXACT_PATTERN = re.compile(_GIA + r"(?:(?:la|khoang|tam|chi)\s+)?" + _NUMBER)
+# Giá cụ thể ("giá 15 triệu", "khoảng 50k") được hiểu là khoảng ±10% quanh giá đó
+PRICE_EXACT_TOLERANCE = 0.1
+_UNIT_MULTIPLIERS = {"k": 1_000, "nghin": 1_000, "ngan": 1_000, "trieu": 1_000_000, "tr": 1_000_000}
+
+
+def normalize(text):
+    """Chuẩn hóa Unicode (NFC), chữ thường, gộp khoảng trắng."""
+    return " ".join(unicodedata.normalize("NFC", text).lower().split())
+
+
+def _parse_amount(number, unit):
+    """'50', 'nghin' -> 50000; '50.000' -> 50000; '1,5', 'trieu' -> 1500000."""
+    groups = re.split(r"[.,]", number)
+    if len(groups) > 1 and all(len(g) == 3 for g in groups[1:]):
+        value = float("".join(groups)) # Dấu phân cách hàng nghìn
+    else:
+        value = float(number.replace(",", "."))
+    return int(value * _UNIT_MULTIPLIERS.get(unit or "", 1))
+
+
+@dataclass
+class QueryAnalysis:
+    """Kết quả phân tích một câu hỏi."""
+    text: str
+    normalized: str
+    folded: str
+    intents: set = field(default_factory=set)
+    brand: str = None
+    category: str = None
+    price_min: int = None
+    price_max: int = None
+    keywords: list = field(default_factory=list)
+
+    @property
+    def intent(self):
+        """Ý định chính; "chitchat" nếu không nhận ra ý định hay thực thể nào."""
+        for name in INTENT_KEYWORDS:
+            if name in self.intents:
+                return name
+        if self.price_min is not None or self.price_max is not None:
+            return "price"
+        if self.brand or self.category:
+            return "product"
+        return "chitchat"
+
+    @property
+    def should_search(self):
+        """Có cần tra cứu cơ sở dữ liệu không (chit-chat thì không)."""
+        return self.intent != "chitchat"
+
+    def mongo_filter(self):
+        """Bộ lọc bằng/khoảng trên các trường có index (thuong_hieu, danh_muc, gia)."""
+        query = {}
+        if self.brand:
+            query["thuong_hieu"] = self.brand
+        if self.category:
+            query["danh_muc"] = self.category
+        price = {}
+        if self.price_min is not None:
+            price["$gte"] = self.price_min
+        if self.price_max is not None:
+            price["$lte"] = self.price_max
+        if price:
+            query["gia"] = price
+        if "promotion" in self.intents:
+            query["khuyen_mai"] = {"$nin": [None, ""]}
+        return query
+
+    def retrieval_key(self):
+        """Hai câu hỏi có cùng khóa này cho cùng kết quả tra cứu (từ khóa + bộ lọc, không phụ thuộc thứ tự từ)."""
+        return (
+            tuple(sorted(set(self.keywords))), self.brand, self.category,
+            self.price_min, self.price_max, "promotion" in self.intents,
+        )
+
+    def matches(self, doc):
+        """Kiểm tra một tài liệu có thỏa bộ lọc hay không (dùng cho chỉ mục trong bộ nhớ)."""
+        if self.brand and doc.get("thuong_hieu") != self.brand:
+            return False
+        if self.category and doc.get("danh_muc") != self.category:
+            return False
+        if self.price_min is not None or self.price_max is not None:
+            price = doc.get("gia")
+            if not isinstance(price, (int, float)):
+                return False
+            if self.price_min is not None and price < self.price_min:
+                return False
+            if self.price_max is not None and price > self.price_max:
+                return False
+        if "promotion" in self.intents and not doc.get("khuyen_mai"):
+            return False
+        return True
+
+
+class QueryAnalyzer:
+    """Bộ phân tích câu hỏi với từ vựng thương hiệu/danh mục lấy từ danh mục sản phẩm."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._brand_pattern = None
+        self._category_pattern = None
+        self._brands = {}
+        self._categories = {}
+
+    @staticmethod
+    def _compile_vocabulary(values):
+        mapping = {}
+        for value in values:
+            if isinstance(value, str) and value.strip():
+                mapping.setdefault(" ".join(fold_diacritics(value).split()), value)
+        if not mapping:
+            return None, {}
+        alternatives = "|".join(re.escape(v) for v in sorted(mapping, key=len, reverse=True))
+        return re.compile(r"(?<![a-z0-9])(?:" + alternatives + r")(?![a-z0-9])"), mapping
+
+    def set_vocabulary(self, brands=(), categories=()):
+        """Cập nhật danh sách thương hiệu và danh mục để nhận diện thực thể."""
+        brand_pattern, brand_map = self._compile_vocabulary(brands)
+        category_pattern, category_map = self._compile_vocabulary(categories)
+        with self._lock:
+            self._brand_pattern, self._brands = brand_pattern, brand_map
+            self._category_pattern, self._categories = category_pattern, category_map
+
+    @property
+    def has_vocabulary(self):
+        return bool(self._brands or self._categories)
+
+    def analyze(self, text):
+        normalized = normalize(text or "")
+        folded = fold_diacritics(normalized)
+        analysis = QueryAnalysis(text=text, normalized=normalized, folded=folded)
+        if not normalized:
+            return analysis
+
+        # Các đoạn đã được dùng làm ý định/thực thể, không lặp lại trong từ khóa tìm kiếm
+        entity_spans = []
+        for match in _INTENT_PATTERN.finditer(normalized):
+            analysis.intents.add(match.lastgroup)
+            entity_spans.append(match.span())
+
+        brand_pattern, category_pattern = self._brand_pattern, self._category_pattern
+        if brand_pattern is not None:
+            match = brand_pattern.search(folded)
+            if match:
+                analysis.brand = self._brands[match.group(0)]
+                entity_spans.append(match.span())
+        if category_pattern is not None:
+            match = category_pattern.search(folded)
+            if match:
+                analysis.category = self._categories[match.group(0)]
+                entity_spans.append(match.span())
+
+        _extract_price(analysis, folded, entity_spans)
+        analysis.keywords = _extract_keywords(normalized, entity_spans)
+        return analysis
+
+
+def _extract_price(analysis, folded, entity_spans):
+    """Điền price_min/price_max: khoảng "từ ... đến ...", rồi cận trên/dưới, cuối cùng là một giá cụ thể."""
+    for match in _PRICE_RANGE_PATTERN.finditer(folded):
+        gia, low, low_unit, high, high_unit = match.groups()
+        if not (gia or low_unit or high_unit):
+            continue
+        analysis.price_min = _parse_amount(low, low_unit or high_unit)
+        analysis.price_max = _parse_amount(high, high_unit)
+        entity_spans.append(match.span())
+        return
+
+    found = False
+    for match in _PRICE_BOUND_PATTERN.finditer(folded):
+        gia, word, number, unit = match.groups()
+        if not (gia or unit):
+            continue
+        if word in _UPPER_BOUND_WORDS:
+            analysis.price_max = _parse_amount(number, unit)
+        else:
+            analysis.price_min = _parse_amount(number, unit)
+        entity_spans.append(match.span())
+        found = True
+    if found:
+        return
+
+    for match in _PRICE_EXACT_PATTERN.finditer(folded):
+        gia, number, unit = match.groups()
+        if not (gia or unit):
+            continue
+        amount = _parse_amount(number, unit)
+        analysis.price_min = int(amount * (1 - PRICE_EXACT_TOLERANCE))
+        analysis.price_max = int(amount * (1 + PRICE_EXACT_TOLERANCE))
+        entity_spans.append(match.span())
+        return
+
+
+def _extract_keywords(normalized, entity_spans):
+    """
+    Từ khóa tìm kiếm: bỏ các đoạn đã thành thực thể/bộ lọc, bỏ cụm từ dừng và từ dừng.
+    fold_diacritics giữ nguyên độ dài chuỗi NFC tiếng Việt nên vị trí trên văn bản bỏ dấu dùng được cho văn bản gốc.
+    """
+    if entity_spans and len(fold_diacritics(normalized)) == len(normalized):
+        chars = list(normalized)
+        for start, end in entity_spans:
+            chars[start:end] = " " * (end - start)
+        normalized = "".join(chars)
+    normalized = _STOP_PHRASE_PATTERN.sub(" ", normalized)
+    keywords = []
+    negation = None
+    for raw in normalized.split():
+        word = raw.strip(".,!?;:\"'()")
+        if word in NEGATION_WORDS:
+            # Bị dấu câu ngắt ("không?", "không,") thì không phủ định từ phía sau
+            negation = word if word == raw else None
+            continue
+        if len(word) > 1 and word not in STOP_WORDS:
+            if negation:
+                keywords.append(negation)
+            keywords.append(word)
+        negation = None
+    return keywords
+
+
+# Bộ phân tích dùng chung của tiến trình
+analyzer = QueryAnalyzer()
+
+
+@metrics_module.timed("intent")
+def analyze(text):
+    """Phân tích câu hỏi bằng bộ phân tích dùng chung."""
+    return analyzer.analyze(text)
+
+
+def set_vocabulary(brands=(), categories=()):
+    analyzer.set_vocabulary(brands, categories)
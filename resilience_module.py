@@ -0,0 +1,349 @@
+# resilience_module.py
+# Lớp bảo vệ quanh các lời gọi dịch vụ ngoài (Gemini): deadline cho cả lượt, thử lại lỗi tạm thời với backoff có jitter,
+# gửi thêm yêu cầu dự phòng (hedge) khi yêu cầu đầu chậm hơn p95, và circuit breaker để trả lời ngay khi API đang lỗi.
+# Lỗi được phân loại theo kiểu exception / mã trạng thái, không theo nội dung thông báo.
+import collections
+import concurrent.futures
+import contextvars
+import logging
+import random
+import sys
+import threading
+import time
+
+import executor_module
+
+
+class DeadlineExceededError(TimeoutError):
+    """Hết thời gian cho phép của cả lời gọi (kể cả các lần thử lại)."""
+
+
+class CircuitOpenError(RuntimeError):
+    """Circuit breaker đang mở: không gọi dịch vụ để trả lời ngay."""
+
+
+# Loại lỗi được thử lại và được tính là dịch vụ không khỏe (làm mở circuit breaker)
+TRANSIENT_KINDS = frozenset({"timeout", "unavailable", "rate_limit"})
+# Loại lỗi nên trả lời bằng phương án dự phòng (cache, câu trả lời soạn sẵn) thay vì báo lỗi
+DEGRADED_KINDS = TRANSIENT_KINDS | {"circuit_open", "overloaded"}
+
+
+def classify(error):
+    """
+    Phân loại exception: "timeout", "unavailable", "rate_limit", "circuit_open", "overloaded", "auth",
+    "unsupported_location", "bad_request" hoặc "unknown".
+    """
+    if isinstance(error, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(error, executor_module.ExecutorBusyError):
+        return "overloaded"
+    if isinstance(error, (TimeoutError, concurrent.futures.TimeoutError)):
+        return "timeout"
+    # Không import google-api-core chỉ để phân loại: chưa được nạp (Gemini chưa được gọi) thì lỗi không thể là lỗi của nó.
+    # Thiếu thư viện thì chỉ phân loại theo mã trạng thái.
+    google_exceptions = sys.modules.get("google.api_core.exceptions")
+    if google_exceptions is not None and isinstance(error, google_exceptions.GoogleAPICallError):
+        if isinstance(error, (google_exceptions.DeadlineExceeded, google_exceptions.GatewayTimeout)):
+            return "timeout"
+        if isinstance(error, google_exceptions.ResourceExhausted):
+            return "rate_limit"
+        if isinstance(error, (google_exceptions.ServiceUnavailable, google_exceptions.InternalServerError,
+                              google_exceptions.BadGateway)):
+            return "unavailable"
+        if isinstance(error, (google_exceptions.Unauthenticated, google_exceptions.PermissionDenied)):
+            return "auth"
+        if isinstance(error, google_exceptions.FailedPrecondition):
+            return "unsupported_location" # Gemini trả FAILED_PRECONDITION khi khu vực của người gọi không được hỗ trợ
+        if isinstance(error, google_exceptions.InvalidArgument):
+            return "auth" if getattr(error, "reason", None) == "API_KEY_INVALID" else "bad_request"
+    code = getattr(error, "code", None)
+    if isinstance(code, int) and not isinstance(code, bool):
+        if code in (401, 403):
+            return "auth"
+        if code == 429:
+            return "rate_limit"
+        if code in (408, 504):
+            return "timeout"
+        if 500 <= code < 600:
+            return "unavailable"
+        if 400 <= code < 500:
+            return "bad_request"
+    if isinstance(error, OSError): # ConnectionError, lỗi socket/DNS, requests.ConnectionError...
+        return "unavailable"
+    return "unknown"
+
+
+class ReconnectBackoff:
+    """
+    Khoảng chờ giữa các lần thử kết nối lại một dịch vụ (MongoDB) đang không kết nối được: tăng gấp đôi từ
+    `minimum` tới `maximum` giây (có jitter). Trong lúc chờ, nơi gọi trả lỗi ngay thay vì mỗi yêu cầu lại chờ timeout.
+    """
+
+    def __init__(self, minimum, maximum):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.failures = 0
+        self._next_attempt = 0.0
+
+    def ready(self):
+        return time.monotonic() >= self._next_attempt
+
+    def failed(self):
+        """Ghi nhận một lần thử lỗi; trả về số giây trước lần thử tiếp theo."""
+        self.failures += 1
+        delay = min(self.maximum, self.minimum * (2 ** (self.failures - 1))) * random.uniform(0.5, 1.0)
+        self._next_attempt = time.monotonic() + delay
+        return delay
+
+    def succeeded(self):
+        self.failures = 0
+        self._next_attempt = 0.0
+
+
+class CircuitBreaker:
+    """
+    Mở sau `failure_threshold` lỗi tạm thời liên tiếp; khi mở, allow() trả về False trong `reset_timeout` giây,
+    sau đó cho đúng một yêu cầu thử (half-open): thành công thì đóng lại, lỗi thì mở tiếp.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.opened = 0 # Số lần chuyển sang mở
+        self.rejected = 0 # Số yêu cầu bị từ chối khi đang mở
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self):
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self._state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logging.info(f"Circuit '{self.name}' closed.")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def release(self):
+        """
+        Lời gọi kết thúc mà không cho biết dịch vụ có khỏe không (bị hủy giữa chừng, lỗi của chính yêu cầu,
+        quá tải phía mình): chỉ trả lại lượt thử half-open, không thay đổi trạng thái hay số lỗi liên tiếp.
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or (self._state == self.CLOSED and self._failures >= self.failure_threshold):
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+                self._probe_in_flight = False
+                self.opened += 1
+                logging.warning(f"Circuit '{self.name}' opened after {self._failures} consecutive failures.")
+
+    def stats(self):
+        return {"state": self.state, "failures": self._failures, "opened": self.opened, "rejected": self.rejected}
+
+
+class LatencyTracker:
+    """Thời gian của các lần gọi thành công gần nhất, để ước lượng p95 làm ngưỡng hedge."""
+
+    def __init__(self, window=200, min_samples=20):
+        self._samples = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.min_samples = min_samples
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, fraction):
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            values = sorted(self._samples)
+        return values[min(int(fraction * len(values)), len(values) - 1)]
+
+
+class ResilientCaller:
+    """
+    Gọi fn(timeout) với:
+    - deadline: tổng thời gian tối đa (giây) cho mọi lần thử; timeout truyền cho fn là thời gian còn lại
+    - retries/backoff: số lần thử lại lỗi tạm thời, độ trễ cơ bản tăng gấp đôi mỗi lần (có jitter)
+    - hedge: gửi thêm một yêu cầu song song khi yêu cầu đầu chưa xong sau max(p95, hedge_min_delay) giây
+    - breaker: CircuitBreaker dùng chung cho mọi lời gọi
+    Các lần thử chạy trong pool riêng nên thread gọi thôi chờ đúng lúc hết deadline, kể cả khi SDK bị treo.
+    """
+
+    def __init__(self, name, deadline, retries=2, backoff=0.5, hedge=False, hedge_min_delay=1.0,
+                 breaker=None, max_attempts_in_flight=32):
+        self.name = name
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker = breaker
+        self.latency = LatencyTracker()
+        self._max_attempts_in_flight = max_attempts_in_flight
+        self._attempts = None # Tạo khi cần lần đầu (sau fork nếu chạy nhiều worker)
+        self._attempts_lock = threading.Lock()
+        self._counts_lock = threading.Lock()
+        self.counts = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "deadline_exceeded": 0,
+                       "short_circuited": 0, "failures": 0}
+
+    def count(self, name):
+        with self._counts_lock:
+            self.counts[name] += 1
+
+    def _executor(self):
+        if self._attempts is None:
+            with self._attempts_lock:
+                if self._attempts is None:
+                    # Không có hàng chờ: đủ số lần thử đang chạy (kể cả lần bị bỏ rơi do hết deadline) thì báo quá tải
+                    self._attempts = executor_module.BoundedExecutor(
+                        f"{self.name}-attempts", self._max_attempts_in_flight, 0
+                    )
+        return self._attempts
+
+    def hedge_delay(self):
+        if not self.hedge:
+            return None
+        p95 = self.latency.percentile(0.95)
+        return None if p95 is None else max(p95, self.hedge_min_delay)
+
+    def retry_delay(self, attempt):
+        return self.backoff * (2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def before_call(self):
+        """Ném CircuitOpenError nếu breaker đang mở. Dùng cùng after_call() khi tự gọi dịch vụ (ví dụ streaming)."""
+        self.count("calls")
+        if self.breaker is not None and not self.breaker.allow():
+            self.count("short_circuited")
+            raise CircuitOpenError(f"Circuit '{self.breaker.name}' is open.")
+
+    def after_call(self, error=None):
+        """
+        Báo kết quả cho breaker: chỉ lời gọi trả lời xong mới được tính là thành công, chỉ lỗi tạm thời mới bị tính
+        là dịch vụ không khỏe; lỗi khác (auth, bad_request, overloaded...) không làm thay đổi trạng thái breaker.
+        """
+        if error is not None:
+            self.count("failures")
+            if isinstance(error, DeadlineExceededError):
+                self.count("deadline_exceeded")
+        if self.breaker is None:
+            return
+        if error is None:
+            self.breaker.record_success()
+        elif classify(error) in TRANSIENT_KINDS:
+            self.breaker.record_failure()
+        else:
+            self.breaker.release()
+
+    def abandon(self):
+        """Nơi gọi bỏ dở lời gọi (ví dụ dừng đọc stream khi lượt bị hủy): không tính là thành công hay lỗi."""
+        if self.breaker is not None:
+            self.breaker.release()
+
+    def call(self, fn):
+        self.before_call()
+        deadline_at = time.monotonic() + self.deadline
+        attempt = 0
+        try:
+            while True:
+                remaining = deadline_at - time.monotonic()
+                if remaining <= 0:
+                    raise DeadlineExceededError(f"'{self.name}' did not finish within {self.deadline:.1f}s.")
+                try:
+                    result = self._attempt(fn, deadline_at)
+                    break
+                except Exception as e:
+                    if attempt >= self.retries or classify(e) not in TRANSIENT_KINDS or isinstance(e, DeadlineExceededError):
+                        raise
+                    delay = self.retry_delay(attempt)
+                    if delay >= deadline_at - time.monotonic():
+                        raise
+                    logging.warning(f"'{self.name}' attempt {attempt + 1} failed ({classify(e)}), retrying in {delay:.2f}s.")
+                    self.count("retries")
+                    time.sleep(delay)
+                    attempt += 1
+        except Exception as e:
+            self.after_call(e)
+            raise
+        self.after_call()
+        return result
+
+    def _submit(self, fn, deadline_at):
+        ctx = contextvars.copy_context() # Mỗi lần thử một bản sao: một Context không chạy được ở hai thread cùng lúc
+        started = time.monotonic()
+        return self._executor().submit(ctx.run, fn, max(deadline_at - started, 0.001)), started
+
+    def _attempt(self, fn, deadline_at):
+        """Một lần thử (có thể kèm một yêu cầu hedge). Trả về kết quả về trước, hoặc ném lỗi."""
+        future, started = self._submit(fn, deadline_at)
+        pending = {future: (started, False)}
+        hedge_delay = self.hedge_delay()
+        errors = []
+        try:
+            while pending:
+                remaining = deadline_at - time.monotonic()
+                if remaining <= 0:
+                    raise DeadlineExceededError(f"'{self.name}' did not finish within {self.deadline:.1f}s.")
+                can_hedge = hedge_delay is not None and len(pending) == 1 and not errors
+                wait_for = remaining
+                if can_hedge:
+                    wait_for = min(remaining, max(started + hedge_delay - time.monotonic(), 0))
+                done, _ = concurrent.futures.wait(pending, timeout=wait_for, return_when=concurrent.futures.FIRST_COMPLETED)
+                if not done:
+                    if can_hedge and deadline_at - time.monotonic() > 0:
+                        self.count("hedges")
+                        hedge_future, hedge_started = self._submit(fn, deadline_at)
+                        pending[hedge_future] = (hedge_started, True)
+                        hedge_delay = None
+                    continue
+                for finished in done:
+                    finished_started, is_hedge = pending.pop(finished)
+                    error = finished.exception()
+                    if error is None:
+                        self.latency.record(time.monotonic() - finished_started)
+                        if is_hedge:
+                            self.count("hedge_wins")
+                        return finished.result()
+                    errors.append(error)
+            raise errors[0]
+        finally:
+            for other in pending:
+                other.cancel() # Chỉ hủy được yêu cầu chưa chạy; yêu cầu đang chạy tự dừng theo timeout đã truyền
+
+    def stats(self):
+        with self._counts_lock:
+            stats = dict(self.counts)
+        if self.breaker is not None:
+            stats["breaker"] = self.breaker.stats()
+        return stats
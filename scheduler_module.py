@@ -0,0 +1,102 @@
+# scheduler_module.py
+# Bộ lập lịch lượt hội thoại cho mỗi phiên WebSocket: xử lý tuần tự từng lượt theo thứ tự nhận,
+# hủy lượt cũ khi có lượt mới hơn và từ chối client gửi dồn dập.
+import asyncio
+import logging
+
+import config
+
+
+class SessionOverloadedError(RuntimeError):
+    """Hàng đợi lượt của phiên đã đầy."""
+
+
+class TurnScheduler:
+    """
+    Hàng đợi lượt có giới hạn cho một phiên.
+    - Các lượt chạy lần lượt, đúng thứ tự gửi lên (không chồng chéo trên cùng lịch sử chat).
+    - Lượt mới (supersede=True) làm lượt đang chạy bị hủy và các lượt cũ còn trong hàng đợi bị bỏ qua,
+      nên không tốn lời gọi STT/DB/LLM cho câu trả lời không ai đọc.
+    """
+
+    def __init__(self, max_pending=None, name=""):
+        self.name = name
+        self.max_pending = config.TURN_QUEUE_SIZE if max_pending is None else max_pending
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._worker = None
+        self._current = None # Task của lượt đang chạy
+        self._current_id = 0
+        self._last_id = 0
+        self._stale_upto = 0 # Các lượt có id <= giá trị này bị bỏ qua
+        self.completed = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self.consecutive_rejections = 0
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    @property
+    def busy(self):
+        return self._current is not None and not self._current.done()
+
+    def submit(self, coro_factory, supersede=True):
+        """
+        Đưa một lượt vào hàng đợi. coro_factory() tạo coroutine xử lý lượt khi tới lượt chạy.
+        Ném SessionOverloadedError nếu hàng đợi đã đầy. Trả về id của lượt.
+        """
+        if self._queue.full():
+            self.rejected += 1
+            self.consecutive_rejections += 1
+            raise SessionOverloadedError(f"Too many pending turns for session {self.name}.")
+        self.consecutive_rejections = 0
+        self._last_id += 1
+        turn_id = self._last_id
+        if supersede:
+            self.cancel_pending(upto=turn_id - 1)
+        self._queue.put_nowait((turn_id, coro_factory))
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        return turn_id
+
+    def cancel_pending(self, upto=None):
+        """Hủy lượt đang chạy và bỏ qua các lượt trong hàng đợi có id <= upto (mặc định: tất cả)."""
+        upto = self._last_id if upto is None else upto
+        self._stale_upto = max(self._stale_upto, upto)
+        if self.busy and self._current_id <= upto:
+            self._current.cancel()
+            logging.info(f"Turn {self._current_id} of session {self.name} cancelled (superseded).")
+
+    async def _run(self):
+        while True:
+            turn_id, coro_factory = await self._queue.get()
+            if turn_id <= self._stale_upto:
+                self.cancelled += 1
+                continue
+            self._current_id = turn_id
+            self._current = asyncio.create_task(coro_factory())
+            try:
+                # asyncio.wait không ném CancelledError khi chính lượt bị hủy, chỉ khi worker bị hủy
+                await asyncio.wait({self._current})
+            except asyncio.CancelledError:
+                self._current.cancel()
+                raise
+            if self._current.cancelled():
+                self.cancelled += 1
+            elif self._current.exception() is not None:
+                logging.error(f"Turn {turn_id} of session {self.name} failed: {self._current.exception()}")
+            else:
+                self.completed += 1
+
+    async def close(self):
+        """Hủy mọi lượt và dừng worker (khi client ngắt kết nối)."""
+        self.cancel_pending()
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        if self._current is not None and not self._current.done():
+            self._current.cancel()
@@ -0,0 +1,226 @@
+# search_module.py
+# Chỉ mục ngược (inverted index) trong bộ nhớ cho danh mục sản phẩm,
+# thay cho việc quét toàn bộ collection bằng regex `.*keyword.*`.
+import heapq
+import logging
+import math
+import re
+import threading
+import unicodedata
+from array import array
+
+# Trọng số của từng trường khi tính điểm (tên sản phẩm quan trọng hơn mô tả)
+FIELD_WEIGHTS = {
+    "ten": 3.0,
+    "thuong_hieu": 2.5,
+    "danh_muc": 2.0,
+    "keywords": 2.0,
+    "mo_ta": 1.0,
+}
+# Các trường được giữ lại trong bộ nhớ (đủ cho format_product_info)
+STORED_FIELDS = ("ten", "gia", "mo_ta", "khuyen_mai", "danh_muc", "thuong_hieu")
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def fold_diacritics(text):
+    """Chuyển về chữ thường và bỏ dấu tiếng Việt: "Sữa Tươi" -> "sua tuoi"."""
+    text = text.lower().replace("đ", "d")
+    decomposed = unicodedata.normalize("NFD", text)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def tokenize(text):
+    """Tách văn bản (đã bỏ dấu) thành các token chữ/số."""
+    if not text:
+        return []
+    if isinstance(text, (list, tuple)):
+        text = " ".join(str(item) for item in text)
+    return _TOKEN_PATTERN.findall(fold_diacritics(str(text)))
+
+
+class SearchIndex:
+    """
+    Chỉ mục BM25 theo từng trường với trọng số FIELD_WEIGHTS.
+    Postings của mỗi token là hai mảng song song (id tài liệu nội bộ, tần suất).
+    Cập nhật/xóa đánh dấu tài liệu cũ là đã chết; chỉ mục tự nén lại khi có quá nhiều tài liệu chết.
+    """
+
+    def __init__(self, field_weights=None, k1=1.2, b=0.75, updated_at_field="updated_at", on_change=None):
+        self.field_weights = dict(field_weights or FIELD_WEIGHTS)
+        self.on_change = on_change # Gọi sau mỗi lần nội dung chỉ mục thay đổi (ví dụ để xóa cache)
+        self.k1 = k1
+        self.b = b
+        self.updated_at_field = updated_at_field
+        self.watermark = None # Giá trị updated_at lớn nhất đã nạp
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._docs = [] # id nội bộ -> tài liệu rút gọn (None nếu đã bị xóa/cập nhật)
+        self._ids = {} # _id của Mongo -> id nội bộ
+        self._postings = {field: {} for field in self.field_weights}
+        self._lengths = {field: array("I") for field in self.field_weights}
+        self._total_lengths = {field: 0 for field in self.field_weights}
+        self._dead = 0
+
+    def __len__(self):
+        return len(self._docs) - self._dead
+
+    def _add(self, doc):
+        key = doc.get("_id", doc.get("ten"))
+        if key in self._ids:
+            self._remove(key)
+        doc_id = len(self._docs)
+        self._docs.append({k: doc[k] for k in ("_id",) + STORED_FIELDS if k in doc})
+        self._ids[key] = doc_id
+        for field, postings in self._postings.items():
+            counts = {}
+            for token in tokenize(doc.get(field)):
+                counts[token] = counts.get(token, 0) + 1
+            length = sum(counts.values())
+            self._lengths[field].append(length)
+            self._total_lengths[field] += length
+            for token, tf in counts.items():
+                entry = postings.get(token)
+                if entry is None:
+                    entry = postings[token] = (array("I"), array("H"))
+                entry[0].append(doc_id)
+                entry[1].append(min(tf, 0xFFFF))
+        value = doc.get(self.updated_at_field)
+        if value is not None and (self.watermark is None or value > self.watermark):
+            self.watermark = value
+
+    def _remove(self, key):
+        doc_id = self._ids.pop(key, None)
+        if doc_id is None or self._docs[doc_id] is None:
+            return False
+        self._docs[doc_id] = None
+        for field in self._postings:
+            self._total_lengths[field] -= self._lengths[field][doc_id]
+        self._dead += 1
+        return True
+
+    def _maybe_compact(self):
+        if self._dead > 1000 and self._dead > len(self) // 4:
+            live_docs = [doc for doc in self._docs if doc is not None]
+            watermark = self.watermark
+            self._reset()
+            for doc in live_docs:
+                self._add(doc)
+            self.watermark = watermark
+
+    def rebuild(self, docs):
+        """Xây lại toàn bộ chỉ mục từ một iterable các tài liệu."""
+        with self._lock:
+            self._reset()
+            self.watermark = None
+            for doc in docs:
+                self._add(doc)
+
+    def _notify_change(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    def upsert(self, doc, notify=True):
+        with self._lock:
+            self._add(doc)
+            self._maybe_compact()
+        if notify:
+            self._notify_change()
+
+    def delete(self, key):
+        with self._lock:
+            removed = self._remove(key)
+            self._maybe_compact()
+        if removed:
+            self._notify_change()
+        return removed
+
+    def apply_change(self, change):
+        """
+        Áp dụng một sự kiện dạng change stream của MongoDB:
+        {"operationType": "insert|update|replace|delete", "fullDocument": {...}, "documentKey": {"_id": ...}}
+        """
+        operation = change.get("operationType")
+        if operation == "delete":
+            self.delete(change.get("documentKey", {}).get("_id"))
+        elif change.get("fullDocument") is not None:
+            self.upsert(change["fullDocument"])
+
+    def search(self, text, limit=5, predicate=None):
+        """
+        Trả về tối đa `limit` tài liệu có điểm BM25 cao nhất cho câu truy vấn.
+        predicate: hàm lọc tài liệu (ví dụ QueryAnalysis.matches), áp dụng trước khi chọn top.
+        """
+        tokens = set(tokenize(text))
+        if not tokens:
+            return []
+        with self._lock:
+            total_docs = len(self._docs)
+            if not total_docs:
+                return []
+            docs = self._docs
+            scores = {}
+            k1, b = self.k1, self.b
+            for field, weight in self.field_weights.items():
+                postings = self._postings[field]
+                lengths = self._lengths[field]
+                avg_length = (self._total_lengths[field] / max(len(self), 1)) or 1.0
+                for token in tokens:
+                    entry = postings.get(token)
+                    if entry is None:
+                        continue
+                    doc_ids, tfs = entry
+                    df = len(doc_ids)
+                    idf = math.log(1.0 + (total_docs - df + 0.5) / (df + 0.5))
+                    for doc_id, tf in zip(doc_ids, tfs):
+                        if docs[doc_id] is None:
+                            continue
+                        norm = tf * (k1 + 1) / (tf + k1 * (1 - b + b * lengths[doc_id] / avg_length))
+                        scores[doc_id] = scores.get(doc_id, 0.0) + weight * idf * norm
+            if predicate is not None:
+                scores = {doc_id: score for doc_id, score in scores.items() if predicate(docs[doc_id])}
+            best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+            return [docs[doc_id] for doc_id, _ in best]
+
+    def load(self, collection):
+        """Nạp toàn bộ collection vào chỉ mục."""
+        projection = {field: 1 for field in set(STORED_FIELDS) | set(self.field_weights) | {self.updated_at_field}}
+        self.rebuild(collection.find({}, projection))
+        self._notify_change()
+        logging.info(f"Search index loaded {len(self)} products.")
+
+    def refresh(self, collection):
+        """
+        Cập nhật tăng dần: chỉ đọc các tài liệu có updated_at lớn hơn watermark.
+        Nếu collection không có trường updated_at thì nạp lại toàn bộ.
+        Trả về số tài liệu đã cập nhật.
+        """
+        if self.watermark is None:
+            self.load(collection)
+            return len(self)
+        projection = {field: 1 for field in set(STORED_FIELDS) | set(self.field_weights) | {self.updated_at_field}}
+        changed = 0
+        for doc in collection.find({self.updated_at_field: {"$gt": self.watermark}}, projection):
+            self.upsert(doc, notify=False)
+            changed += 1
+        if changed:
+            self._notify_change()
+            logging.info(f"Search index refreshed {changed} products.")
+        return changed
+
+    def start_refresher(self, collection, interval):
+        """Chạy refresh() định kỳ trong một thread nền (daemon)."""
+        stop = threading.Event()
+
+        def loop():
+            while not stop.wait(interval):
+                try:
+                    self.refresh(collection)
+                except Exception as e:
+                    logging.error(f"Search index refresh failed: {e}")
+
+        thread = threading.Thread(target=loop, name="search-index-refresher", daemon=True)
+        thread.start()
+        return stop
@@ -1,13 +1,34 @@
 # server.py
+import argparse
 import asyncio
+import functools
 import json
+import os
+import signal
+import sys
+import time
 import websockets
 import stt_module
 import db_module
 import llm_module # Sẽ cần sửa đổi hàm get_chatbot_response trong module này
+import executor_module # Chạy pymongo/Gemini/STT trong thread pool, không chặn loop
+import tts_module
+import audio_module
+import scheduler_module
+import admission_module # Giới hạn kết nối, số lời gọi Gemini/MongoDB đồng thời và tốc độ gửi lượt
+import worker_module # Chế độ nhiều tiến trình (--workers N)
+import protocol_module # Thỏa thuận giao thức gửi sự kiện (v1 JSON, v2 gộp frame/MessagePack), nén permessage-deflate
+import session_module # Lưu lịch sử/tùy chọn theo session_id, dùng chung giữa các tiến trình
+import journal_module # Nhật ký hội thoại ghi trễ theo lô vào MongoDB (collection conversations)
+import prefetch_module # Tra cứu sản phẩm trước từ sự kiện typing/partial_text
+import metrics_module # Histogram theo giai đoạn, endpoint /metrics cho Prometheus, /healthz và /readyz
+import resilience_module
+import log_module # Log JSON qua hàng đợi + thread nền, cắt ngắn và lấy mẫu
+import config
+import query_module
 import logging
-import traceback
-from collections import deque # Sử dụng deque để quản lý cửa sổ trượt hiệu quả
+import uuid
+from prompt_module import ChatHistory # Cửa sổ trượt, lượt cũ được gộp vào bản tóm tắt
 
 # Cấu hình logging
 logging.basicConfig(
@@ -15,74 +36,331 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s",
 )
 
-# Dictionary để lưu lịch sử chat cho mỗi client (sử dụng deque cho cửa sổ trượt)
-# Key: đối tượng websocket, Value: deque các tin nhắn dạng {"role": "user/model", "parts": ["message"]}
+# session_id của mỗi kết nối (client gửi trong sự kiện "hello" để tiếp tục phiên cũ, nếu không thì tự sinh)
+client_session_ids = {}
+# Dictionary để lưu lịch sử chat cho mỗi client (ChatHistory: cửa sổ trượt + tóm tắt các lượt cũ)
+# Key: đối tượng websocket, Value: ChatHistory các tin nhắn dạng {"role": "user/model", "parts": ["message"]}
 client_chat_histories = {}
+# Tùy chọn riêng của từng client, thay đổi bằng sự kiện "set_options". Key: đối tượng websocket
+client_options = {}
+# llm_cache: dùng lại câu trả lời đã cache của Gemini; tts: gửi kèm âm thanh câu trả lời (audio_chunk)
+DEFAULT_CLIENT_OPTIONS = {"llm_cache": True, "tts": False}
+# Phiên âm thanh (ring buffer + VAD) của client đang gửi frame nhị phân sau sự kiện "audio_start"
+client_audio_sessions = {}
+# Bộ lập lịch lượt (TurnScheduler) của mỗi client: lượt chạy tuần tự, lượt mới hủy lượt cũ
+client_schedulers = {}
+# Token bucket giới hạn số lượt mỗi client được gửi (None nếu tắt RATE_LIMIT_TURNS_PER_MINUTE)
+client_rate_limiters = {}
+# Đường gửi sự kiện (protocol_module.EventChannel) của mỗi client, theo phiên bản giao thức đã thỏa thuận
+client_channels = {}
+# Task đang gửi âm thanh câu trả lời cho mỗi client, bị hủy khi người dùng bắt đầu lượt mới (barge-in)
+client_speech_tasks = {}
+# Ô tra cứu trước (prefetch_module.SpeculativeRetriever) của mỗi client; không có nếu tắt PREFETCH_ENABLED
+client_prefetchers = {}
+# Làm nóng xong (MongoDB, Gemini, từ vựng, chỉ mục): /readyz chỉ báo sẵn sàng từ lúc này
+warmed_up = False
 MAX_HISTORY_TURNS = 5 # Số lượt hội thoại (user + model) muốn giữ lại. Ví dụ 5 lượt = 10 tin nhắn.
                       # Hoặc bạn có thể định nghĩa theo số tin nhắn: MAX_HISTORY_MESSAGES = 10
 
 async def handle_client(websocket):
+    if len(client_chat_histories) >= config.MAX_CONNECTIONS:
+        logging.warning(f"Connection limit ({config.MAX_CONNECTIONS}) reached, rejecting {websocket.remote_address}.")
+        try:
+            await send_busy(websocket, "connections", admission_module.retry_after_seconds(config.BUSY_RETRY_AFTER_SECONDS))
+            await websocket.close(code=1013, reason="Server busy") # 1013: Try Again Later
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        return
+
     logging.info(f"Client connected: {websocket.remote_address}")
     # Khởi tạo lịch sử chat rỗng (hoặc với tin nhắn hệ thống/mở đầu nếu muốn) cho client mới
-    client_chat_histories[websocket] = deque(maxlen=MAX_HISTORY_TURNS * 2) # deque tự động loại bỏ phần tử cũ khi đầy
+    client_chat_histories[websocket] = ChatHistory(maxlen=MAX_HISTORY_TURNS * 2) # Tin nhắn cũ nhất được gộp vào summary khi đầy
+    client_options[websocket] = dict(DEFAULT_CLIENT_OPTIONS)
+    client_session_ids[websocket] = uuid.uuid4().hex
+    client_channels[websocket] = protocol_module.EventChannel(websocket)
+    client_schedulers[websocket] = scheduler_module.TurnScheduler(name=str(websocket.remote_address))
+    client_rate_limiters[websocket] = admission_module.new_rate_limiter()
+    if config.PREFETCH_ENABLED:
+        client_prefetchers[websocket] = prefetch_module.SpeculativeRetriever(
+            functools.partial(_speculative_search, websocket)
+        )
+    metrics_module.ACTIVE_SESSIONS.inc()
 
     try:
         async for message in websocket:
-            logging.info(f"Received message from {websocket.remote_address}: {message}")
+            if isinstance(message, bytes): # Frame âm thanh (PCM16/Opus) sau "audio_start"
+                await handle_audio_frame(websocket, message)
+                continue
+            logging.info(
+                "Received message from %s: %s", websocket.remote_address, log_module.lazy(lambda: message, 200),
+                extra={"event": "ws_message", "size": len(message)},
+            )
             try:
-                data = json.loads(message)
+                data = protocol_module.loads(message)
                 event = data.get("event")
 
-                if event == "start_listening":
+                if event == "hello":
+                    session_id = data.get("session_id")
+                    resumed = False
+                    if session_id:
+                        resumed = await resume_session(websocket, str(session_id))
+                    version, encoding = protocol_module.negotiate(data.get("protocol"), data.get("encoding"))
+                    await send_event(websocket, {
+                        "event": "session",
+                        "session_id": client_session_ids[websocket],
+                        "resumed": resumed,
+                        "history_length": len(client_chat_histories[websocket]),
+                        "options": client_options[websocket],
+                        "protocol": version,
+                        "encoding": encoding,
+                    })
+                    await client_channels[websocket].upgrade(version, encoding) # Từ đây gửi theo giao thức đã chọn
+
+                elif event == "start_listening":
+                    if not await admit_turn(websocket):
+                        continue
                     logging.info("Starting listening...")
-                    await websocket.send(json.dumps({"event": "listening"}))
-                    asyncio.create_task(process_speech(websocket))
+                    cancel_speech(websocket)
+                    await send_event(websocket, {"event": "listening"})
+                    await submit_turn(websocket, functools.partial(process_speech, websocket, trace_id=data.get("trace_id")))
 
                 elif event == "text_message":
                     text = data.get("text")
                     if text:
-                        # Thêm tin nhắn người dùng vào lịch sử trước khi xử lý
-                        history = client_chat_histories.get(websocket)
-                        if history is not None:
-                            history.append({"role": "user", "parts": [text]})
-                        await process_text(websocket, text, is_user_typed=True)
+                        if not await admit_turn(websocket):
+                            continue
+                        cancel_speech(websocket)
+                        stream = bool(data.get("stream", config.STREAM_RESPONSES))
+                        speak = bool(data.get("tts", client_options[websocket]["tts"]))
+                        await submit_turn(
+                            websocket, functools.partial(
+                                process_text, websocket, text, is_user_typed=True, stream=stream, speak=speak,
+                                trace_id=data.get("trace_id"),
+                            )
+                        )
                     else:
-                        await websocket.send(
-                            json.dumps({"event": "error", "message": "No text provided"})
+                        await send_event(websocket, {"event": "error", "message": "No text provided"})
+                elif event in ("typing", "partial_text"):
+                    # Nội dung đang gõ / giả thuyết STT tạm thời: chỉ tra cứu trước, không trả lời
+                    prefetcher = client_prefetchers.get(websocket)
+                    text = data.get("text")
+                    if prefetcher is not None and isinstance(text, str) and text.strip():
+                        prefetcher.update(text)
+                elif event == "set_options":
+                    options = client_options.setdefault(websocket, dict(DEFAULT_CLIENT_OPTIONS))
+                    for name in DEFAULT_CLIENT_OPTIONS:
+                        if name in data:
+                            options[name] = bool(data[name])
+                    await save_session(websocket)
+                    await send_event(websocket, {"event": "options_ack", "options": options})
+                elif event == "audio_start":
+                    cancel_speech(websocket)
+                    try:
+                        client_audio_sessions[websocket] = audio_module.AudioSession(
+                            sample_rate=int(data.get("sample_rate", 16000)),
+                            encoding=data.get("encoding", "pcm16"),
+                            channels=int(data.get("channels", 1)),
                         )
+                    except audio_module.AudioFormatError as e:
+                        await send_event(websocket, {"event": "error", "message": str(e)})
+                    else:
+                        await send_event(websocket, {"event": "listening"})
+                elif event == "audio_end":
+                    session = client_audio_sessions.pop(websocket, None)
+                    utterance = session.finish() if session is not None else None
+                    if utterance and await admit_turn(websocket):
+                        await submit_turn(websocket, functools.partial(
+                            process_speech, websocket, utterance, session.sample_rate, trace_id=data.get("trace_id")
+                        ))
+                    await send_event(websocket, {"event": "audio_end_ack"})
                 elif event == "stop_listening":
-                    logging.info("Stopping listening (not fully implemented yet)...")
-                    await websocket.send(json.dumps({"event": "stop_listening_ack"}))
+                    logging.info("Stopping listening: cancelling in-flight turn...")
+                    client_audio_sessions.pop(websocket, None) # Bỏ phần âm thanh chưa xử lý
+                    client_schedulers[websocket].cancel_pending() # Hủy STT/DB/LLM của lượt đang chạy
+                    cancel_speech(websocket)
+                    await send_event(websocket, {"event": "stop_listening_ack"})
                 else:
-                    await websocket.send(json.dumps({"event": "error", "message": "Unknown event"}))
+                    await send_event(websocket, {"event": "error", "message": "Unknown event"})
 
             except json.JSONDecodeError as e:
-                error_message = f"Invalid JSON from {websocket.remote_address}: {e}"
-                logging.error(error_message)
-                await websocket.send(json.dumps({"event": "error", "message": error_message}))
+                logging.warning(f"Invalid JSON from {websocket.remote_address}: {e}")
+                await send_event(websocket, {"event": "error", "message": f"Invalid JSON: {e}"})
             except Exception as e:
-                error_message = f"Error processing message from {websocket.remote_address}: {e}\n{traceback.format_exc()}"
-                logging.error(error_message)
-                await websocket.send(json.dumps({"event": "error", "message": error_message}))
+                # Chi tiết lỗi (traceback) chỉ ghi vào log, không gửi cho client
+                logging.error(f"Error processing message from {websocket.remote_address}: {e}", exc_info=True)
+                await send_event(websocket, {"event": "error", "message": "Internal server error."})
 
     except websockets.exceptions.ConnectionClosedOK:
         logging.info(f"Connection from {websocket.remote_address} closed normally.")
     except websockets.exceptions.ConnectionClosedError as e:
         logging.error(f"Connection error from {websocket.remote_address}: {e}")
     except Exception as e:
-        logging.error(f"Unexpected error in client handler for {websocket.remote_address}: {e}\n{traceback.format_exc()}")
+        logging.error(f"Unexpected error in client handler for {websocket.remote_address}: {e}", exc_info=True)
     finally:
+        scheduler = client_schedulers.pop(websocket, None)
+        if scheduler is not None:
+            await scheduler.close()
+        cancel_speech(websocket)
+        await save_session(websocket) # Lưu lần cuối để client có thể kết nối lại và tiếp tục
+        client_session_ids.pop(websocket, None)
+        client_rate_limiters.pop(websocket, None)
+        prefetcher = client_prefetchers.pop(websocket, None)
+        if prefetcher is not None:
+            prefetcher.close()
+        channel = client_channels.pop(websocket, None)
+        if channel is not None:
+            channel.close()
+        client_audio_sessions.pop(websocket, None)
+        client_options.pop(websocket, None)
         if websocket in client_chat_histories:
             del client_chat_histories[websocket] # Dọn dẹp lịch sử khi client ngắt kết nối
             logging.info(f"Chat history cleared for disconnected client: {websocket.remote_address}")
+        metrics_module.ACTIVE_SESSIONS.dec()
         logging.info(f"Client disconnected: {websocket.remote_address}")
 
-async def process_speech(websocket):
+async def _speculative_search(websocket, text, analysis):
+    """Tra cứu cho prefetch_module: chỉ chạy khi còn chỗ trống ở db_limiter, không giành chỗ của lượt thật."""
+    if not admission_module.db_limiter.has_capacity():
+        metrics_module.PREFETCH.inc(result="skipped")
+        raise admission_module.OverloadedError("No spare DB capacity for speculative search", 0.0, "db")
+    async with admission_module.db_limiter.slot(websocket):
+        return await db_module.search_knowledge_base_async(text, analysis=analysis)
+
+async def _session_store_call(fn, *args):
+    """Backend lưu phiên có I/O (sqlite/kv) chạy trong thread pool, backend bộ nhớ gọi trực tiếp."""
+    if session_module.get_store().blocking:
+        return await executor_module.run("db", fn, *args)
+    return fn(*args)
+
+async def resume_session(websocket, session_id):
+    """Gắn kết nối với session_id và nạp lịch sử/tùy chọn đã lưu. Trả về True nếu phiên cũ tồn tại."""
+    client_session_ids[websocket] = session_id
+    try:
+        state = await _session_store_call(session_module.get_store().load, session_id)
+    except Exception as e:
+        logging.error(f"Failed to load session {session_id}: {e}")
+        return False
+    if state is None:
+        # Session store không còn phiên (hết hạn, server khởi động lại...): dựng lại lịch sử gần nhất từ nhật ký
+        messages = await load_journal_history(session_id)
+        if messages:
+            client_chat_histories[websocket] = ChatHistory(maxlen=MAX_HISTORY_TURNS * 2, messages=messages)
+            logging.info(f"Session {session_id} rebuilt from the conversation journal ({len(messages)} messages).")
+        await save_session(websocket) # Ghi lại trạng thái hiện tại dưới session_id của client
+        return bool(messages)
+    client_chat_histories[websocket] = ChatHistory(
+        maxlen=MAX_HISTORY_TURNS * 2, messages=state.get("messages", ()), summary=state.get("summary", "")
+    )
+    options = dict(DEFAULT_CLIENT_OPTIONS)
+    options.update({name: value for name, value in state.get("options", {}).items() if name in DEFAULT_CLIENT_OPTIONS})
+    client_options[websocket] = options
+    logging.info(f"Session {session_id} resumed for {websocket.remote_address} ({len(client_chat_histories[websocket])} messages).")
+    return True
+
+async def save_session(websocket):
+    """Ghi lịch sử chat và tùy chọn của kết nối vào session store (lỗi chỉ được ghi log)."""
+    session_id = client_session_ids.get(websocket)
+    history = client_chat_histories.get(websocket)
+    if session_id is None or history is None:
+        return
+    state = {
+        "messages": list(history),
+        "summary": history.summary,
+        "options": client_options.get(websocket, DEFAULT_CLIENT_OPTIONS),
+    }
+    try:
+        await _session_store_call(session_module.get_store().save, session_id, state)
+    except Exception as e:
+        logging.error(f"Failed to save session {session_id}: {e}")
+
+async def load_journal_history(session_id):
+    journal = journal_module.journal
+    if journal is None:
+        return []
+    try:
+        return await journal.load_history(session_id, MAX_HISTORY_TURNS * 2)
+    except Exception as e:
+        logging.error(f"Failed to load journal history for session {session_id}: {e}")
+        return []
+
+async def journal_turn(websocket, question, answer, **fields):
+    """Đưa lượt vào nhật ký hội thoại (sau khi đã gửi câu trả lời; việc ghi MongoDB do task nền làm)."""
+    journal = journal_module.journal
+    session_id = client_session_ids.get(websocket)
+    if journal is None or session_id is None:
+        return
+    await journal.record(session_id, question, answer, trace_id=metrics_module.current_trace_id(), **fields)
+
+async def send_busy(websocket, reason, retry_after):
+    """Báo client đang quá tải và nên gửi lại sau retry_after giây (yêu cầu không được xếp hàng chờ)."""
+    metrics_module.REJECTED.inc(reason=reason)
+    await send_event(websocket, {
+        "event": "busy",
+        "reason": reason,
+        "retry_after": retry_after,
+        "message": f"Server is busy, please retry in {retry_after} s.",
+    })
+
+async def admit_turn(websocket):
+    """Kiểm tra giới hạn tốc độ gửi lượt của client trước khi nhận lượt mới. Trả về False (đã gửi busy) nếu vượt."""
+    bucket = client_rate_limiters.get(websocket)
+    if bucket is None:
+        return True
+    wait = bucket.try_acquire()
+    if not wait:
+        return True
+    logging.warning(f"Rate limit exceeded for {websocket.remote_address}, retry in {wait:.1f}s.")
+    await send_busy(websocket, "rate_limit", admission_module.retry_after_seconds(wait))
+    return False
+
+async def submit_turn(websocket, coro_factory):
+    """
+    Đưa một lượt vào TurnScheduler của client (lượt mới hủy lượt cũ đang chạy).
+    Client gửi dồn dập làm đầy hàng đợi sẽ bị báo lỗi, quá TURN_MAX_REJECTIONS lần liên tiếp thì bị ngắt kết nối.
+    """
+    scheduler = client_schedulers[websocket]
+    try:
+        scheduler.submit(coro_factory)
+    except scheduler_module.SessionOverloadedError:
+        logging.warning(f"Turn queue full for {websocket.remote_address} ({scheduler.consecutive_rejections} rejected in a row).")
+        if scheduler.consecutive_rejections >= config.TURN_MAX_REJECTIONS:
+            await websocket.close(code=1008, reason="Too many messages")
+            return
+        await send_event(websocket, {"event": "error", "message": "Too many messages, please slow down."})
+
+async def handle_audio_frame(websocket, frame):
+    """Đưa một frame âm thanh vào phiên của client; khi VAD thấy hết câu thì nhận dạng ở task nền."""
+    session = client_audio_sessions.get(websocket)
+    if session is None:
+        await send_event(websocket, {"event": "error", "message": "Send audio_start before audio frames."})
+        return
     try:
-        text_from_speech = stt_module.listen_and_recognize()
+        utterance = session.feed(frame)
+    except Exception as e:
+        logging.error(f"Invalid audio frame from {websocket.remote_address}: {e}")
+        await send_event(websocket, {"event": "error", "message": "Invalid audio frame."})
+        return
+    if utterance:
+        await send_event(websocket, {"event": "speech_end"})
+        if not await admit_turn(websocket): # Lượt do VAD kết thúc cũng tính vào giới hạn tốc độ như audio_end
+            return
+        await submit_turn(websocket, functools.partial(process_speech, websocket, utterance, session.sample_rate))
+
+async def process_speech(websocket, pcm=None, sample_rate=None, trace_id=None):
+    """
+    Chuyển giọng nói thành văn bản rồi xử lý như tin nhắn của người dùng.
+    pcm=None: ghi âm bằng micro của máy chủ (start_listening);
+    ngược lại: câu nói PCM16 do client gửi lên (audio_start + frame nhị phân).
+    """
+    metrics_module.trace_id_var.set(trace_id or metrics_module.new_trace_id())
+    try:
+        if pcm is None:
+            text_from_speech = await executor_module.run("stt", stt_module.listen_and_recognize)
+        else:
+            text_from_speech = await executor_module.run("stt", stt_module.recognize_pcm, pcm, sample_rate)
         if text_from_speech is None:
             logging.warning(f"STT module returned None for {websocket.remote_address}.")
-            await websocket.send(json.dumps({"event": "error", "message": "Speech recognition failed to return text."}))
+            await send_event(websocket, {"event": "error", "message": "Speech recognition failed to return text."})
             return
 
         logging.info(f"Speech-to-text result for {websocket.remote_address}: {text_from_speech}")
@@ -90,97 +368,433 @@ async def process_speech(websocket):
         history = client_chat_histories.get(websocket)
         if history is None: # Nên luôn tồn tại nếu client kết nối đúng cách
             logging.error(f"Chat history not found for {websocket.remote_address} in process_speech")
-            history = deque(maxlen=MAX_HISTORY_TURNS * 2) # Tạo mới nếu lỡ mất
+            history = ChatHistory(maxlen=MAX_HISTORY_TURNS * 2) # Tạo mới nếu lỡ mất
             client_chat_histories[websocket] = history
 
         if text_from_speech:
             # Gửi kết quả STT về UI
-            await websocket.send(json.dumps({"event": "chat_message", "role": "user_stt", "message": text_from_speech}))
-            # Thêm vào lịch sử
-            history.append({"role": "user", "parts": [text_from_speech]})
-            # Xử lý text để lấy phản hồi chatbot
-            await process_text(websocket, text_from_speech, is_user_typed=False)
+            await send_event(websocket, {"event": "chat_message", "role": "user_stt", "message": text_from_speech})
+            # Xử lý text (tin nhắn được thêm vào lịch sử cùng câu trả lời khi lượt xong) để lấy phản hồi chatbot
+            speak = client_options.get(websocket, DEFAULT_CLIENT_OPTIONS)["tts"]
+            await process_text(
+                websocket, text_from_speech, is_user_typed=False, stream=config.STREAM_RESPONSES, speak=speak,
+                trace_id=metrics_module.current_trace_id(),
+            )
         else: # Trường hợp STT trả về chuỗi rỗng
              logging.info(f"STT returned empty string for {websocket.remote_address}. Notifying client.")
              # Gửi sự kiện error cho client
-             await websocket.send(json.dumps({"event": "error", "message": "Không nhận dạng được giọng nói. Vui lòng thử lại."}))
+             await send_event(websocket, {"event": "error", "message": "Không nhận dạng được giọng nói. Vui lòng thử lại."})
+    except executor_module.ExecutorBusyError as e:
+        logging.warning(f"STT pool busy for {websocket.remote_address}: {e}")
+        await send_busy(websocket, "stt", admission_module.retry_after_seconds(config.BUSY_RETRY_AFTER_SECONDS))
     except Exception as e:
-        error_message = f"Speech-to-text processing error for {websocket.remote_address}: {e}\n{traceback.format_exc()}"
-        logging.error(error_message)
-        await websocket.send(json.dumps({"event": "error", "message": f"Speech-to-text error: {str(e)}"}))
+        logging.error(f"Speech-to-text processing error for {websocket.remote_address}: {e}", exc_info=True)
+        await send_event(websocket, {"event": "error", "message": "Speech-to-text error."})
 
-async def process_text(websocket, text_input, is_user_typed=False):
+async def send_event(websocket, event):
+    """
+    Gửi một sự kiện cho client theo giao thức đã thỏa thuận (protocol_module), gắn trace_id của lượt
+    đang xử lý (để client đối chiếu với log/metrics). Thời gian mã hóa + gửi được đo ở giai đoạn ws_send.
+    """
+    trace_id = metrics_module.current_trace_id()
+    if trace_id is not None:
+        event["trace_id"] = trace_id
+    channel = client_channels.get(websocket)
+    if channel is None: # Kết nối bị từ chối trước khi được đăng ký: gửi theo v1
+        channel = protocol_module.EventChannel(websocket)
+    await channel.send(event)
+
+async def stream_speech(websocket, text):
+    """
+    Gửi âm thanh của câu trả lời theo từng câu (audio_chunk, mp3) rồi audio_done.
+    Câu sau được tổng hợp trong khi câu trước đang được gửi/phát ở client.
+    """
+    pipeline = tts_module.SpeechPipeline(text)
+    seq = 0
+    try:
+        async for chunk_text, audio in executor_module.iterate("tts", pipeline.audio_chunks):
+            await send_event(websocket, {
+                "event": "audio_chunk",
+                "seq": seq,
+                "text": chunk_text,
+                "format": "mp3",
+                "audio": audio, # bytes: base64 trong JSON, giữ nguyên trong MessagePack (protocol_module)
+            })
+            if seq == 0:
+                logging.info(f"Time to first audio for {websocket.remote_address}: {pipeline.time_to_first_audio:.3f}s")
+            seq += 1
+        await send_event(websocket, {"event": "audio_done", "chunks": seq})
+    except asyncio.CancelledError:
+        pipeline.cancel()
+        raise
+    except Exception as e:
+        pipeline.cancel()
+        logging.error(f"TTS streaming error for {websocket.remote_address}: {e}")
+
+def start_speech(websocket, text):
+    """Bắt đầu gửi âm thanh câu trả lời ở task nền để client vẫn gửi được tin nhắn mới (barge-in)."""
+    cancel_speech(websocket)
+    client_speech_tasks[websocket] = asyncio.create_task(stream_speech(websocket, text))
+
+def cancel_speech(websocket):
+    """Dừng gửi âm thanh của lượt trước (nếu còn)."""
+    task = client_speech_tasks.pop(websocket, None)
+    if task is not None and not task.done():
+        task.cancel()
+        logging.info(f"Speech cancelled for {websocket.remote_address} (barge-in).")
+
+async def stream_chatbot_response(websocket, chat_history, db_context=None, use_cache=True, summary=""):
+    """
+    Gửi câu trả lời của Gemini theo từng phần (chat_delta) rồi chat_done với câu trả lời cuối.
+    chat_done.replaced = True khi câu trả lời cuối khác phần đã stream (ví dụ bị chặn thông tin cá nhân),
+    client nên thay nội dung đã hiển thị bằng chat_done.message.
+    """
+    streamed_parts = []
+    final_text = None
+    async for kind, text in executor_module.iterate(
+        "llm", llm_module.stream_chatbot_response, chat_history,
+        db_context=db_context, use_cache=use_cache, summary=summary,
+    ):
+        if kind == "delta":
+            streamed_parts.append(text)
+            await send_event(websocket, {"event": "chat_delta", "role": "chatbot", "delta": text})
+        else:
+            final_text = text
+
+    if final_text is None:
+        return None
+    await send_event(websocket, {
+        "event": "chat_done",
+        "role": "chatbot",
+        "message": final_text,
+        "replaced": final_text != "".join(streamed_parts),
+    })
+    return final_text
+
+async def process_text(websocket, text_input, is_user_typed=False, stream=False, speak=False, trace_id=None):
+    # Mỗi lượt chạy trong task riêng nên trace id chỉ có hiệu lực trong lượt này
+    metrics_module.trace_id_var.set(trace_id or metrics_module.new_trace_id())
+    try:
+        with metrics_module.timed("turn"):
+            outcome = await _process_text(websocket, text_input, is_user_typed, stream, speak)
+    except asyncio.CancelledError:
+        metrics_module.TURNS.inc(outcome="cancelled") # Bị lượt mới thay thế (TurnScheduler)
+        raise
+    metrics_module.TURNS.inc(outcome=outcome)
+
+async def _process_text(websocket, text_input, is_user_typed, stream, speak):
+    """Xử lý một lượt; trả về kết quả cho metrics: ok, empty, error, busy."""
     try:
         if not text_input:
             logging.warning(f"process_text received empty input for {websocket.remote_address}.")
-            return
+            return "empty"
 
         history = client_chat_histories.get(websocket)
         if history is None:
             logging.error(f"Chat history not found for {websocket.remote_address} in process_text")
             # Nếu không có history, chúng ta không thể xây dựng context cho LLM
             # Có thể gửi lỗi hoặc tạo một history rỗng tạm thời
-            await websocket.send(json.dumps({"event": "error", "message": "Chat session error. Please reconnect."}))
-            return
+            await send_event(websocket, {"event": "error", "message": "Chat session error. Please reconnect."})
+            return "error"
 
-        # Log tin nhắn đang được xử lý (tin nhắn này đã được thêm vào history ở nơi gọi)
+        # Tin nhắn của người dùng chỉ vào lịch sử cùng câu trả lời khi lượt xong: lượt bị lượt mới thay thế,
+        # bị hủy hay bị từ chối (busy) không để lại tin nhắn "user" không có câu trả lời
+        user_message = {"role": "user", "parts": [text_input]}
+        messages = list(history) + [user_message]
         logging.info(f"Processing text for {websocket.remote_address}: '{text_input}' (User typed: {is_user_typed})")
-        logging.info(f"Current history for {websocket.remote_address} (before LLM call): {list(history)}")
+        logging.debug(
+            "Current history for %s (before LLM call): %s", websocket.remote_address,
+            log_module.lazy(lambda: messages), extra={"event": "turn_history"},
+        )
 
 
         db_search_context = None
-        if db_module.should_search_db(text_input):
-            db_search_context = db_module.search_knowledge_base(text_input)
+        analysis = query_module.analyze(text_input)
+        if analysis.should_search:
+            prefetcher = client_prefetchers.get(websocket)
+            prefetched = False
+            if prefetcher is not None:
+                prefetched, db_search_context = await prefetcher.take(analysis)
+            if not prefetched:
+                async with admission_module.db_limiter.slot(websocket):
+                    db_search_context = await db_module.search_knowledge_base_async(text_input, analysis=analysis)
             if db_search_context:
                 logging.info(f"Context found in DB for {websocket.remote_address}: {db_search_context[:200]}...")
             else:
                 logging.info(f"No specific context found in DB for this query for {websocket.remote_address}.")
 
-        # Gọi LLM, truyền toàn bộ lịch sử hiện tại của client (deque sẽ được chuyển thành list khi truyền)
-        chatbot_response_text = llm_module.get_chatbot_response(list(history), db_context=db_search_context)
+        # Gọi LLM với lịch sử hiện tại của client cộng câu hỏi của lượt này, cùng bản tóm tắt các lượt cũ
+        use_cache = client_options.get(websocket, DEFAULT_CLIENT_OPTIONS)["llm_cache"]
+        async with admission_module.llm_limiter.slot(websocket):
+            if stream:
+                chatbot_response_text = await stream_chatbot_response(
+                    websocket, messages, db_context=db_search_context, use_cache=use_cache, summary=history.summary
+                )
+            else:
+                chatbot_response_text = await executor_module.run(
+                    "llm", llm_module.get_chatbot_response, messages,
+                    db_context=db_search_context, use_cache=use_cache, summary=history.summary,
+                )
 
         if chatbot_response_text is None:
             logging.error(f"LLM module returned None response for {websocket.remote_address}.")
-            await websocket.send(json.dumps({"event": "error", "message": "Chatbot failed to generate a response."}))
-            return
+            await send_event(websocket, {"event": "error", "message": "Chatbot failed to generate a response."})
+            return "error"
 
         logging.info(f"Chatbot response for {websocket.remote_address}: {chatbot_response_text[:200]}...")
-        # Thêm phản hồi của chatbot vào lịch sử
+        # Thêm câu hỏi và phản hồi của chatbot vào lịch sử
+        history.append(user_message)
         history.append({"role": "model", "parts": [chatbot_response_text]})
-        # Gửi phản hồi của chatbot về client
-        await websocket.send(json.dumps({"event": "chat_message", "role": "chatbot", "message": chatbot_response_text}))
+        await save_session(websocket)
+        # Gửi phản hồi của chatbot về client (chế độ streaming đã gửi chat_done)
+        if not stream:
+            await send_event(websocket, {"event": "chat_message", "role": "chatbot", "message": chatbot_response_text})
+        if speak:
+            start_speech(websocket, chatbot_response_text)
+        await journal_turn(
+            websocket, text_input, chatbot_response_text,
+            source="text" if is_user_typed else "speech", db_context=bool(db_search_context),
+        )
+        return "ok"
 
+    except admission_module.OverloadedError as e:
+        logging.warning(f"Admission rejected turn for {websocket.remote_address}: {e}")
+        await send_busy(websocket, e.reason, e.retry_after)
+        return "busy"
+    except executor_module.ExecutorBusyError as e:
+        logging.warning(f"Worker pool busy for {websocket.remote_address}: {e}")
+        await send_busy(websocket, "pool", admission_module.retry_after_seconds(config.BUSY_RETRY_AFTER_SECONDS))
+        return "busy"
     except Exception as e:
-        error_message = f"Chatbot processing error for {websocket.remote_address}: {e}\n{traceback.format_exc()}"
-        logging.error(error_message)
-        await websocket.send(json.dumps({"event": "error", "message": f"Chatbot processing error: {str(e)}"}))
-
-async def main():
-    # ... (phần main giữ nguyên)
-    if db_module.collection is None:
-        logging.error("Cannot start server: MongoDB collection is not initialized.")
-        return
-    if llm_module.model is None:
-        logging.error("Cannot start server: LLM model is not initialized.")
+        logging.error(f"Chatbot processing error for {websocket.remote_address}: {e}", exc_info=True)
+        await send_event(websocket, {"event": "error", "message": "Chatbot processing error."})
+        return "error"
+
+def register_runtime_metrics():
+    """Metric đọc lúc xuất từ thống kê sẵn có: cache (KB, Gemini, TTS), các thread pool, kiểm soát tải, nhật ký hội thoại và lớp bảo vệ Gemini."""
+    def cache_requests():
+        caches = {"llm": llm_module.cache_stats(), "tts": tts_module.cache_stats()}
+        if db_module.kb_cache is not None:
+            caches["kb"] = db_module.kb_cache.stats()
+        values = {}
+        for name, stats in caches.items():
+            values[(name, "hit")] = stats["hits"]
+            values[(name, "miss")] = stats["misses"]
+        values[("llm", "coalesced")] = caches["llm"]["coalesced"]
+        return values
+
+    def executor_stats(field):
+        return lambda: {(kind,): stats[field] for kind, stats in executor_module.stats().items()}
+
+    metrics_module.register_callback(
+        "chatbot_cache_requests_total", "Cache lookups by cache and result.", "counter", cache_requests, ["cache", "result"]
+    )
+    metrics_module.register_callback(
+        "chatbot_executor_queued", "Tasks waiting for a worker thread.", "gauge", executor_stats("queued"), ["pool"]
+    )
+    metrics_module.register_callback(
+        "chatbot_executor_in_flight", "Tasks running on worker threads.", "gauge", executor_stats("in_flight"), ["pool"]
+    )
+    metrics_module.register_callback(
+        "chatbot_executor_rejected_total", "Tasks rejected because the pool queue was full.", "counter",
+        executor_stats("rejected"), ["pool"]
+    )
+
+    def admission_stats(field):
+        return lambda: {(name,): stats[field] for name, stats in admission_module.stats().items()}
+
+    metrics_module.register_callback(
+        "chatbot_admission_in_flight", "Calls holding an admission slot.", "gauge", admission_stats("in_flight"), ["limiter"]
+    )
+    metrics_module.register_callback(
+        "chatbot_admission_waiting", "Calls waiting for an admission slot.", "gauge", admission_stats("waiting"), ["limiter"]
+    )
+
+    breaker_states = {"closed": 0, "half_open": 1, "open": 2}
+    journal = journal_module.journal
+    if journal is not None:
+        metrics_module.register_callback(
+            "chatbot_journal_buffered", "Conversation turns waiting to be written to MongoDB.", "gauge",
+            lambda: {(): journal.stats()["buffered"]}
+        )
+        metrics_module.register_callback(
+            "chatbot_journal_turns_total", "Conversation turns written to or dropped from the journal.", "counter",
+            lambda: {("written",): journal.stats()["written"], ("dropped",): journal.stats()["dropped"]}, ["result"]
+        )
+
+    metrics_module.register_callback(
+        "chatbot_llm_circuit_state", "Gemini circuit breaker state (0 closed, 1 half-open, 2 open).", "gauge",
+        lambda: {(): breaker_states[llm_module.llm_caller.breaker.state]}
+    )
+    metrics_module.register_callback(
+        "chatbot_llm_resilience_events_total", "Gemini retries, hedges, deadline misses and short-circuited calls.",
+        "counter", lambda: {(event,): value for event, value in llm_module.llm_caller.stats().items() if event != "breaker"},
+        ["event"]
+    )
+
+def register_readiness_checks():
+    """Điều kiện của /readyz: đã làm nóng xong, MongoDB trả lời ping gần nhất, model Gemini đã được tạo."""
+    metrics_module.register_readiness_check("warmup", lambda: warmed_up)
+    metrics_module.register_readiness_check("mongo", lambda: db_module.healthy)
+    metrics_module.register_readiness_check("llm", lambda: llm_module.model is not None)
+
+async def _warm_up_once():
+    # Kết nối MongoDB và Gemini trong chính tiến trình này (sau khi fork nếu chạy nhiều worker);
+    # import SDK Gemini mất vài giây nên cũng chạy trong thread pool, không chặn loop
+    if await executor_module.run("db", db_module.connect) is None:
+        return False
+    if await executor_module.run("llm", llm_module.configure) is None:
+        return False
+    # Từ vựng thương hiệu/danh mục cho query_module
+    if not await executor_module.run("db", db_module.load_query_vocabulary):
+        return False
+    # MONGO_DRIVER = "async": mở và làm nóng pool kết nối async trên loop này
+    await db_module.connect_async()
+    if config.SEARCH_BACKEND == "index":
+        # Nạp chỉ mục tìm kiếm để truy vấn đầu tiên không phải chờ
+        if await executor_module.run("db", db_module.get_search_index) is None:
+            return False
+    return True
+
+async def maintain_dependencies():
+    """
+    Task nền chạy sau khi server đã mở cổng: làm nóng (thử lại với khoảng chờ tăng dần cho tới khi MongoDB/Gemini
+    sẵn sàng, kể cả khi chúng chỉ lên sau server), rồi ping MongoDB mỗi HEALTH_CHECK_INTERVAL giây cho /readyz.
+    Trong lúc làm nóng, lượt của client vẫn được xử lý (kết nối khi cần, thiếu MongoDB thì trả lời không có ngữ cảnh).
+    """
+    global warmed_up
+    backoff = resilience_module.ReconnectBackoff(config.MONGO_RECONNECT_MIN_SECONDS, config.MONGO_RECONNECT_MAX_SECONDS)
+    started = time.perf_counter()
+    while True:
+        try:
+            if await _warm_up_once():
+                break
+        except Exception as e:
+            logging.error(f"Warm-up failed: {e}", exc_info=True)
+        delay = backoff.failed()
+        logging.warning(f"Warm-up incomplete (MongoDB or Gemini unavailable), retrying in {delay:.1f}s.")
+        await asyncio.sleep(delay)
+    warmed_up = True
+    logging.info(f"Warm-up finished in {time.perf_counter() - started:.2f}s, worker is ready.")
+    if journal_module.journal is not None:
+        await journal_module.journal.ensure_index() # MongoDB có thể chưa kết nối lúc journal.start()
+
+    if config.HEALTH_CHECK_INTERVAL <= 0:
         return
+    while True:
+        await asyncio.sleep(config.HEALTH_CHECK_INTERVAL)
+        was_healthy = db_module.healthy
+        try:
+            healthy = await executor_module.run("db", db_module.check_health)
+        except executor_module.ExecutorBusyError:
+            continue # Pool đang đầy: giữ kết quả cũ, kiểm tra lại ở chu kỳ sau
+        if healthy and not was_healthy:
+            logging.info("MongoDB is reachable again.")
+        elif was_healthy and not healthy:
+            logging.warning("MongoDB is unreachable, reporting not ready.")
 
+async def watch_catalog_version():
+    """Đọc phiên bản danh mục trong MongoDB mỗi CATALOG_VERSION_POLL_SECONDS giây: nhập danh mục xong thì cache tra cứu được bỏ."""
+    while True:
+        await asyncio.sleep(config.CATALOG_VERSION_POLL_SECONDS)
+        try:
+            if await executor_module.run("db", db_module.refresh_catalog_version):
+                logging.info(f"Catalog version changed to {db_module.catalog_db_version}, knowledge-base cache cleared.")
+        except Exception as e: # MongoDB tạm lỗi hoặc pool đầy: thử lại ở chu kỳ sau
+            logging.warning(f"Catalog version check failed: {e}")
+
+async def main(sock=None, reuse_port=False, worker_id=0):
+    """
+    Chạy WebSocket server. sock: socket nghe dùng chung do tiến trình cha tạo (chế độ nhiều worker không có
+    SO_REUSEPORT); reuse_port: mỗi worker tự bind cùng cổng, hệ điều hành chia kết nối giữa các worker.
+    worker_id: endpoint metrics của worker thứ i nằm ở cổng METRICS_PORT + i.
+    Cổng được mở ngay; kết nối MongoDB/Gemini được làm nóng ở task nền (maintain_dependencies), xem /readyz.
+    """
+    # Endpoint metrics/probe mở trước tiên để /healthz trả lời ngay và /readyz theo dõi được quá trình làm nóng
+    register_runtime_metrics()
+    register_readiness_checks()
+    metrics_server = None
+    if config.METRICS_PORT:
+        try:
+            metrics_server = await metrics_module.start_http_server(port=config.METRICS_PORT + worker_id)
+        except OSError as e:
+            logging.error(f"Metrics endpoint disabled: {e}")
+
+    # Mở session store trước khi nhận client (lỗi cấu hình được báo ngay khi khởi động)
+    await executor_module.run("db", session_module.get_store)
+    if journal_module.journal is not None:
+        await journal_module.journal.start()
+    dependencies_task = asyncio.create_task(maintain_dependencies())
+    catalog_task = None
+    if config.CATALOG_VERSION_POLL_SECONDS > 0 and db_module.kb_cache is not None:
+        catalog_task = asyncio.create_task(watch_catalog_version())
+
+    host, port = config.SERVER_HOST, config.SERVER_PORT
+    if sock is not None:
+        serve_kwargs = {"sock": sock}
+    else:
+        serve_kwargs = {"host": host, "port": port, "reuse_port": reuse_port or None}
+    serve_kwargs.update(protocol_module.server_options()) # permessage-deflate theo cấu hình WS_DEFLATE_*
+
+    stats_task = asyncio.create_task(executor_module.report_stats_periodically())
     try:
-        async with websockets.serve(handle_client, "0.0.0.0", 8765) as server:
-            logging.info(f"WebSocket server started and listening on ws://0.0.0.0:8765")
+        async with websockets.serve(handle_client, **serve_kwargs) as server:
+            logging.info(f"WebSocket server started and listening on ws://{host}:{port} (pid {os.getpid()})")
             try:
                 actual_ip = [sock.getsockname()[0] for sock in server.sockets if sock.family == asyncio.constants.AF_INET]
                 if actual_ip:
-                    logging.info(f"Access server from other devices in network via ws://{actual_ip[0]}:8765")
+                    logging.info(f"Access server from other devices in network via ws://{actual_ip[0]}:{port}")
             except Exception:
                 pass
             await server.wait_closed()
     except OSError as e:
         if e.errno == 98: # Address already in use
-             logging.error(f"Server startup failed: Port 8765 is already in use. {e}")
+             logging.error(f"Server startup failed: Port {port} is already in use. {e}")
         else:
-             logging.error(f"Server startup failed with OSError: {e}\n{traceback.format_exc()}")
+             logging.error(f"Server startup failed with OSError: {e}", exc_info=True)
     except Exception as e:
-        logging.error(f"Server startup failed: {e}\n{traceback.format_exc()}")
+        logging.error(f"Server startup failed: {e}", exc_info=True)
+    finally:
+        stats_task.cancel()
+        dependencies_task.cancel()
+        if catalog_task is not None:
+            catalog_task.cancel()
+        if metrics_server is not None:
+            metrics_server.close()
+        if journal_module.journal is not None:
+            await journal_module.journal.close() # Ghi nốt các lượt còn trong bộ đệm trước khi dừng thread pool
+        session_module.get_store().close()
+        executor_module.shutdown(wait=False)
+
+def run_worker(worker_id, sock=None):
+    """Điểm vào của một tiến trình worker (chế độ --workers N)."""
+    log_module.setup_logging() # Thread ghi log của tiến trình cha không tồn tại sau fork
+    logging.info(f"Worker {worker_id} (pid {os.getpid()}) initializing...")
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl+C do tiến trình cha xử lý, worker dừng bằng SIGTERM
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        asyncio.run(main(sock=sock, reuse_port=sock is None, worker_id=worker_id))
+    except SystemExit:
+        pass
+
+def run_multiprocess(workers):
+    if config.SESSION_BACKEND == "memory":
+        logging.warning("SESSION_BACKEND=memory is per process: a client reconnecting to another worker "
+                        "will not find its session. Use 'sqlite' or 'kv' with --workers.")
+    sock = None
+    if not (config.SERVER_REUSE_PORT and worker_module.reuse_port_supported()):
+        # Không có SO_REUSEPORT: bind một lần ở tiến trình cha, các worker cùng accept trên socket này
+        sock = worker_module.create_listening_socket(config.SERVER_HOST, config.SERVER_PORT)
+        logging.info(f"Sharing listening socket {config.SERVER_HOST}:{config.SERVER_PORT} with {workers} workers.")
+    worker_module.WorkerSupervisor(run_worker, workers, args=(sock,)).run()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="WebSocket chatbot server")
+    parser.add_argument("--workers", type=int, default=config.SERVER_WORKERS,
+                        help="Số tiến trình worker (mặc định SERVER_WORKERS). 1 = chạy trong tiến trình hiện tại.")
+    cli_args = parser.parse_args()
+    log_module.setup_logging()
+    if cli_args.workers > 1:
+        run_multiprocess(cli_args.workers)
+    else:
+        asyncio.run(main())
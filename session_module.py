@@ -0,0 +1,423 @@
+# session_module.py
+# Lưu trạng thái hội thoại (lịch sử chat, bản tóm tắt, tùy chọn) theo session_id do client gửi lên,
+# tách khỏi đối tượng websocket để client kết nối lại vẫn tiếp tục được và nhiều tiến trình server dùng chung.
+# Ba backend: "memory" (trong tiến trình), "sqlite" (file cục bộ), "kv" (giao thức RESP, tương thích Redis).
+import asyncio
+import json
+import logging
+import socket
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import config
+
+
+def encode_state(state):
+    """Trạng thái phiên (dict) -> bytes JSON gọn đã nén."""
+    return zlib.compress(json.dumps(state, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def decode_state(data):
+    return json.loads(zlib.decompress(data).decode("utf-8"))
+
+
+class SessionStore:
+    """
+    Giao diện chung của các backend. Các hàm là đồng bộ;
+    backend có `blocking = True` (I/O đĩa/mạng) nên được gọi qua thread pool.
+    """
+
+    blocking = True
+
+    def load(self, session_id):
+        """Trả về dict trạng thái của phiên, hoặc None nếu không có / đã hết hạn."""
+        raise NotImplementedError
+
+    def save(self, session_id, state):
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Lưu trong bộ nhớ tiến trình dưới dạng JSON nén. Phiên không hoạt động quá `ttl` giây bị xóa;
+    khi tổng dung lượng vượt `max_bytes`, phiên lâu không dùng nhất bị xóa trước.
+    """
+
+    blocking = False
+
+    def __init__(self, ttl=None, max_bytes=None):
+        self.ttl = config.SESSION_TTL_SECONDS if ttl is None else ttl
+        self.max_bytes = config.SESSION_MEMORY_MAX_BYTES if max_bytes is None else max_bytes
+        self._sessions = OrderedDict() # session_id -> (dữ liệu nén, thời điểm dùng gần nhất)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _remove(self, session_id):
+        data, _ = self._sessions.pop(session_id)
+        self._bytes -= len(data)
+
+    def _evict(self, now):
+        # Thứ tự trong OrderedDict là thứ tự dùng gần nhất, nên chỉ cần xét từ đầu
+        while self._sessions:
+            session_id, (data, last_used) = next(iter(self._sessions.items()))
+            expired = self.ttl and now - last_used > self.ttl
+            if not expired and self._bytes <= self.max_bytes:
+                break
+            self._remove(session_id)
+            self.evictions += 1
+
+    def load(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            self._sessions[session_id] = (entry[0], now)
+            self._sessions.move_to_end(session_id)
+            return decode_state(entry[0])
+
+    def save(self, session_id, state):
+        data = encode_state(state)
+        now = time.monotonic()
+        with self._lock:
+            if session_id in self._sessions:
+                self._remove(session_id)
+            self._sessions[session_id] = (data, now)
+            self._bytes += len(data)
+            self._evict(now)
+
+    def delete(self, session_id):
+        with self._lock:
+            if session_id in self._sessions:
+                self._remove(session_id)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Lưu trong file SQLite (chế độ WAL), dùng chung được giữa các tiến trình trên cùng máy
+    và giữ được phiên qua lần khởi động lại server.
+    """
+
+    PURGE_EVERY = 100 # Số lần save giữa hai lần xóa phiên hết hạn
+
+    def __init__(self, path=None, ttl=None):
+        self.path = path or config.SESSION_SQLITE_PATH
+        self.ttl = config.SESSION_TTL_SECONDS if ttl is None else ttl
+        self._local = threading.local() # Mỗi thread một kết nối
+        self._connections = set() # Kết nối của mọi thread, để close() đóng hết
+        self._connections_lock = threading.Lock()
+        self._saves = 0
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, data BLOB NOT NULL, expires_at REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)")
+        conn.commit()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or conn not in self._connections: # Chưa có, hoặc đã bị close() đóng
+            # Mỗi kết nối chỉ được dùng bởi thread đã tạo nó; check_same_thread=False để close() đóng được từ thread khác
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with self._connections_lock:
+                self._connections.add(conn)
+            self._local.conn = conn
+        return conn
+
+    def _expires_at(self):
+        return time.time() + self.ttl if self.ttl else None
+
+    def load(self, session_id):
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT data, expires_at FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        data, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            self.delete(session_id)
+            return None
+        if self.ttl: # Gia hạn TTL khi phiên được dùng lại
+            conn.execute("UPDATE sessions SET expires_at = ? WHERE session_id = ?", (self._expires_at(), session_id))
+            conn.commit()
+        return decode_state(data)
+
+    def save(self, session_id, state):
+        conn = self._connection()
+        conn.execute(
+            "INSERT INTO sessions (session_id, data, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(session_id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at",
+            (session_id, encode_state(state), self._expires_at()),
+        )
+        conn.commit()
+        self._saves += 1
+        if self._saves % self.PURGE_EVERY == 0:
+            self.purge_expired()
+
+    def delete(self, session_id):
+        conn = self._connection()
+        conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+        conn.commit()
+
+    def purge_expired(self):
+        conn = self._connection()
+        deleted = conn.execute("DELETE FROM sessions WHERE expires_at < ?", (time.time(),)).rowcount
+        conn.commit()
+        return deleted
+
+    def close(self):
+        """Đóng kết nối của mọi thread (không chỉ thread gọi close)."""
+        with self._connections_lock:
+            connections, self._connections = self._connections, set()
+        for conn in connections:
+            conn.close()
+        self._local.conn = None
+
+
+class KVError(RuntimeError):
+    """Lỗi do máy chủ KV trả về."""
+
+
+def _encode_command(*args):
+    parts = [f"*{len(args)}\r\n".encode()]
+    for arg in args:
+        if isinstance(arg, str):
+            arg = arg.encode("utf-8")
+        elif not isinstance(arg, (bytes, bytearray)):
+            arg = str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+def _read_reply(reader):
+    """Đọc một câu trả lời RESP từ file-like `reader` (chế độ nhị phân)."""
+    line = reader.readline()
+    if not line:
+        raise ConnectionError("KV server closed the connection.")
+    kind, payload = line[:1], line[1:-2]
+    if kind == b"+":
+        return payload.decode()
+    if kind == b"-":
+        raise KVError(payload.decode())
+    if kind == b":":
+        return int(payload)
+    if kind == b"$":
+        length = int(payload)
+        if length < 0:
+            return None
+        data = reader.read(length + 2)
+        return data[:-2]
+    if kind == b"*":
+        count = int(payload)
+        return None if count < 0 else [_read_reply(reader) for _ in range(count)]
+    raise KVError(f"Unexpected reply from KV server: {line!r}")
+
+
+class KVSessionStore(SessionStore):
+    """
+    Lưu trên máy chủ key-value qua giao thức RESP (Redis hoặc LocalKVServer bên dưới),
+    để nhiều tiến trình / nhiều máy chạy server dùng chung phiên. TTL do máy chủ KV xử lý.
+    """
+
+    def __init__(self, host=None, port=None, ttl=None, prefix="session:", timeout=2.0):
+        self.host = host or config.SESSION_KV_HOST
+        self.port = port or config.SESSION_KV_PORT
+        self.ttl = config.SESSION_TTL_SECONDS if ttl is None else ttl
+        self.prefix = prefix
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock = None
+        self._reader = None
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self._sock.makefile("rb")
+
+    def _disconnect(self):
+        if self._sock is not None:
+            try:
+                self._reader.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._reader = None
+
+    def execute(self, *args):
+        """Gửi một lệnh và chờ kết quả; kết nối lại một lần nếu kết nối cũ đã đứt."""
+        with self._lock:
+            for attempt in (1, 2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    self._sock.sendall(_encode_command(*args))
+                    return _read_reply(self._reader)
+                except (OSError, ConnectionError):
+                    self._disconnect()
+                    if attempt == 2:
+                        raise
+
+    def load(self, session_id):
+        key = self.prefix + session_id
+        data = self.execute("GET", key)
+        if data is None:
+            return None
+        if self.ttl: # Gia hạn TTL khi phiên được dùng lại
+            self.execute("EXPIRE", key, int(self.ttl))
+        return decode_state(data)
+
+    def save(self, session_id, state):
+        key = self.prefix + session_id
+        if self.ttl:
+            self.execute("SET", key, encode_state(state), "EX", int(self.ttl))
+        else:
+            self.execute("SET", key, encode_state(state))
+
+    def delete(self, session_id):
+        self.execute("DEL", self.prefix + session_id)
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+
+class LocalKVServer:
+    """
+    Máy chủ KV tối giản nói giao thức RESP (PING, GET, SET [EX], DEL, EXPIRE) chạy trên asyncio.
+    Dùng thay Redis khi phát triển/kiểm thử: `python session_module.py --port 6380`.
+    """
+
+    def __init__(self, host="127.0.0.1", port=6380):
+        self.host = host
+        self.port = port
+        self._data = {} # key -> (value, thời điểm hết hạn hoặc None)
+        self._server = None
+
+    def _get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    def _execute(self, args):
+        command = args[0].upper()
+        if command == b"PING":
+            return b"+PONG\r\n"
+        if command == b"GET" and len(args) == 2:
+            value = self._get(args[1])
+            return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+        if command == b"SET" and len(args) in (3, 5):
+            expires_at = None
+            if len(args) == 5:
+                if args[3].upper() != b"EX":
+                    return b"-ERR syntax error\r\n"
+                expires_at = time.monotonic() + int(args[4])
+            self._data[args[1]] = (args[2], expires_at)
+            return b"+OK\r\n"
+        if command == b"DEL" and len(args) >= 2:
+            deleted = 0
+            for key in args[1:]:
+                if self._get(key) is not None:
+                    del self._data[key]
+                    deleted += 1
+            return b":%d\r\n" % deleted
+        if command == b"EXPIRE" and len(args) == 3:
+            value = self._get(args[1])
+            if value is None:
+                return b":0\r\n"
+            self._data[args[1]] = (value, time.monotonic() + int(args[2]))
+            return b":1\r\n"
+        return b"-ERR unknown command or wrong number of arguments\r\n"
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                header = await reader.readline()
+                if not header:
+                    break
+                if header[:1] != b"*":
+                    writer.write(b"-ERR protocol error\r\n")
+                    break
+                args = []
+                for _ in range(int(header[1:-2])):
+                    length = int((await reader.readline())[1:-2])
+                    args.append((await reader.readexactly(length + 2))[:-2])
+                writer.write(self._execute(args) if args else b"-ERR empty command\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1] # port=0: hệ điều hành chọn port trống
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def serve_forever(self):
+        await self.start()
+        logging.info(f"Local KV server listening on {self.host}:{self.port}")
+        await self._server.serve_forever()
+
+
+SESSION_BACKENDS = {
+    "memory": MemorySessionStore,
+    "sqlite": SQLiteSessionStore,
+    "kv": KVSessionStore,
+}
+
+_store = None
+
+def get_store():
+    """Backend được cấu hình bởi SESSION_BACKEND (khởi tạo một lần)."""
+    global _store
+    if _store is None:
+        backend = SESSION_BACKENDS.get(config.SESSION_BACKEND)
+        if backend is None:
+            raise ValueError(f"Unknown session backend: {config.SESSION_BACKEND}")
+        _store = backend()
+        logging.info(f"Session store: {config.SESSION_BACKEND}")
+    return _store
+
+
+if __name__ == '__main__':
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Máy chủ KV cục bộ cho SESSION_BACKEND=kv")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=config.SESSION_KV_PORT)
+    args = parser.parse_args()
+    asyncio.run(LocalKVServer(args.host, args.port).serve_forever())
@@ -1,12 +1,16 @@
 # stt_module.py
-import speech_recognition as sr
+# speech_recognition chỉ được import khi nhận dạng lần đầu: worker không dùng giọng nói không phải nạp thư viện này
 import logging
+import config
+import metrics_module
 
 # Cấu hình logging (nếu chưa có)
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+@metrics_module.timed("stt")
 def listen_and_recognize():
     """Ghi âm và chuyển giọng nói thành văn bản."""
+    import speech_recognition as sr
     r = sr.Recognizer()
     with sr.Microphone() as source:
         logging.info("Nói gì đó...")
@@ -28,4 +32,39 @@ def listen_and_recognize():
         return ""
     except sr.RequestError as e:
         logging.error("Không thể yêu cầu dịch vụ STT; {0}".format(e))
-        return "" # Hoặc trả về một thông báo lỗi cụ thể hơn
\ No newline at end of file
+        return "" # Hoặc trả về một thông báo lỗi cụ thể hơn
+
+def recognize_google_pcm(pcm, sample_rate, sample_width=2):
+    """Nhận dạng một câu nói PCM (mono) bằng Google Web Speech API."""
+    import speech_recognition as sr
+    r = sr.Recognizer()
+    audio = sr.AudioData(pcm, sample_rate, sample_width)
+    try:
+        text = r.recognize_google(audio, language=config.LANGUAGE_CODE)
+        logging.info("Bạn đã nói: " + text)
+        return text
+    except sr.UnknownValueError:
+        logging.error("Không nhận diện được giọng nói")
+        return ""
+    except sr.RequestError as e:
+        logging.error("Không thể yêu cầu dịch vụ STT; {0}".format(e))
+        return ""
+
+# Các backend nhận dạng cho âm thanh do client gửi lên: hàm (pcm, sample_rate, sample_width) -> str
+RECOGNIZER_BACKENDS = {
+    "google": recognize_google_pcm,
+}
+
+def register_recognizer(name, recognizer):
+    """Đăng ký một backend nhận dạng mới (ví dụ Whisper cục bộ, hoặc backend giả cho benchmark)."""
+    RECOGNIZER_BACKENDS[name] = recognizer
+
+@metrics_module.timed("stt")
+def recognize_pcm(pcm, sample_rate, sample_width=2, backend=None):
+    """Nhận dạng PCM bằng backend được cấu hình (STT_BACKEND)."""
+    backend = backend or config.STT_BACKEND
+    recognizer = RECOGNIZER_BACKENDS.get(backend)
+    if recognizer is None:
+        raise ValueError(f"Unknown STT backend: {backend}")
+    logging.info("Đang nhận dạng...")
+    return recognizer(pcm, sample_rate, sample_width)
@@ -0,0 +1,85 @@
+# test_admission_module.py
+# Kiểm thử token bucket và hàng chờ công bằng của admission_module. Chạy bằng: python -m pytest -q
+import asyncio
+
+import pytest
+
+import admission_module
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_retry_after_rounds_up_to_whole_seconds():
+    assert admission_module.retry_after_seconds(0) == 1
+    assert admission_module.retry_after_seconds(1.2) == 2
+    assert admission_module.retry_after_seconds(3) == 3
+
+
+def test_token_bucket_allows_burst_then_refills():
+    clock = FakeClock()
+    bucket = admission_module.TokenBucket(rate=2, burst=3, clock=clock)
+    assert [bucket.try_acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.try_acquire() == pytest.approx(0.5) # Cần nửa giây cho token tiếp theo
+    clock.now = 0.5
+    assert bucket.try_acquire() == 0.0
+    clock.now = 100
+    assert [bucket.try_acquire() for _ in range(4)][-1] > 0 # Không dồn quá burst
+
+
+def test_limiter_rejects_when_queue_is_full():
+    async def scenario():
+        limiter = admission_module.FairLimiter("test", capacity=1, max_waiting=0, max_wait=5)
+        await limiter.acquire("a")
+        assert not limiter.has_capacity()
+        with pytest.raises(admission_module.OverloadedError) as excinfo:
+            await limiter.acquire("b")
+        limiter.release()
+        assert limiter.has_capacity()
+        return excinfo.value, limiter.stats()
+
+    error, stats = asyncio.run(scenario())
+    assert error.reason == "test" and error.retry_after >= 1
+    assert stats["admitted"] == 1 and stats["rejected"] == 1 and stats["in_flight"] == 0
+
+
+def test_waiting_sessions_are_served_round_robin():
+    async def scenario():
+        limiter = admission_module.FairLimiter("test", capacity=1, max_waiting=10, max_wait=5)
+        await limiter.acquire("holder")
+        order = []
+
+        async def request(session, name):
+            async with limiter.slot(session):
+                order.append(name)
+
+        # Phiên "a" gửi ba yêu cầu trước khi "b" gửi một: "b" vẫn được phục vụ ngay sau yêu cầu đầu của "a"
+        tasks = [asyncio.create_task(request("a", f"a{i}")) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(request("b", "b0")))
+        await asyncio.sleep(0)
+        limiter.release()
+        await asyncio.gather(*tasks)
+        return order, limiter.stats()
+
+    order, stats = asyncio.run(scenario())
+    assert order == ["a0", "b0", "a1", "a2"]
+    assert stats["in_flight"] == 0 and stats["waiting"] == 0
+
+
+def test_waiting_request_times_out():
+    async def scenario():
+        limiter = admission_module.FairLimiter("test", capacity=1, max_waiting=10, max_wait=0.05)
+        limiter._service_time = 0.01 # Ước tính ngắn để yêu cầu được vào hàng chờ
+        await limiter.acquire("holder")
+        with pytest.raises(admission_module.OverloadedError):
+            await limiter.acquire("b")
+        return limiter.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["timed_out"] == 1 and stats["waiting"] == 0 and stats["in_flight"] == 1
@@ -0,0 +1,93 @@
+# test_audio_module.py
+# Kiểm thử ring buffer, VAD theo năng lượng và việc tách câu nói của AudioSession. Chạy bằng: python -m pytest -q
+from array import array
+
+import pytest
+
+import audio_module
+
+
+def _tone(samples, amplitude):
+    return array("h", [amplitude if i % 2 else -amplitude for i in range(samples)]).tobytes()
+
+
+def test_ring_buffer_wraps_around():
+    ring = audio_module.RingBuffer(8)
+    ring.write(b"abcdef")
+    ring.write(b"ghij") # Ghi vòng qua cuối bộ đệm
+    assert ring.total_written == 10
+    assert ring.read_since(2) == b"cdefghij"
+    assert ring.read_since(6) == b"ghij"
+    assert ring.read_since(0) == b"cdefghij" # Phần đầu đã bị ghi đè
+    assert ring.read_since(10) == b""
+
+
+def test_ring_buffer_oversized_write_advances_by_full_length():
+    ring = audio_module.RingBuffer(4)
+    ring.write(b"12345678")
+    assert ring.total_written == 8
+    assert ring.read_since(0) == b"5678"
+    assert ring.read_since(6) == b"78"
+    ring.write(b"ab")
+    assert ring.total_written == 10
+    assert ring.read_since(6) == b"78ab"
+
+
+def test_ring_buffer_oversized_write_after_partial_fill():
+    ring = audio_module.RingBuffer(4)
+    ring.write(b"xy")
+    ring.write(b"abcdef")
+    assert ring.total_written == 8
+    assert ring.read_since(4) == b"cdef"
+
+
+def test_vad_detects_start_and_end():
+    vad = audio_module.EnergyVAD(16000, frame_ms=20, threshold=500, start_frames=2, end_silence_ms=60)
+    loud, quiet = _tone(320, 2000), _tone(320, 0)
+    assert vad.process(loud) is None
+    assert vad.process(loud) == "start"
+    assert [vad.process(quiet) for _ in range(3)] == [None, None, "end"]
+    assert not vad.in_speech
+
+
+@pytest.fixture
+def vad_config(monkeypatch):
+    import config
+    monkeypatch.setattr(config, "AUDIO_VAD_FRAME_MS", 20)
+    monkeypatch.setattr(config, "AUDIO_VAD_THRESHOLD", 500)
+    monkeypatch.setattr(config, "AUDIO_VAD_START_FRAMES", 2)
+    monkeypatch.setattr(config, "AUDIO_VAD_END_SILENCE_MS", 100)
+    monkeypatch.setattr(config, "AUDIO_PREROLL_MS", 0)
+    monkeypatch.setattr(config, "AUDIO_MAX_UTTERANCE_SECONDS", 1)
+    return config
+
+
+def test_session_returns_utterance_after_silence(vad_config):
+    session = audio_module.AudioSession(sample_rate=16000)
+    speech = _tone(320 * 10, 3000)
+    assert session.feed(_tone(320 * 5, 0)) is None
+    assert session.feed(speech) is None
+    assert session.in_speech
+    utterance = session.feed(_tone(320 * 5, 0))
+    assert utterance is not None and utterance.startswith(speech)
+    assert not session.in_speech
+
+
+def test_session_offsets_survive_oversized_frame(vad_config):
+    session = audio_module.AudioSession(sample_rate=16000)
+    capacity = session.ring.capacity
+    session.feed(b"\x00" * (capacity + 640)) # Một frame lớn hơn cả bộ đệm
+    assert session.ring.total_written == capacity + 640
+    speech = _tone(320 * 10, 3000)
+    session.feed(speech)
+    utterance = session.feed(_tone(320 * 5, 0))
+    assert utterance is not None and utterance.startswith(speech)
+
+
+def test_unsupported_formats_are_rejected():
+    with pytest.raises(audio_module.AudioFormatError):
+        audio_module.AudioSession(sample_rate=11025)
+    with pytest.raises(audio_module.AudioFormatError):
+        audio_module.AudioSession(channels=2)
+    with pytest.raises(audio_module.AudioFormatError):
+        audio_module.AudioSession(encoding="mp3")
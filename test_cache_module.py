@@ -0,0 +1,124 @@
+# test_cache_module.py
+# Kiểm thử TTLCache (LRU + hết hạn) và SingleFlight. Chạy bằng: python -m pytest -q
+import threading
+import time
+
+import cache_module
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_get_missing_returns_sentinel_or_default():
+    cache = cache_module.TTLCache(2)
+    assert cache.get("a") is cache_module.MISSING
+    assert cache.get("a", None) is None
+    assert cache.stats()["misses"] == 2
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = cache_module.TTLCache(10, ttl=5, clock=clock)
+    cache.set("a", 1)
+    clock.now = 4.9
+    assert cache.get("a") == 1
+    clock.now = 5.0
+    assert cache.get("a") is cache_module.MISSING
+    assert cache.stats()["expirations"] == 1
+    assert len(cache) == 0
+
+
+def test_least_recently_used_is_evicted():
+    cache = cache_module.TTLCache(2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a") # "b" thành phần tử ít dùng nhất
+    cache.set("c", 3)
+    assert cache.get("b") is cache_module.MISSING
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_cached_none_is_a_hit():
+    cache = cache_module.TTLCache(2)
+    cache.set("a", None)
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 1
+
+
+def test_zero_size_cache_stores_nothing():
+    cache = cache_module.TTLCache(0)
+    cache.set("a", 1)
+    assert cache.get("a") is cache_module.MISSING
+
+
+def test_invalidate_and_clear():
+    cache = cache_module.TTLCache(4)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.invalidate("a")
+    assert not cache.invalidate("a")
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_single_flight_shares_one_call_between_concurrent_callers():
+    flight = cache_module.SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "câu trả lời"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("k", slow)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do("k", slow))) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    while flight.shared < 3: # Chờ các lời gọi sau đã nhập hàng
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join(5)
+    assert results == ["câu trả lời"] * 4
+    assert len(calls) == 1 and flight.in_flight() == 0
+
+
+def test_single_flight_shares_exceptions_and_forgets_finished_calls():
+    flight = cache_module.SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    errors = []
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise ValueError("lỗi")
+
+    def call():
+        try:
+            flight.do("k", failing)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call)]
+    threads[0].start()
+    started.wait(5)
+    threads.append(threading.Thread(target=call))
+    threads[1].start()
+    while flight.shared < 1:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(errors) == 2
+    assert flight.do("k", lambda: "mới") == "mới" # Lời gọi đã xong không được dùng lại
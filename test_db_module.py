@@ -0,0 +1,60 @@
+# test_db_module.py
+# Kiểm thử khóa cache tra cứu và phiên bản danh mục dùng chung (collection giả, không cần MongoDB).
+import pytest
+
+import cache_module
+import config
+import db_module
+import query_module
+
+
+class FakeMetaCollection:
+    def __init__(self):
+        self.docs = {}
+
+    def find_one(self, query, projection=None):
+        return self.docs.get(query["_id"])
+
+    def find_one_and_update(self, query, update, upsert=False, return_document=None):
+        doc = self.docs.setdefault(query["_id"], {"_id": query["_id"], "version": 0})
+        doc["version"] += update["$inc"]["version"]
+        return dict(doc)
+
+
+@pytest.fixture
+def meta(monkeypatch):
+    collection = FakeMetaCollection()
+    monkeypatch.setattr(db_module, "db", {config.CATALOG_META_COLLECTION: collection})
+    monkeypatch.setattr(db_module, "catalog_db_version", None)
+    return collection
+
+
+def test_catalog_version_is_part_of_cache_key(meta):
+    if db_module.kb_cache is None:
+        pytest.skip("KB cache disabled")
+    db_module.refresh_catalog_version()
+    before = db_module._kb_cache_key(query_module.analyze("sữa vinamilk"))
+    assert db_module.refresh_catalog_version() is False # Chưa đổi: giữ nguyên khóa
+    assert db_module._kb_cache_key(query_module.analyze("sữa vinamilk")) == before
+
+    assert db_module.bump_catalog_version() == 1 # Một tiến trình khác vừa nhập danh mục
+    db_module.kb_cache.set(before, "ngữ cảnh cũ")
+    assert db_module.refresh_catalog_version() is True
+    assert db_module.catalog_db_version == 1
+    assert db_module._kb_cache_key(query_module.analyze("sữa vinamilk")) != before
+    assert db_module.kb_cache.get(before) is cache_module.MISSING
+
+
+def test_refresh_without_connection_does_nothing(monkeypatch):
+    monkeypatch.setattr(db_module, "db", None)
+    assert db_module.refresh_catalog_version() is False
+    assert db_module.bump_catalog_version() is None
+
+
+def test_cache_key_keeps_price_bounds():
+    if db_module.kb_cache is None:
+        pytest.skip("KB cache disabled")
+    first = db_module._kb_cache_key(query_module.analyze("sữa dưới 50k trên 20k"))
+    swapped = db_module._kb_cache_key(query_module.analyze("sữa dưới 20k trên 50k"))
+    assert first != swapped
+    assert first == db_module._kb_cache_key(query_module.analyze("sữa trên 20k dưới 50k"))
@@ -0,0 +1,112 @@
+# test_journal_module.py
+# Kiểm thử nhật ký hội thoại ghi trễ của journal_module với collection giả (không cần MongoDB).
+# Chạy bằng: python -m pytest -q
+import asyncio
+
+import pytest
+
+import db_module
+import journal_module
+
+
+class FakeCollection:
+    def __init__(self, fail_writes=0):
+        self.docs = []
+        self.indexes = []
+        self.fail_writes = fail_writes
+
+    def create_index(self, keys, name=None):
+        self.indexes.append((keys, name))
+        return name
+
+    def insert_many(self, docs, ordered=True):
+        if self.fail_writes:
+            self.fail_writes -= 1
+            raise ConnectionError("MongoDB is down")
+        self.docs.extend(docs)
+
+
+def _journal(collection, **kwargs):
+    kwargs.setdefault("batch_size", 2)
+    kwargs.setdefault("flush_interval", 0.01)
+    kwargs.setdefault("max_buffer", 10)
+    kwargs.setdefault("max_block", 0)
+    return journal_module.ConversationJournal(collection=collection, **kwargs)
+
+
+@pytest.fixture
+def no_mongo(monkeypatch):
+    monkeypatch.setattr(db_module, "db", None)
+    monkeypatch.setattr(db_module.config, "MONGO_RETRIES", 0)
+
+
+def test_turns_are_written_in_batches(no_mongo):
+    collection = FakeCollection()
+
+    async def scenario():
+        journal = _journal(collection)
+        await journal.start()
+        for i in range(3):
+            await journal.record("s1", f"hỏi {i}", f"đáp {i}")
+        await journal.close(timeout=2)
+        return journal.stats()
+
+    stats = asyncio.run(scenario())
+    assert [doc["question"] for doc in collection.docs] == ["hỏi 0", "hỏi 1", "hỏi 2"]
+    assert stats["written"] == 3 and stats["buffered"] == 0
+
+
+def test_index_is_created_once_mongo_is_reachable(no_mongo, monkeypatch):
+    collection = FakeCollection()
+
+    async def scenario():
+        journal = _journal(None) # Lúc start(), MongoDB chưa kết nối
+        await journal.start()
+        assert collection.indexes == []
+        monkeypatch.setattr(db_module, "db", {journal_module.config.JOURNAL_COLLECTION: collection})
+        await journal.record("s1", "hỏi", "đáp")
+        assert await journal.flush()
+        assert await journal.flush() # Bộ đệm trống: không tạo lại index
+        await journal.record("s1", "hỏi 2", "đáp 2")
+        await journal.flush()
+        await journal.close(timeout=2)
+
+    asyncio.run(scenario())
+    assert collection.indexes == [([("session_id", 1), ("created_at", -1)], "journal_session")]
+
+
+def test_failed_batch_is_kept_for_retry(no_mongo):
+    collection = FakeCollection(fail_writes=1)
+
+    async def scenario():
+        journal = _journal(collection)
+        await journal.record("s1", "hỏi", "đáp")
+        assert not await journal.flush()
+        assert await journal.flush()
+        return journal.stats()
+
+    stats = asyncio.run(scenario())
+    assert len(collection.docs) == 1 and stats["failed_batches"] == 1 and stats["dropped"] == 0
+
+
+def test_full_buffer_drops_turns(no_mongo):
+    async def scenario():
+        journal = _journal(FakeCollection(), batch_size=1, max_buffer=1)
+        assert await journal.record("s1", "hỏi 1", "đáp 1")
+        assert not await journal.record("s1", "hỏi 2", "đáp 2")
+        return journal.stats()
+
+    assert asyncio.run(scenario())["dropped"] == 1
+
+
+def test_load_history_includes_unwritten_turns(no_mongo):
+    async def scenario():
+        journal = _journal(None, batch_size=10) # Chưa ghi xuống MongoDB
+        await journal.record("s1", "hỏi", "đáp")
+        await journal.record("s2", "khác", "khác")
+        return await journal.load_history("s1", max_messages=10)
+
+    assert asyncio.run(scenario()) == [
+        {"role": "user", "parts": ["hỏi"]},
+        {"role": "model", "parts": ["đáp"]},
+    ]
@@ -0,0 +1,72 @@
+# test_llm_module.py
+# Kiểm thử bộ lọc thông tin cá nhân khi stream câu trả lời của llm_module (Gemini được thay bằng model giả).
+# Chạy bằng: python -m pytest -q
+import pytest
+
+import llm_module
+
+
+class FakeChunk:
+    usage_metadata = None
+
+    def __init__(self, text):
+        self.text = text
+        self.parts = [text]
+
+
+class FakeModel:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def generate_content(self, contents, stream=False, request_options=None):
+        return [FakeChunk(text) for text in self.chunks]
+
+
+def _feed_all(chunks):
+    pii_filter = llm_module.PIIStreamFilter()
+    emitted = [pii_filter.feed(chunk) for chunk in chunks]
+    return pii_filter, emitted
+
+
+def test_filter_holds_back_digits_split_across_chunks():
+    pii_filter, emitted = _feed_all(["Gọi số 09", "0123", "4567 nhé"])
+    assert emitted == ["Gọi số ", "", ""]
+    assert pii_filter.tripped
+    assert pii_filter.feed("thêm") == "" and pii_filter.flush() == ""
+
+
+def test_filter_releases_short_digit_runs():
+    pii_filter, emitted = _feed_all(["Giá 30", "000 đồng, còn 12", " hộp"])
+    assert emitted == ["Giá ", "30000 đồng, còn ", "12 hộp"]
+    assert not pii_filter.tripped
+
+
+def test_filter_flushes_trailing_digits_at_end_of_stream():
+    pii_filter, emitted = _feed_all(["Còn lại ", "12345"])
+    assert emitted == ["Còn lại ", ""]
+    assert pii_filter.flush() == "12345"
+
+
+@pytest.fixture
+def fake_gemini(monkeypatch):
+    def install(chunks):
+        monkeypatch.setattr(llm_module, "model", FakeModel(chunks))
+    return install
+
+
+def _stream(chunks, install):
+    install(chunks)
+    history = [{"role": "user", "parts": ["Số điện thoại cửa hàng?"]}]
+    return list(llm_module.stream_chatbot_response(history, use_cache=False))
+
+
+def test_stream_never_emits_a_split_phone_number(fake_gemini):
+    events = _stream(["Số của cửa hàng là 0901", "23", "4567."], fake_gemini)
+    deltas = "".join(text for kind, text in events if kind == "delta")
+    assert "0901" not in deltas and deltas == "Số của cửa hàng là "
+    assert events[-1] == ("done", llm_module.PERSONAL_INFO_REFUSAL)
+
+
+def test_stream_flushes_short_trailing_digits(fake_gemini):
+    events = _stream(["Còn ", "12"], fake_gemini)
+    assert events == [("delta", "Còn "), ("delta", "12"), ("done", "Còn 12")]
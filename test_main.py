@@ -0,0 +1,118 @@
+# test_main.py
+# Kiểm thử lịch sử hội thoại của Kiosk (main.py): lượt bị khách nói chen ngang không để lại tin nhắn trong lịch sử.
+# Không cần micro/loa/Gemini: luồng trả lời và việc tổng hợp/phát âm thanh được thay bằng hàm giả.
+import asyncio
+import time
+
+import pytest
+
+import executor_module
+import main
+
+
+@pytest.fixture
+def fake_pipeline(monkeypatch):
+    """
+    Gemini giả trả lời theo từng đoạn (`chunks`), mỗi đoạn cách nhau `delay` giây, rồi gửi câu trả lời cuối `final`
+    (mặc định là ghép các đoạn). TTS giả không phát gì, chỉ ghi lại các câu được đọc vào `played`.
+    """
+    state = {"delay": 0.0, "chunks": ["Chào bạn. ", "Bạn cần gì?"], "final": None, "played": []}
+
+    async def fake_iterate(kind, fn, messages, **kwargs):
+        for chunk in state["chunks"]:
+            await asyncio.sleep(state["delay"])
+            yield "delta", chunk
+        yield "done", state["final"] if state["final"] is not None else "".join(state["chunks"])
+
+    async def fake_run(kind, fn, *args, **kwargs):
+        if fn is main._play_locked:
+            state["played"].append(args[1])
+        return None
+
+    monkeypatch.setattr(executor_module, "iterate", fake_iterate)
+    monkeypatch.setattr(executor_module, "run", fake_run)
+    return state
+
+
+def _roles(kiosk):
+    return [message["role"] for message in kiosk.history]
+
+
+def test_finished_turn_adds_question_and_answer(fake_pipeline):
+    async def scenario():
+        kiosk = main.Kiosk()
+        await kiosk.turn("xin chào", heard_at=time.monotonic())
+        return kiosk
+
+    kiosk = asyncio.run(scenario())
+    assert _roles(kiosk) == ["user", "model"]
+    assert list(kiosk.history)[1]["parts"] == ["Chào bạn. Bạn cần gì?"]
+
+
+def test_barged_in_turn_leaves_no_user_message(fake_pipeline):
+    fake_pipeline["delay"] = 10
+
+    async def scenario():
+        kiosk = main.Kiosk()
+        task = asyncio.create_task(kiosk.turn("xin chào", heard_at=time.monotonic()))
+        await asyncio.sleep(0.01)
+        task.cancel() # Khách nói chen ngang: TurnScheduler hủy lượt đang chạy
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return kiosk
+
+    kiosk = asyncio.run(scenario())
+    assert _roles(kiosk) == []
+
+
+def test_replaced_answer_is_read_in_full(fake_pipeline):
+    # Câu trả lời cuối khác phần đã stream (ví dụ bị chặn thông tin cá nhân): đọc đủ mọi câu của câu trả lời cuối
+    fake_pipeline["chunks"] = ["Số điện thoại của ", "cửa hàng là "]
+    fake_pipeline["final"] = "Xin lỗi, tôi không thể chia sẻ thông tin này. Bạn hãy hỏi nhân viên quầy. Cảm ơn bạn nhé."
+
+    async def scenario():
+        kiosk = main.Kiosk()
+        await kiosk.turn("số điện thoại cửa hàng", heard_at=time.monotonic())
+
+    asyncio.run(scenario())
+    assert " ".join(fake_pipeline["played"]) == fake_pipeline["final"]
+
+
+def test_cleared_speaker_returns_slots_of_synthesized_sentences(monkeypatch):
+    played, synthesized = [], []
+
+    async def scenario():
+        permits = asyncio.Semaphore(0) # Mỗi câu chỉ phát xong khi được cấp một lượt
+        playing = asyncio.Event()
+
+        async def fake_run(kind, fn, *args, **kwargs):
+            if fn is main.tts_module.synthesize:
+                synthesized.append(args[0])
+            elif fn is main._play_locked:
+                played.append(args[1])
+                playing.set()
+                await permits.acquire()
+            return None
+
+        monkeypatch.setattr(executor_module, "run", fake_run)
+        speaker = main.Speaker(lookahead=1) # Hai chỗ: câu đang phát + một câu tổng hợp trước
+        speaker.say("một")
+        await playing.wait()
+        speaker.say("hai") # Tổng hợp xong, giữ chỗ chờ phát
+        speaker.say("ba") # Chờ chỗ
+        await asyncio.sleep(0.01)
+        speaker.clear()
+
+        speaker.say("bốn")
+        speaker.say("năm")
+        playing.clear()
+        permits.release() # "một" phát xong
+        await playing.wait() # "bốn" đang phát
+        await asyncio.sleep(0.01)
+        assert "năm" in synthesized # Câu sau vẫn được tổng hợp trước trong lúc câu trước đang phát
+        for _ in range(2):
+            permits.release()
+        await asyncio.wait_for(speaker.finish(), 1)
+
+    asyncio.run(scenario())
+    assert played == ["một", "bốn", "năm"]
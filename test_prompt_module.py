@@ -0,0 +1,97 @@
+# test_prompt_module.py
+# Kiểm thử ngân sách token của prompt và bản tóm tắt lịch sử của prompt_module. Chạy bằng: python -m pytest -q
+import pytest
+
+import config
+import prompt_module
+
+
+def _message(role, text):
+    return {"role": role, "parts": [text]}
+
+
+def _conversation(turns, length=60):
+    messages = []
+    for i in range(turns):
+        messages.append(_message("user", f"Câu hỏi {i}." + " x" * length))
+        messages.append(_message("model", f"Trả lời {i}." + " y" * length))
+    return messages
+
+
+@pytest.fixture
+def summary_budget(monkeypatch):
+    monkeypatch.setattr(config, "HISTORY_SUMMARY_TOKENS", 60)
+    return 60
+
+
+def test_estimate_and_truncate():
+    assert prompt_module.estimate_tokens("") == 0
+    assert prompt_module.estimate_tokens("abcd") == 2
+    assert prompt_module.truncate_to_tokens("ngắn", 10) == "ngắn"
+    assert prompt_module.truncate_to_tokens("a" * 30, 3) == "a" * 8 + "…"
+
+
+def test_summarize_message_keeps_first_sentence():
+    line = prompt_module.summarize_message(_message("user", "Sữa giá bao nhiêu?  Loại nào rẻ nhất?"))
+    assert line == "Khách: Sữa giá bao nhiêu?"
+    long_line = prompt_module.summarize_message(_message("model", "z" * 500))
+    assert long_line.startswith("Trợ lý: ") and len(long_line) == len("Trợ lý: ") + prompt_module.SUMMARY_LINE_CHARS
+
+
+def test_fold_into_summary_drops_oldest_lines_over_budget():
+    summary = prompt_module.fold_into_summary("", _conversation(5, length=0), max_tokens=20)
+    assert prompt_module.estimate_tokens(summary) <= 20
+    assert summary.split("\n")[-1] == "Trợ lý: Trả lời 4."
+    assert "Câu hỏi 0" not in summary
+
+
+def test_chat_history_folds_evicted_messages_into_summary(summary_budget):
+    history = prompt_module.ChatHistory(maxlen=2)
+    for message in _conversation(2, length=0):
+        history.append(message)
+    assert [m["parts"][0] for m in history] == ["Câu hỏi 1.", "Trả lời 1."]
+    assert history.summary == "Khách: Câu hỏi 0.\nTrợ lý: Trả lời 0."
+    history.clear()
+    assert len(history) == 0 and history.summary == ""
+
+
+def test_build_prompt_keeps_recent_messages_within_budget(summary_budget):
+    messages = _conversation(10) + [_message("user", "Câu hỏi cuối?")]
+    contents, used = prompt_module.build_prompt(messages, budget=200, db_context_budget=50)
+    assert used <= 200
+    assert contents[-1]["parts"][0] == "Câu hỏi cuối?"
+    assert contents[0]["role"] == "user" # Gemini yêu cầu bắt đầu bằng lượt của người dùng
+    assert len(contents) < len(messages)
+    first = contents[0]["parts"][0]
+    assert first.startswith("(Tóm tắt cuộc trò chuyện trước đó:\n")
+    dropped = len(messages) - len(contents)
+    assert f"{prompt_module.summarize_message(messages[dropped - 1])})\n\n" in first # Tin nhắn vừa bị bỏ nằm cuối bản tóm tắt
+    assert messages[-1]["parts"] == ["Câu hỏi cuối?"] # Không sửa lịch sử của nơi gọi
+
+
+def test_build_prompt_caps_db_context_by_relevance_order(summary_budget):
+    blocks = ["Sữa tươi: 30.000đ", "Bánh quy: 45.000đ", "Nước mắm: 25.000đ " + "m" * 300]
+    db_context = prompt_module.DB_CONTEXT_SEPARATOR.join(blocks)
+    contents, _ = prompt_module.build_prompt([_message("user", "Giá sữa?")], db_context=db_context,
+                                             budget=1000, db_context_budget=20)
+    text = contents[-1]["parts"][0]
+    assert text.startswith("Giá sữa?") and blocks[0] in text and blocks[1] in text
+    assert "Nước mắm" not in text
+
+
+def test_cap_db_context_truncates_single_oversized_block():
+    capped = prompt_module.cap_db_context("a" * 300, 10)
+    assert capped.endswith("…") and prompt_module.estimate_tokens(capped) <= 10
+
+
+@pytest.mark.parametrize("db_context", [None, "Sữa tươi: 30.000đ\n---\nBánh quy: 45.000đ"])
+def test_build_prompt_truncates_oversized_final_message(summary_budget, db_context):
+    pasted = "Tôi muốn hỏi về đơn hàng này. " + "z" * 5000
+    messages = _conversation(3) + [_message("user", pasted)]
+    contents, used = prompt_module.build_prompt(messages, db_context=db_context, budget=300, db_context_budget=50)
+    text = contents[-1]["parts"][0]
+    assert used <= 300
+    assert sum(prompt_module.message_tokens(message) for message in contents) <= 300
+    assert "\n\nTôi muốn hỏi về đơn hàng này." in text and "…" in text # Sau bản tóm tắt các lượt đã bỏ
+    if db_context:
+        assert text.endswith("Hãy trả lời câu hỏi trên DỰA VÀO thông tin này và lịch sử trò chuyện.")
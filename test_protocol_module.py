@@ -0,0 +1,71 @@
+# test_protocol_module.py
+# Kiểm thử mã hóa sự kiện, thỏa thuận phiên bản và việc gộp frame của EventChannel. Chạy bằng: python -m pytest -q
+import asyncio
+
+import pytest
+
+import metrics_module
+import protocol_module
+
+
+class FakeWebSocket:
+    remote_address = ("127.0.0.1", 12345)
+
+    def __init__(self):
+        self.frames = []
+
+    async def send(self, data, text=None):
+        self.frames.append((data, text))
+
+
+def test_json_encoding_round_trip_with_audio_as_base64():
+    data, text = protocol_module.encode({"event": "audio_chunk", "audio": b"\x00\x01", "text": "xin chào"})
+    assert text
+    if isinstance(data, bytes): # JSON của orjson
+        data = data.decode("utf-8")
+    assert protocol_module.decode_frame(data) == [{"event": "audio_chunk", "audio": "AAE=", "text": "xin chào"}]
+
+
+@pytest.mark.parametrize("requested, expected", [
+    ((None, None), (1, "json")),
+    ((1, "msgpack"), (1, "json")),
+    ((2, "json"), (2, "json")),
+    ((9, "json"), (2, "json")),
+    (("lạ", None), (1, "json")),
+])
+def test_negotiate(requested, expected):
+    assert protocol_module.negotiate(*requested) == expected
+
+
+def test_v2_batches_until_flush_event():
+    async def scenario():
+        websocket = FakeWebSocket()
+        channel = protocol_module.EventChannel(websocket, version=2, flush_interval=10, max_batch=10)
+        await channel.send({"event": "chat_delta", "text": "Chào "})
+        await channel.send({"event": "chat_delta", "text": "bạn"})
+        assert websocket.frames == []
+        await channel.send({"event": "chat_done"})
+        channel.close()
+        return websocket.frames
+
+    frames = asyncio.run(scenario())
+    assert len(frames) == 1
+    data, text = frames[0]
+    assert text # Text frame: websockets phía client trả về str
+    assert [event["event"] for event in protocol_module.decode_frame(data.decode("utf-8"))] == ["chat_delta", "chat_delta", "chat_done"]
+
+
+@pytest.mark.parametrize("use_orjson", [False, True])
+def test_sent_bytes_counts_encoded_utf8_length(monkeypatch, use_orjson):
+    if use_orjson and protocol_module.orjson is None:
+        pytest.skip("orjson is not installed")
+    if not use_orjson:
+        monkeypatch.setattr(protocol_module, "orjson", None)
+    websocket = FakeWebSocket()
+    channel = protocol_module.EventChannel(websocket, version=1)
+    label = channel.label
+    before = metrics_module.WS_BYTES.value(protocol=label)
+    asyncio.run(channel.send({"event": "chat_message", "message": "Sữa tươi giá bao nhiêu?"}))
+    data, text = websocket.frames[0]
+    assert text and isinstance(data, bytes)
+    assert metrics_module.WS_BYTES.value(protocol=label) - before == len(data) > len(data.decode("utf-8"))
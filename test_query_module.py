@@ -0,0 +1,96 @@
+# test_query_module.py
+# Kiểm thử phân tích câu hỏi: ý định, khoảng giá, từ khóa, khóa cache. Chạy bằng: python -m pytest -q
+import pytest
+
+import query_module
+
+
+@pytest.fixture(autouse=True)
+def vocabulary():
+    query_module.set_vocabulary(brands=["Vinamilk", "Dell"], categories=["Sữa", "Laptop"])
+    yield
+    query_module.set_vocabulary()
+
+
+@pytest.mark.parametrize("text, price_min, price_max", [
+    ("rẻ hơn 50k", None, 50_000),
+    ("dưới 50 nghìn", None, 50_000),
+    ("không quá 1,5 triệu", None, 1_500_000),
+    ("đắt hơn 1,5 triệu", 1_500_000, None),
+    ("trên 100k", 100_000, None),
+    ("hơn 200k", 200_000, None),
+    ("trên 100k dưới 200k", 100_000, 200_000),
+    ("từ 20k đến 50k", 20_000, 50_000),
+    ("từ 20 đến 50k", 20_000, 50_000),
+    ("sữa giá dưới 30000", None, 30_000),
+    ("Giá 1.500.000 đ", 1_350_000, 1_650_000),
+    ("laptop khoảng 15 triệu", 13_500_000, 16_500_000),
+    ("50.000đ", 45_000, 55_000),
+    # Số không có đơn vị tiền và không đứng sau "giá" không phải là giá
+    ("sữa hơn 2 hộp", None, None),
+    ("từ 2 hộp", None, None),
+    ("từ 2 đến 5 hộp", None, None),
+    ("iphone 15", None, None),
+])
+def test_price_filters(text, price_min, price_max):
+    analysis = query_module.analyze(text)
+    assert (analysis.price_min, analysis.price_max) == (price_min, price_max)
+
+
+@pytest.mark.parametrize("text, keywords", [
+    ("Giá 1.500.000 đ", []),
+    ("bánh rẻ hơn 50k", ["bánh"]),
+    ("bánh hơn 2 hộp", ["bánh", "hơn", "hộp"]),
+])
+def test_price_is_not_a_keyword(text, keywords):
+    assert query_module.analyze(text).keywords == keywords
+
+
+@pytest.mark.parametrize("text, keywords", [
+    ("bánh không đường", ["bánh", "không", "đường"]),
+    ("có bánh quy không?", ["bánh", "quy"]),
+    ("có bánh không, loại không đường", ["bánh", "loại", "không", "đường"]),
+    ("bánh quy không ạ", ["bánh", "quy"]),
+])
+def test_negation_is_kept_only_before_a_keyword(text, keywords):
+    assert query_module.analyze(text).keywords == keywords
+
+
+@pytest.mark.parametrize("text, intent", [
+    ("Giá sữa Vinamilk bao nhiêu?", "price"),
+    ("Có khuyến mãi gì không", "promotion"),
+    ("Cửa hàng mở cửa mấy giờ", "store_hours"),
+    ("laptop Dell", "product"),
+    ("dưới 50k", "price"),
+    ("xin chào", "chitchat"),
+])
+def test_intent(text, intent):
+    analysis = query_module.analyze(text)
+    assert analysis.intent == intent
+    assert analysis.should_search == (intent != "chitchat")
+
+
+def test_entities_and_mongo_filter():
+    analysis = query_module.analyze("khuyến mãi sữa Vinamilk dưới 50k")
+    assert analysis.brand == "Vinamilk"
+    assert analysis.category == "Sữa"
+    assert analysis.mongo_filter() == {
+        "thuong_hieu": "Vinamilk", "danh_muc": "Sữa", "gia": {"$lte": 50_000}, "khuyen_mai": {"$nin": [None, ""]},
+    }
+
+
+def test_matches():
+    analysis = query_module.analyze("sữa Vinamilk dưới 50k")
+    assert analysis.matches({"thuong_hieu": "Vinamilk", "danh_muc": "Sữa", "gia": 30_000})
+    assert not analysis.matches({"thuong_hieu": "Vinamilk", "danh_muc": "Sữa", "gia": 60_000})
+    assert not analysis.matches({"thuong_hieu": "Dell", "danh_muc": "Sữa", "gia": 30_000})
+    assert not analysis.matches({"thuong_hieu": "Vinamilk", "danh_muc": "Sữa", "gia": "liên hệ"})
+
+
+def test_retrieval_key_ignores_word_order():
+    first = query_module.analyze("sữa tươi Vinamilk")
+    second = query_module.analyze("Vinamilk tươi sữa")
+    assert first.retrieval_key() == second.retrieval_key()
+    assert first.retrieval_key() != query_module.analyze("sữa tươi Vinamilk dưới 50k").retrieval_key()
+    assert (query_module.analyze("sữa dưới 50k trên 20k").retrieval_key()
+            != query_module.analyze("sữa dưới 20k trên 50k").retrieval_key())
@@ -0,0 +1,158 @@
+# test_resilience_module.py
+# Kiểm thử phân loại lỗi, circuit breaker và việc thử lại/deadline của ResilientCaller. Chạy bằng: python -m pytest -q
+import time
+
+import pytest
+
+import executor_module
+import resilience_module
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class StatusError(Exception):
+    def __init__(self, code):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+
+
+@pytest.mark.parametrize("error, kind", [
+    (resilience_module.CircuitOpenError("open"), "circuit_open"),
+    (executor_module.ExecutorBusyError("full"), "overloaded"),
+    (TimeoutError(), "timeout"),
+    (resilience_module.DeadlineExceededError(), "timeout"),
+    (StatusError(429), "rate_limit"),
+    (StatusError(503), "unavailable"),
+    (StatusError(504), "timeout"),
+    (StatusError(401), "auth"),
+    (StatusError(400), "bad_request"),
+    (ConnectionResetError(), "unavailable"),
+    (ValueError("lạ"), "unknown"),
+])
+def test_classify(error, kind):
+    assert resilience_module.classify(error) == kind
+
+
+def _open_breaker(clock):
+    breaker = resilience_module.CircuitBreaker("test", failure_threshold=2, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    breaker.record_failure()
+    return breaker
+
+
+def test_breaker_opens_after_threshold_and_probes_after_timeout():
+    clock = FakeClock()
+    breaker = _open_breaker(clock)
+    assert breaker.state == breaker.OPEN and not breaker.allow()
+    clock.now = 10
+    assert breaker.state == breaker.HALF_OPEN
+    assert breaker.allow() # Đúng một yêu cầu thử
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == breaker.CLOSED and breaker.allow()
+
+
+def test_failed_probe_reopens_breaker():
+    clock = FakeClock()
+    breaker = _open_breaker(clock)
+    clock.now = 10
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN and breaker.opened == 2
+
+
+def test_released_probe_keeps_breaker_half_open():
+    clock = FakeClock()
+    breaker = _open_breaker(clock)
+    clock.now = 10
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.state == breaker.HALF_OPEN
+    assert breaker.allow() # Lượt thử được trả lại cho yêu cầu sau
+
+
+def _caller(breaker, **kwargs):
+    kwargs.setdefault("deadline", 5)
+    kwargs.setdefault("backoff", 0.001)
+    return resilience_module.ResilientCaller("test", breaker=breaker, **kwargs)
+
+
+@pytest.mark.parametrize("error", [
+    executor_module.ExecutorBusyError("full"), StatusError(401), StatusError(400), ValueError("lạ"),
+])
+def test_non_transient_errors_do_not_count_as_success(error):
+    clock = FakeClock()
+    breaker = resilience_module.CircuitBreaker("test", failure_threshold=2, reset_timeout=10, clock=clock)
+    caller = _caller(breaker)
+    breaker.record_failure()
+    caller.after_call(error)
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN # Số lỗi tạm thời liên tiếp không bị đặt lại
+
+    clock.now = 10
+    caller.before_call() # Yêu cầu thử half-open
+    caller.after_call(error)
+    assert breaker.state == breaker.HALF_OPEN # Không đóng circuit, nhưng trả lại lượt thử
+    caller.before_call()
+
+
+def test_abandoned_call_does_not_close_breaker():
+    clock = FakeClock()
+    breaker = _open_breaker(clock)
+    caller = _caller(breaker)
+    clock.now = 10
+    caller.before_call()
+    caller.abandon()
+    assert breaker.state == breaker.HALF_OPEN and breaker.allow()
+
+
+def test_call_retries_transient_errors():
+    breaker = resilience_module.CircuitBreaker("test", failure_threshold=5)
+    caller = _caller(breaker, retries=2)
+    attempts = []
+
+    def flaky(timeout):
+        attempts.append(timeout)
+        if len(attempts) < 3:
+            raise StatusError(503)
+        return "ok"
+
+    assert caller.call(flaky) == "ok"
+    assert len(attempts) == 3 and all(0 < timeout <= 5 for timeout in attempts)
+    assert caller.counts["retries"] == 2 and breaker.state == breaker.CLOSED
+
+
+def test_call_does_not_retry_permanent_errors():
+    caller = _caller(resilience_module.CircuitBreaker("test"), retries=2)
+    attempts = []
+
+    def bad_request(timeout):
+        attempts.append(timeout)
+        raise StatusError(400)
+
+    with pytest.raises(StatusError):
+        caller.call(bad_request)
+    assert len(attempts) == 1 and caller.counts["failures"] == 1
+
+
+def test_call_stops_waiting_at_deadline():
+    caller = _caller(None, deadline=0.05, retries=0)
+    started = time.monotonic()
+    with pytest.raises(resilience_module.DeadlineExceededError):
+        caller.call(lambda timeout: time.sleep(0.5))
+    assert time.monotonic() - started < 0.4
+    assert caller.counts["deadline_exceeded"] == 1
+
+
+def test_open_breaker_short_circuits_calls():
+    breaker = _open_breaker(FakeClock())
+    caller = _caller(breaker)
+    with pytest.raises(resilience_module.CircuitOpenError):
+        caller.call(lambda timeout: "không được gọi")
+    assert caller.counts["short_circuited"] == 1
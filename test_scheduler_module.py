@@ -0,0 +1,105 @@
+# test_scheduler_module.py
+# Kiểm thử TurnScheduler: chạy tuần tự, lượt mới hủy lượt cũ, từ chối khi hàng đợi đầy. Chạy bằng: python -m pytest -q
+import asyncio
+
+import pytest
+
+import scheduler_module
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_turns_run_in_order_without_overlap():
+    async def scenario():
+        scheduler = scheduler_module.TurnScheduler(max_pending=4, name="test")
+        events = []
+
+        def turn(name):
+            async def body():
+                events.append(f"{name}:start")
+                await asyncio.sleep(0.01)
+                events.append(f"{name}:end")
+            return body
+
+        scheduler.submit(turn("a"), supersede=False)
+        scheduler.submit(turn("b"), supersede=False)
+        await asyncio.sleep(0.05)
+        await scheduler.close()
+        return events, scheduler.completed
+
+    events, completed = run(scenario())
+    assert events == ["a:start", "a:end", "b:start", "b:end"]
+    assert completed == 2
+
+
+def test_new_turn_cancels_running_turn():
+    async def scenario():
+        scheduler = scheduler_module.TurnScheduler(max_pending=4, name="test")
+        cancelled = asyncio.Event()
+        finished = []
+
+        async def slow():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def fast():
+            finished.append("fast")
+
+        scheduler.submit(slow)
+        await asyncio.sleep(0.01)
+        scheduler.submit(fast)
+        await asyncio.wait_for(cancelled.wait(), 1)
+        await asyncio.sleep(0.01)
+        await scheduler.close()
+        return finished, scheduler.cancelled
+
+    finished, cancelled_count = run(scenario())
+    assert finished == ["fast"]
+    assert cancelled_count == 1
+
+
+def test_queued_turns_are_skipped_when_superseded():
+    async def scenario():
+        scheduler = scheduler_module.TurnScheduler(max_pending=4, name="test")
+        ran = []
+
+        def turn(name):
+            async def body():
+                ran.append(name)
+            return body
+
+        # Chưa nhường loop: cả ba lượt còn trong hàng đợi, chỉ lượt cuối được chạy
+        scheduler.submit(turn("a"))
+        scheduler.submit(turn("b"))
+        scheduler.submit(turn("c"))
+        await asyncio.sleep(0.01)
+        await scheduler.close()
+        return ran
+
+    assert run(scenario()) == ["c"]
+
+
+def test_full_queue_rejects_and_counts_consecutive_rejections():
+    async def scenario():
+        scheduler = scheduler_module.TurnScheduler(max_pending=1, name="test")
+
+        async def noop():
+            pass
+
+        scheduler.submit(noop, supersede=False)
+        for _ in range(2):
+            with pytest.raises(scheduler_module.SessionOverloadedError):
+                scheduler.submit(noop, supersede=False)
+        assert scheduler.consecutive_rejections == 2
+        await asyncio.sleep(0.01) # Hàng đợi đã trống
+        scheduler.submit(noop, supersede=False)
+        assert scheduler.consecutive_rejections == 0
+        await scheduler.close()
+        return scheduler.rejected
+
+    assert run(scenario()) == 2
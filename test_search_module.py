@@ -0,0 +1,84 @@
+# test_search_module.py
+# Kiểm thử chỉ mục BM25 trong bộ nhớ của search_module. Chạy bằng: python -m pytest -q
+import search_module
+
+PRODUCTS = [
+    {"_id": 1, "ten": "Sữa tươi Vinamilk", "gia": 30000, "danh_muc": "Sữa", "thuong_hieu": "Vinamilk",
+     "mo_ta": "Sữa tươi tiệt trùng", "updated_at": 1},
+    {"_id": 2, "ten": "Bánh quy bơ", "gia": 45000, "danh_muc": "Bánh kẹo", "thuong_hieu": "Cosy",
+     "mo_ta": "Bánh quy vị bơ sữa", "updated_at": 2},
+    {"_id": 3, "ten": "Nước mắm Nam Ngư", "gia": 25000, "danh_muc": "Gia vị", "thuong_hieu": "Chin-su",
+     "mo_ta": "Nước mắm cá cơm", "updated_at": 3},
+]
+
+
+class FakeCollection:
+    def __init__(self, docs):
+        self.docs = docs
+        self.queries = []
+
+    def find(self, query, projection=None):
+        self.queries.append(query)
+        bound = query.get("updated_at", {}).get("$gt")
+        return [doc for doc in self.docs if bound is None or doc["updated_at"] > bound]
+
+
+def _index(**kwargs):
+    index = search_module.SearchIndex(**kwargs)
+    index.rebuild(PRODUCTS)
+    return index
+
+
+def _ids(results):
+    return [doc["_id"] for doc in results]
+
+
+def test_fold_and_tokenize():
+    assert search_module.fold_diacritics("Sữa Tươi Đà Lạt") == "sua tuoi da lat"
+    assert search_module.tokenize("Bánh quy, 200g!") == ["banh", "quy", "200g"]
+    assert search_module.tokenize(["Sữa", "Bơ"]) == ["sua", "bo"]
+    assert search_module.tokenize(None) == []
+
+
+def test_search_ranks_name_match_first_without_diacritics():
+    index = _index()
+    assert _ids(index.search("sua tuoi"))[0] == 1
+    assert _ids(index.search("bánh quy")) == [2]
+    assert index.search("điện thoại") == []
+    assert index.search("") == []
+
+
+def test_search_applies_predicate_before_limit():
+    index = _index()
+    pricey = index.search("sữa", limit=1, predicate=lambda doc: doc["gia"] > 40000)
+    assert _ids(pricey) == [2]
+
+
+def test_upsert_and_delete_notify_and_update_results():
+    changes = []
+    index = _index(on_change=lambda: changes.append(1))
+    index.upsert(dict(PRODUCTS[2], ten="Nước tương Chin-su", mo_ta="Nước tương đậu nành"))
+    assert index.search("mam ca com") == []
+    assert _ids(index.search("nuoc tuong")) == [3]
+    assert index.delete(1) and not index.delete(1)
+    assert index.search("vinamilk") == []
+    assert len(index) == 2 and len(changes) == 2
+
+
+def test_apply_change_stream_events():
+    index = _index()
+    index.apply_change({"operationType": "delete", "documentKey": {"_id": 2}})
+    index.apply_change({"operationType": "insert", "fullDocument": {"_id": 4, "ten": "Cà phê sữa", "updated_at": 4}})
+    assert _ids(index.search("banh")) == []
+    assert _ids(index.search("cà phê"))[0] == 4
+
+
+def test_refresh_reads_only_documents_newer_than_watermark():
+    collection = FakeCollection(list(PRODUCTS))
+    index = search_module.SearchIndex()
+    assert index.refresh(collection) == 3 # Lần đầu: nạp toàn bộ
+    assert index.watermark == 3
+    collection.docs.append({"_id": 5, "ten": "Trà xanh", "updated_at": 5})
+    assert index.refresh(collection) == 1
+    assert collection.queries[-1] == {"updated_at": {"$gt": 3}}
+    assert _ids(index.search("tra xanh")) == [5] and index.watermark == 5
@@ -0,0 +1,123 @@
+# test_server_history.py
+# Kiểm thử lịch sử chat của server.py: chỉ lượt trả lời xong mới để lại tin nhắn trong lịch sử.
+# Không cần MongoDB/Gemini: tra cứu, lời gọi Gemini và việc gửi sự kiện được thay bằng hàm giả.
+import asyncio
+
+import pytest
+
+import executor_module
+import server
+from prompt_module import ChatHistory
+
+
+class FakeWebSocket:
+    remote_address = ("127.0.0.1", 12345)
+
+
+@pytest.fixture
+def session(monkeypatch):
+    websocket = FakeWebSocket()
+    sent = []
+
+    async def send_event(ws, event):
+        sent.append(event)
+
+    async def search(text, analysis=None):
+        return None
+
+    async def noop(*args, **kwargs):
+        return None
+
+    monkeypatch.setattr(server, "send_event", send_event)
+    monkeypatch.setattr(server, "save_session", noop)
+    monkeypatch.setattr(server, "journal_turn", noop)
+    monkeypatch.setattr(server.db_module, "search_knowledge_base_async", search)
+    server.client_chat_histories[websocket] = ChatHistory(maxlen=10)
+    server.client_options[websocket] = dict(server.DEFAULT_CLIENT_OPTIONS)
+    yield websocket, sent
+    server.client_chat_histories.pop(websocket, None)
+    server.client_options.pop(websocket, None)
+
+
+def _fake_llm(monkeypatch, answer=None, delay=0.0, seen=None):
+    async def fake_run(kind, fn, *args, **kwargs):
+        if seen is not None:
+            seen.append(args[0])
+        await asyncio.sleep(delay)
+        return answer
+    monkeypatch.setattr(executor_module, "run", fake_run)
+
+
+def _roles(websocket):
+    return [message["role"] for message in server.client_chat_histories[websocket]]
+
+
+def test_finished_turn_adds_question_and_answer(session, monkeypatch):
+    websocket, sent = session
+    seen = []
+    _fake_llm(monkeypatch, answer="Chào bạn!", seen=seen)
+    asyncio.run(server.process_text(websocket, "xin chào", is_user_typed=True))
+    assert _roles(websocket) == ["user", "model"]
+    assert seen[0][-1] == {"role": "user", "parts": ["xin chào"]} # Gemini vẫn nhận câu hỏi của lượt
+    assert sent[-1]["message"] == "Chào bạn!"
+
+
+def test_cancelled_turn_leaves_no_user_message(session, monkeypatch):
+    websocket, _ = session
+    _fake_llm(monkeypatch, answer="không ai đọc", delay=10)
+
+    async def scenario():
+        task = asyncio.create_task(server.process_text(websocket, "câu hỏi cũ", is_user_typed=True))
+        await asyncio.sleep(0.01)
+        task.cancel() # Lượt mới thay thế (TurnScheduler) hoặc stop_listening
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert _roles(websocket) == []
+
+
+def test_busy_turn_leaves_history_unchanged(session, monkeypatch):
+    websocket, sent = session
+    _fake_llm(monkeypatch, answer="không được gọi")
+    limiter = server.admission_module.FairLimiter("llm", capacity=1, max_waiting=0, max_wait=1)
+    asyncio.run(limiter.acquire("phiên khác")) # Chỗ duy nhất đã bị chiếm
+    monkeypatch.setattr(server.admission_module, "llm_limiter", limiter)
+    asyncio.run(server.process_text(websocket, "xin chào", is_user_typed=True))
+    assert sent[-1]["event"] == "busy" and sent[-1]["reason"] == "llm"
+    assert _roles(websocket) == []
+
+
+def test_pool_busy_turn_leaves_history_unchanged(session, monkeypatch):
+    websocket, sent = session
+
+    async def busy_run(kind, fn, *args, **kwargs):
+        raise executor_module.ExecutorBusyError("llm pool is full")
+
+    monkeypatch.setattr(executor_module, "run", busy_run)
+    asyncio.run(server.process_text(websocket, "xin chào", is_user_typed=True))
+    assert sent[-1]["event"] == "busy" and sent[-1]["reason"] == "pool"
+    assert _roles(websocket) == []
+
+
+class FakeAudioSession:
+    sample_rate = 16000
+
+    def feed(self, frame):
+        return b"\x00" * 640 # Mỗi frame kết thúc một câu nói (VAD)
+
+
+def test_vad_turns_are_rate_limited(session, monkeypatch):
+    websocket, sent = session
+    submitted = []
+
+    async def fake_submit(ws, coro_factory):
+        submitted.append(coro_factory)
+
+    monkeypatch.setattr(server, "submit_turn", fake_submit)
+    monkeypatch.setitem(server.client_audio_sessions, websocket, FakeAudioSession())
+    monkeypatch.setitem(server.client_rate_limiters, websocket, server.admission_module.TokenBucket(rate=0.001, burst=2))
+    for _ in range(3):
+        asyncio.run(server.handle_audio_frame(websocket, b"\x00" * 640))
+    assert len(submitted) == 2
+    assert sent[-1]["event"] == "busy" and sent[-1]["reason"] == "rate_limit"
@@ -0,0 +1,104 @@
+# test_session_module.py
+# Kiểm thử các backend lưu phiên của session_module (memory, sqlite, kv). Chạy bằng: python -m pytest -q
+import asyncio
+import sqlite3
+import threading
+
+import pytest
+
+import session_module
+
+STATE = {"history": [{"role": "user", "parts": ["xin chào"]}], "summary": "", "options": {"stream": True}}
+
+
+def test_state_round_trip():
+    assert session_module.decode_state(session_module.encode_state(STATE)) == STATE
+
+
+def test_memory_store_evicts_least_recently_used():
+    size = len(session_module.encode_state(STATE))
+    store = session_module.MemorySessionStore(ttl=0, max_bytes=size * 2)
+    store.save("a", STATE)
+    store.save("b", STATE)
+    assert store.load("a") == STATE # "a" vừa được dùng: "b" bị xóa trước
+    store.save("c", STATE)
+    assert store.load("b") is None
+    assert store.load("a") == STATE and store.load("c") == STATE
+    assert store.evictions == 1 and store.size_bytes == size * 2
+
+
+def test_memory_store_expires_idle_sessions(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(session_module.time, "monotonic", lambda: now[0])
+    store = session_module.MemorySessionStore(ttl=60, max_bytes=1 << 20)
+    store.save("a", STATE)
+    now[0] += 61
+    assert store.load("a") is None and len(store) == 0
+
+
+def test_sqlite_store_round_trip_and_expiry(tmp_path, monkeypatch):
+    store = session_module.SQLiteSessionStore(path=str(tmp_path / "sessions.db"), ttl=60)
+    store.save("a", STATE)
+    assert store.load("a") == STATE
+    store.delete("a")
+    assert store.load("a") is None
+
+    store.save("b", STATE)
+    real_time = session_module.time.time
+    monkeypatch.setattr(session_module.time, "time", lambda: real_time() + 120)
+    assert store.load("b") is None
+    store.close()
+
+
+def test_sqlite_close_closes_connections_of_all_threads(tmp_path):
+    store = session_module.SQLiteSessionStore(path=str(tmp_path / "sessions.db"), ttl=0)
+    saved, closed = threading.Event(), threading.Event()
+    errors = []
+
+    def worker():
+        store.save("from-thread", STATE)
+        conn = store._connection()
+        saved.set()
+        closed.wait(5)
+        try:
+            conn.execute("SELECT 1")
+        except sqlite3.ProgrammingError as e: # Kết nối của thread này đã bị đóng
+            errors.append(e)
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    saved.wait(5)
+    store.close() # Gọi từ thread khác với thread đã mở kết nối
+    closed.set()
+    thread.join(5)
+    assert len(errors) == 1
+    assert store.load("from-thread") == STATE # Dùng lại sau close(): mở kết nối mới
+    store.close()
+
+
+@pytest.fixture
+def kv_server():
+    loop = asyncio.new_event_loop()
+    server = session_module.LocalKVServer(port=0)
+    loop.run_until_complete(server.start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield server
+    asyncio.run_coroutine_threadsafe(server.stop(), loop).result(5)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+    loop.close()
+
+
+def test_kv_store_round_trip(kv_server):
+    store = session_module.KVSessionStore(host=kv_server.host, port=kv_server.port, ttl=60)
+    assert store.execute("PING") == "PONG"
+    store.save("a", STATE)
+    assert store.load("a") == STATE
+    store.delete("a")
+    assert store.load("a") is None
+
+    store._sock.close() # Kết nối bị đứt: lệnh sau tự kết nối lại
+    store.save("b", STATE)
+    assert store.load("b") == STATE
+    store.close()
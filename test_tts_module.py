@@ -0,0 +1,87 @@
+# test_tts_module.py
+# Kiểm thử cache âm thanh trên đĩa của tts_module (không gọi gTTS). Chạy bằng: python -m pytest -q
+import os
+
+import pytest
+
+import config
+import tts_module
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "TTS_CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def _write(directory, name, size, mtime):
+    path = directory / name
+    path.write_bytes(b"x" * size)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_disk_limit_removes_least_recently_used(cache_dir, monkeypatch):
+    monkeypatch.setattr(config, "TTS_CACHE_MAX_BYTES", 250)
+    oldest = _write(cache_dir, "a.mp3", 100, 1_000)
+    middle = _write(cache_dir, "b.mp3", 100, 2_000)
+    newest = _write(cache_dir, "c.mp3", 100, 3_000)
+    tts_module._enforce_disk_limit()
+    assert not oldest.exists()
+    assert middle.exists() and newest.exists()
+
+
+def test_disk_limit_skips_files_removed_concurrently(cache_dir, monkeypatch):
+    monkeypatch.setattr(config, "TTS_CACHE_MAX_BYTES", 150)
+    vanished = _write(cache_dir, "a.mp3", 100, 1_000)
+    _write(cache_dir, "b.mp3", 100, 2_000)
+    _write(cache_dir, "c.mp3", 100, 3_000)
+    real_scandir = os.scandir
+
+    def scandir_then_remove(path):
+        entries = list(real_scandir(path))
+        vanished.unlink() # Thread/tiến trình khác dọn cache giữa scandir và stat
+        return entries
+
+    monkeypatch.setattr(tts_module.os, "scandir", scandir_then_remove)
+    tts_module._enforce_disk_limit()
+    assert sorted(p.name for p in cache_dir.iterdir()) == ["c.mp3"]
+
+
+def test_store_and_load_round_trip(cache_dir):
+    key = tts_module._cache_key("xin chào", "vi", False)
+    tts_module._store_on_disk(key, b"mp3-bytes")
+    assert tts_module._load_from_disk(key) == b"mp3-bytes"
+    assert tts_module._load_from_disk(tts_module._cache_key("khác", "vi", False)) is None
+
+
+def test_sentence_buffer_emits_complete_sentences_as_text_arrives():
+    buffer = tts_module.SentenceBuffer(max_chars=200, min_chars=10)
+    assert buffer.feed("Xin chào") == []
+    assert buffer.feed(" bạn. Hôm nay") == ["Xin chào bạn."]
+    assert buffer.feed(" trời đẹp! Bạn cần") == ["Hôm nay trời đẹp!"]
+    assert buffer.feed(" gì") == []
+    assert buffer.flush() == ["Bạn cần gì"]
+    assert buffer.flush() == []
+
+
+def test_sentence_buffer_waits_for_whitespace_after_punctuation():
+    buffer = tts_module.SentenceBuffer(max_chars=200, min_chars=5)
+    assert buffer.feed("Giá là 25.") == [] # Có thể là 25.000: chưa cắt
+    assert buffer.feed("000 đồng. Còn") == ["Giá là 25.000 đồng."]
+    assert buffer.flush() == ["Còn"]
+
+
+def test_split_sentences_at_punctuation_followed_by_space():
+    text = "Sữa tươi giá 30.000 đồng. Bạn muốn mua mấy hộp?\n- Bánh quy: 45.000đ"
+    assert tts_module.split_sentences(text, max_chars=200, min_chars=10) == [ # "Bánh quy:" ngắn: gộp với đoạn sau
+        "Sữa tươi giá 30.000 đồng.", "Bạn muốn mua mấy hộp?", "Bánh quy: 45.000đ",
+    ]
+
+
+def test_split_sentences_splits_long_sentences_at_commas_and_merges_short_ones():
+    text = "Dạ. Câu này dài hơn nhiều, có dấu phẩy, và còn nữa."
+    assert tts_module.split_sentences(text, max_chars=25, min_chars=5) == [
+        "Dạ. Câu này dài hơn nhiều,", "có dấu phẩy, và còn nữa.",
+    ]
+    assert tts_module.split_sentences("", max_chars=25, min_chars=5) == []
@@ -1,9 +1,117 @@
 # tts_module.py
-from gtts import gTTS
+# gTTS và playsound chỉ được import khi tổng hợp/phát lần đầu (server thường chỉ đọc cache hoặc không bật TTS)
 import os
-from playsound import playsound
-import tempfile # Để tạo file tạm an toàn hơn
+import io
+import hashlib
+import queue
+import re
+import threading
+import time
+import tempfile # Chỉ dùng khi tắt cache trên đĩa
+import config
+import cache_module
+import metrics_module
 
+# Cache âm thanh theo nội dung (text, lang, slow): tầng bộ nhớ (LRU) và tầng đĩa (giới hạn dung lượng)
+_memory_cache = cache_module.TTLCache(config.TTS_MEMORY_CACHE_SIZE)
+_disk_lock = threading.Lock()
+
+def _cache_key(text, lang, slow):
+    return hashlib.sha256(f"{lang}\x00{int(bool(slow))}\x00{text}".encode("utf-8")).hexdigest()
+
+def _disk_path(key):
+    return os.path.join(config.TTS_CACHE_DIR, f"{key}.mp3")
+
+def _enforce_disk_limit():
+    """Xóa các file ít được dùng nhất khi thư mục cache vượt TTS_CACHE_MAX_BYTES."""
+    try:
+        entries = [entry for entry in os.scandir(config.TTS_CACHE_DIR) if entry.name.endswith(".mp3")]
+    except FileNotFoundError:
+        return
+    stats = []
+    for entry in entries:
+        try:
+            stat = entry.stat()
+        except OSError: # File vừa bị tiến trình/thread khác xóa
+            continue
+        stats.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in stats)
+    for _, size, path in sorted(stats):
+        if total <= config.TTS_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+def _store_on_disk(key, audio):
+    path = _disk_path(key)
+    with _disk_lock:
+        os.makedirs(config.TTS_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.part"
+        with open(tmp_path, "wb") as fp:
+            fp.write(audio)
+        os.replace(tmp_path, path) # Ghi nguyên tử: không bao giờ đọc phải file dở dang
+        _enforce_disk_limit()
+    return path
+
+def _load_from_disk(key):
+    path = _disk_path(key)
+    try:
+        with open(path, "rb") as fp:
+            audio = fp.read()
+        os.utime(path) # Đánh dấu vừa được dùng (cho việc dọn cache theo LRU)
+        return audio
+    except OSError:
+        return None
+
+@metrics_module.timed("tts_synthesize")
+def synthesize(text_to_speak, lang='vi', slow=False):
+    """
+    Trả về âm thanh mp3 (bytes) cho văn bản. Tìm trong cache bộ nhớ, rồi cache đĩa,
+    cuối cùng mới gọi gTTS (tổng hợp thẳng vào bộ nhớ, không qua file tạm).
+    """
+    key = _cache_key(text_to_speak, lang, slow)
+    audio = _memory_cache.get(key, None)
+    if audio is not None:
+        return audio
+
+    if config.TTS_CACHE_DIR:
+        audio = _load_from_disk(key)
+    if audio is None:
+        from gtts import gTTS
+        buffer = io.BytesIO()
+        gTTS(text=text_to_speak, lang=lang, slow=slow).write_to_fp(buffer)
+        audio = buffer.getvalue()
+        if config.TTS_CACHE_DIR:
+            _store_on_disk(key, audio)
+    _memory_cache.set(key, audio)
+    return audio
+
+def _play(audio, key):
+    """Phát mp3. playsound chỉ nhận đường dẫn nên dùng file trong cache đĩa (nếu có)."""
+    from playsound import playsound
+    if config.TTS_CACHE_DIR:
+        path = _disk_path(key)
+        if not os.path.exists(path): # File có thể đã bị dọn khỏi cache đĩa
+            path = _store_on_disk(key, audio)
+        playsound(path)
+        return
+
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as fp:
+        fp.write(audio)
+        temp_filename = fp.name
+    try:
+        playsound(temp_filename)
+    finally:
+        os.remove(temp_filename) # Xóa file tạm sau khi phát
+
+def play(audio, text_to_speak, lang='vi', slow=False):
+    """Phát mp3 đã tổng hợp (kết quả synthesize) của `text_to_speak`, chặn cho đến khi phát xong."""
+    _play(audio, _cache_key(text_to_speak, lang, slow))
+
+@metrics_module.timed("tts_speak")
 def speak(text_to_speak, lang='vi', slow=False):
     """
     Chuyển văn bản thành giọng nói và phát ra loa.
@@ -18,15 +126,8 @@ def speak(text_to_speak, lang='vi', slow=False):
 
     try:
         # print(f"TTS: Đang chuẩn bị nói: '{text_to_speak[:50]}...'") # In một phần để debug
-        tts = gTTS(text=text_to_speak, lang=lang, slow=slow)
-        
-        # Sử dụng tempfile để tạo file tạm
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as fp:
-            temp_filename = fp.name
-        
-        tts.save(temp_filename)
-        playsound(temp_filename)
-        os.remove(temp_filename) # Xóa file tạm sau khi phát
+        audio = synthesize(text_to_speak, lang=lang, slow=slow)
+        _play(audio, _cache_key(text_to_speak, lang, slow))
         # print("TTS: Đã nói xong.") # Bỏ comment nếu muốn debug chi tiết
 
     except ImportError:
@@ -36,10 +137,208 @@ def speak(text_to_speak, lang='vi', slow=False):
         print(f"Lỗi TTS: {e}")
         print("Không thể phát âm thanh. Đảm bảo bạn có kết nối internet (cho gTTS) và cấu hình âm thanh hoạt động.")
 
+# Tách câu theo dấu câu tiếng Việt: chỉ cắt khi sau dấu là khoảng trắng,
+# nên số như "25.000" hay "1,5" không bị cắt.
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?…;:])\s+|\n+")
+_CLAUSE_BOUNDARY = re.compile(r"(?<=,)\s+")
+
+def split_sentences(text, max_chars=None, min_chars=None):
+    """
+    Chia văn bản thành các câu/mệnh đề để tổng hợp giọng nói lần lượt.
+    Câu dài hơn max_chars được chia tiếp tại dấu phẩy; đoạn ngắn hơn min_chars được gộp với đoạn sau.
+    """
+    max_chars = config.TTS_CHUNK_MAX_CHARS if max_chars is None else max_chars
+    min_chars = config.TTS_CHUNK_MIN_CHARS if min_chars is None else min_chars
+    pieces = []
+    for sentence in _SENTENCE_BOUNDARY.split(text or ""):
+        sentence = sentence.strip(" -*•\t")
+        if not sentence:
+            continue
+        if len(sentence) <= max_chars:
+            pieces.append(sentence)
+            continue
+        current = ""
+        for clause in _CLAUSE_BOUNDARY.split(sentence):
+            if current and len(current) + 1 + len(clause) > max_chars:
+                pieces.append(current)
+                current = clause
+            else:
+                current = f"{current} {clause}" if current else clause
+        if current:
+            pieces.append(current)
+
+    chunks = []
+    for piece in pieces:
+        if chunks and len(chunks[-1]) < min_chars:
+            chunks[-1] = f"{chunks[-1]} {piece}"
+        else:
+            chunks.append(piece)
+    return chunks
+
+class SentenceBuffer:
+    """
+    Gom văn bản đến dần (ví dụ các chat_delta của Gemini) và trả ra các câu đã trọn vẹn để đọc ngay,
+    không phải chờ hết câu trả lời. feed() chỉ cắt tại ranh giới câu đã thấy khoảng trắng phía sau;
+    flush() trả về phần còn lại khi văn bản kết thúc.
+    """
+
+    def __init__(self, max_chars=None, min_chars=None):
+        self.max_chars = max_chars
+        self.min_chars = config.TTS_CHUNK_MIN_CHARS if min_chars is None else min_chars
+        self._text = ""
+
+    def feed(self, text):
+        self._text += text or ""
+        boundary = None
+        for boundary in _SENTENCE_BOUNDARY.finditer(self._text):
+            pass
+        if boundary is None or len(self._text[:boundary.start()].strip()) < self.min_chars:
+            return []
+        ready, self._text = self._text[:boundary.start()], self._text[boundary.end():]
+        return split_sentences(ready, max_chars=self.max_chars, min_chars=self.min_chars)
+
+    def flush(self):
+        text, self._text = self._text, ""
+        return split_sentences(text, max_chars=self.max_chars, min_chars=self.min_chars)
+
+_PIPELINE_END = object()
+
+class SpeechPipeline:
+    """
+    Nói một câu trả lời dài theo từng câu: trong khi câu hiện tại đang phát,
+    một thread nền tổng hợp trước các câu tiếp theo vào hàng đợi có giới hạn.
+    cancel() dừng cả tổng hợp lẫn phát (barge-in); câu đang phát dở sẽ phát nốt
+    vì playsound không dừng giữa chừng được.
+    """
+
+    def __init__(self, text, lang='vi', slow=False, lookahead=None):
+        self.lang = lang
+        self.slow = slow
+        self.chunks = split_sentences(text)
+        lookahead = config.TTS_PIPELINE_LOOKAHEAD if lookahead is None else lookahead
+        self._queue = queue.Queue(maxsize=max(lookahead, 1))
+        self._cancelled = threading.Event()
+        self._done = threading.Event()
+        self._producer = None
+        self.started_at = None
+        self.first_audio_at = None # Thời điểm câu đầu tiên sẵn sàng (đo time-to-first-audio)
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def time_to_first_audio(self):
+        if self.started_at is None or self.first_audio_at is None:
+            return None
+        return self.first_audio_at - self.started_at
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _put(self, item):
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        try:
+            for chunk in self.chunks:
+                if self._cancelled.is_set():
+                    break
+                try:
+                    audio = synthesize(chunk, lang=self.lang, slow=self.slow)
+                except Exception as e:
+                    print(f"Lỗi TTS: {e}")
+                    continue
+                if not self._put((chunk, audio)):
+                    break
+        finally:
+            self._put(_PIPELINE_END)
+
+    def audio_chunks(self):
+        """Generator trả về (câu, mp3 bytes) theo thứ tự, ngay khi từng câu được tổng hợp xong."""
+        if self._producer is None:
+            self.started_at = time.monotonic()
+            self._producer = threading.Thread(target=self._produce, name="tts-pipeline", daemon=True)
+            self._producer.start()
+        finished = False
+        try:
+            while not self._cancelled.is_set():
+                try:
+                    item = self._queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _PIPELINE_END:
+                    finished = True
+                    break
+                if self.first_audio_at is None:
+                    self.first_audio_at = time.monotonic()
+                yield item
+        finally:
+            if not finished:
+                self.cancel() # Dừng thread tổng hợp nếu phía tiêu thụ dừng sớm
+            self._done.set()
+
+    def play(self):
+        """Phát lần lượt từng câu ra loa (chặn cho đến khi xong hoặc bị hủy)."""
+        try:
+            for chunk, audio in self.audio_chunks():
+                if self._cancelled.is_set():
+                    break
+                _play(audio, _cache_key(chunk, self.lang, self.slow))
+        except Exception as e:
+            print(f"Lỗi TTS: {e}")
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+def speak_pipelined(text_to_speak, lang='vi', slow=False, background=False):
+    """
+    Như speak(), nhưng chia câu và tổng hợp câu sau trong khi câu trước đang phát.
+    background=True: phát trong thread nền và trả về ngay SpeechPipeline để có thể cancel()/wait().
+    """
+    pipeline = SpeechPipeline(text_to_speak, lang=lang, slow=slow)
+    if not pipeline.chunks:
+        print("TTS: Không có văn bản để nói.")
+        pipeline._done.set()
+        return pipeline
+    if background:
+        threading.Thread(target=pipeline.play, name="tts-playback", daemon=True).start()
+    else:
+        pipeline.play()
+    return pipeline
+
+def prewarm(phrases, lang='vi', slow=False, background=True):
+    """
+    Tổng hợp trước các câu hay dùng (lời chào, tạm biệt, thông báo lỗi) vào cache
+    để khi cần nói thì phát ngay, không phải gọi mạng.
+    """
+    def warm():
+        for phrase in phrases:
+            try:
+                synthesize(phrase, lang=lang, slow=slow)
+            except Exception as e:
+                print(f"TTS: Không thể tổng hợp trước '{phrase[:30]}': {e}")
+
+    if not background:
+        warm()
+        return None
+    thread = threading.Thread(target=warm, name="tts-prewarm", daemon=True)
+    thread.start()
+    return thread
+
+def cache_stats():
+    return _memory_cache.stats()
+
 if __name__ == '__main__':
     # Test thử module
     print("Bắt đầu thử nghiệm TTS...")
     speak("Xin chào, đây là module chuyển văn bản thành giọng nói.")
     speak("Chúc bạn một ngày tốt lành!", lang='vi')
     # speak("Hello, this is a test in English.", lang='en')
-    print("Kết thúc thử nghiệm TTS.")
\ No newline at end of file
+    print("Kết thúc thử nghiệm TTS.")
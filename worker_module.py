@@ -0,0 +1,117 @@
+# worker_module.py
+# Chạy server trên nhiều tiến trình: mỗi worker có asyncio loop, MongoClient và model Gemini riêng
+# (tạo sau khi fork), cùng nhận kết nối trên một cổng. Tiến trình cha chỉ giám sát và khởi động lại worker bị chết.
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+
+def reuse_port_supported():
+    return hasattr(socket, "SO_REUSEPORT")
+
+
+def create_listening_socket(host, port, backlog=1024):
+    """
+    Socket nghe dùng chung khi hệ điều hành không có SO_REUSEPORT:
+    tiến trình cha bind một lần, các worker (fork) thừa kế và cùng accept trên socket này.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+def _worker_entry(target, worker_id, args):
+    # Tiến trình con thừa kế signal handler của supervisor qua fork: trả về mặc định trước khi chạy worker
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    target(worker_id, *args)
+
+
+class WorkerSupervisor:
+    """
+    Khởi động `workers` tiến trình chạy target(worker_id, *args) và khởi động lại tiến trình nào thoát.
+    Worker chết ngay sau khi khởi động (lỗi cấu hình, mất kết nối...) được khởi động lại với độ trễ tăng dần.
+    """
+
+    STABLE_SECONDS = 10 # Worker chạy lâu hơn mức này được coi là ổn định, độ trễ khởi động lại được đặt lại
+
+    def __init__(self, target, workers, args=(), restart_delay=1.0, max_restart_delay=30.0):
+        self.target = target
+        self.workers = workers
+        self.args = args
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self._context = multiprocessing.get_context("fork")
+        self._processes = [None] * workers
+        self._started_at = [0.0] * workers
+        self._delays = [restart_delay] * workers
+        self._next_start = [0.0] * workers
+        self._stopping = False
+        self.restarts = 0
+
+    def _start(self, worker_id):
+        process = self._context.Process(
+            target=_worker_entry, args=(self.target, worker_id, self.args), name=f"server-worker-{worker_id}", daemon=False
+        )
+        process.start()
+        self._processes[worker_id] = process
+        self._started_at[worker_id] = time.monotonic()
+        logging.info(f"Worker {worker_id} started (pid {process.pid}).")
+
+    def _check(self, worker_id):
+        process = self._processes[worker_id]
+        now = time.monotonic()
+        if process is not None:
+            if process.is_alive():
+                return
+            process.join()
+            uptime = now - self._started_at[worker_id]
+            logging.error(f"Worker {worker_id} (pid {process.pid}) exited with code {process.exitcode} after {uptime:.1f}s.")
+            self._processes[worker_id] = None
+            if uptime >= self.STABLE_SECONDS:
+                self._delays[worker_id] = self.restart_delay
+            self._next_start[worker_id] = now + self._delays[worker_id]
+            self._delays[worker_id] = min(self._delays[worker_id] * 2, self.max_restart_delay)
+            return
+        if now >= self._next_start[worker_id]:
+            self.restarts += 1
+            self._start(worker_id)
+
+    def stop(self, signum=None, frame=None):
+        self._stopping = True
+
+    def run(self):
+        """Chặn cho đến khi nhận SIGINT/SIGTERM, rồi dừng tất cả worker."""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        logging.info(f"Supervisor (pid {os.getpid()}) starting {self.workers} workers.")
+        for worker_id in range(self.workers):
+            self._start(worker_id)
+        try:
+            while not self._stopping:
+                time.sleep(0.5)
+                for worker_id in range(self.workers):
+                    if not self._stopping:
+                        self._check(worker_id)
+        finally:
+            self._shutdown()
+
+    def _shutdown(self, timeout=10.0):
+        logging.info("Stopping workers...")
+        processes = [process for process in self._processes if process is not None]
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in processes:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                process.kill()
+                process.join()
+        logging.info("All workers stopped.")